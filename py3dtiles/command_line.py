@@ -1,6 +1,6 @@
 import argparse
 
-from py3dtiles import convert, export, info, merger
+from py3dtiles import convert, export, info, merger, worker
 
 
 def main():
@@ -14,7 +14,8 @@ def main():
         convert.init_parser(sub_parsers),
         info.init_parser(sub_parsers),
         merger.init_parser(sub_parsers),
-        export.init_parser(sub_parsers)
+        export.init_parser(sub_parsers),
+        worker.init_parser(sub_parsers)
     ]
     # add the verbose argument for all sub-parsers so that it is after the command.
     for command_parser in command_parsers:
@@ -30,6 +31,8 @@ def main():
         merger.main(args)
     elif args.command == 'export':
         export.main(args)
+    elif args.command == 'worker':
+        worker.main(args)
     else:
         parser.print_help()
 
@@ -1,8 +1,9 @@
 import argparse
 from collections import namedtuple
 import concurrent.futures
+import functools
 import json
-from multiprocessing import cpu_count, Process
+from multiprocessing import cpu_count, Process, resource_tracker
 import os
 from pathlib import Path, PurePath
 import pickle
@@ -11,7 +12,7 @@ import struct
 import sys
 import time
 import traceback
-from typing import List, Optional, Union
+from typing import List, Optional, Tuple, Union
 
 import numpy as np
 import psutil
@@ -19,21 +20,39 @@ from pyproj import CRS, Transformer
 import zmq
 
 from py3dtiles.exceptions import SrsInMissingException, SrsInMixinException, WorkerException
-from py3dtiles.reader import las_reader, xyz_reader
+from py3dtiles.reader import array_reader, copc_reader, las_reader, npy_reader, ply_reader, xyz_reader
+from py3dtiles.reader.array_reader import ArraySource
+from py3dtiles.reprojection import InterpolatedTransformer
+from py3dtiles.scheduling import JobSizeController, NodeNameTrie, NodeScheduler
 from py3dtiles.tilers.node import Node
 from py3dtiles.tilers.node import node_process
 from py3dtiles.tilers.node import SharedNodeStore
+from py3dtiles.tilers.node import sort_builder
+from py3dtiles.tilers.node.node import MAX_LEAF_POINT_COUNT
 from py3dtiles.tilers.pnts import pnts_writer
 from py3dtiles.tilers.pnts.constants import MIN_POINT_SIZE
 from py3dtiles.tilers.transformations import (
     angle_between_vectors, inverse_matrix, rotation_matrix, scale_matrix, translation_matrix, vector_product
 )
 from py3dtiles.tileset.utils import TileContentReader
-from py3dtiles.utils import CommandType, compute_spacing, node_name_to_path, ResponseType, str_to_CRS
+from py3dtiles.utils import (
+    CommandType, compute_spacing, decode_point_batch, encode_point_batch, get_frames_size, get_point_batch_count,
+    node_name_to_path, release_point_batch, ResponseType, share_point_batch, str_to_CRS, TraceWriter
+)
 
 TOTAL_MEMORY_MB = int(psutil.virtual_memory().total / (1024 * 1024))
 DEFAULT_CACHE_SIZE = int(TOTAL_MEMORY_MB / 10)
+# approximate memory used by a point read but not processed yet, in the messages and the workers
+POINT_IN_PROGRESS_SIZE = 64
+# periods of the manager timers, in seconds
+MEMORY_CONTROL_INTERVAL = 0.5
+PROGRESS_INTERVAL = 0.5
 CPU_COUNT = cpu_count()
+# the engines building the tree: the points are inserted in the nodes as they are read,
+# or they are sorted first, then all the nodes are built from the bottom (see sort_builder)
+ENGINES = ('insert', 'sort')
+# approximate memory used by a point read and sorted in a run of the sort engine
+SORTED_POINT_SIZE = 96
 
 # IPC protocol is not supported on Windows
 if os.name == 'nt':
@@ -47,8 +66,42 @@ READER_MAP = {
     '.xyz': xyz_reader,
     '.las': las_reader,
     '.laz': las_reader,
+    '.copc.laz': copc_reader,
+    '.ply': ply_reader,
+    '.npy': npy_reader,
 }
 
+
+def get_extension(path: PurePath) -> str:
+    """
+    Get the extension of a file in READER_MAP, the COPC files have a double extension.
+    """
+    double_extension = ''.join(path.suffixes[-2:])
+    return double_extension if double_extension in READER_MAP else path.suffix
+
+
+def get_file_metadata(path: Path, color_scale: Optional[float], jobs: int = 1,
+                      cache_dir: Optional[Path] = None) -> dict:
+    """
+    Read the metadata of a point cloud file with the reader of its extension (see READER_MAP).
+
+    :param jobs: The number of processes scanning a xyz file, the whole file is read to find its bounds.
+    :param cache_dir: If set, the metadata are cached in this folder.
+    """
+    reader = READER_MAP[get_extension(path)]
+    if reader is xyz_reader:
+        return reader.get_metadata(path, color_scale=color_scale, jobs=jobs, cache_dir=cache_dir)
+    return reader.get_metadata(path, color_scale=color_scale, cache_dir=cache_dir)
+
+
+def get_file_key(file: Union[str, Path, ArraySource]) -> Union[str, ArraySource]:
+    """
+    Get the key of an input file in the metadata by file (e.g. the color scales). The names of the
+    ArraySource aren't unique, the sources are their own keys.
+    """
+    return file if isinstance(file, ArraySource) else str(file)
+
+
 def make_rotation_matrix(z1, z2):
     v0 = z1 / np.linalg.norm(z1)
     v1 = z2 / np.linalg.norm(z2)
@@ -58,37 +111,102 @@ def make_rotation_matrix(z1, z2):
         vector_product(v0, v1))
 
 
+class _WorkerSocket:
+    """
+    Wrap the socket of a worker to count the bytes sent through it. If shared_memory is True,
+    the point batches of the NEW_TASK messages are moved in shared memory segments, so that
+    only their handles go through the manager.
+    """
+    def __init__(self, socket, shared_memory: bool = False):
+        self.socket = socket
+        self.shared_memory = shared_memory
+        self.bytes_sent = 0
+
+    def send_multipart(self, frames, *args, **kwargs):
+        if self.shared_memory and frames[0] == ResponseType.NEW_TASK.value:
+            frames = frames[:2] + share_point_batch(frames[2:])
+        self.bytes_sent += get_frames_size(frames)
+        return self.socket.send_multipart(frames, *args, **kwargs)
+
+
+def read_portion(parameters: dict, frames: list, queue, transformer) -> None:
+    """
+    Read a portion of a file, or the points of an ArraySource sent in the frames, and send them to the queue.
+
+    :param parameters: The parameters of the reading (see _Convert.get_read_parameters).
+    """
+    if frames:
+        array_reader.run(
+            frames,
+            parameters['rgb_dtype'],
+            parameters['offset_scale'],
+            queue,
+            transformer,
+            parameters['batch_size'],
+        )
+        return
+
+    extension = get_extension(PurePath(parameters['filename']))
+    if extension in READER_MAP:
+        reader = READER_MAP[extension]
+    else:
+        raise ValueError(f"The file with {extension} extension can't be read, "
+                         f"the available extensions are: {READER_MAP.keys()}")
+
+    reader.run(
+        parameters['filename'],
+        parameters['offset_scale'],
+        parameters['portion'],
+        queue,
+        transformer,
+        parameters['batch_size'],
+    )
+
+
 class Worker(Process):
     """
     This class waits from jobs commands from the Zmq socket.
+
+    A worker without octree_metadata is a remote worker: it registers to the manager
+    and gets the conversion parameters from it. If its folder is set, it overrides the
+    output folder of the manager (e.g. the same shared folder mounted on another path).
+
+    If trace is True, the IDLE messages contain the span of the finished job, as JSON.
+    If shared_memory is True, the points sent by the worker are in shared memory segments (see share_point_batch),
+    the worker must then be on the same host as the manager and the other workers.
     """
-    def __init__(self, activity_graph, transformer, octree_metadata, folder: Path, write_rgb, verbosity, uri):
+    def __init__(self, trace, transformer, octree_metadata, folder: Path, write_rgb, overwrite_pnts, shared_memory,
+                 verbosity, uri):
         super().__init__()
-        self.activity_graph = activity_graph
+        self.trace = trace
         self.transformer = transformer
         self.octree_metadata = octree_metadata
         self.folder = folder
         self.write_rgb = write_rgb
+        self.overwrite_pnts = overwrite_pnts
+        self.shared_memory = shared_memory
         self.verbosity = verbosity
         self.uri = uri
 
         # Socket to receive messages on
         self.context = zmq.Context()
         self.skt = None
+        self.sender = None
 
     def run(self):
         self.skt = self.context.socket(zmq.DEALER)
 
         self.skt.connect(self.uri)
+        self.sender = _WorkerSocket(self.skt, self.shared_memory)
 
         startup_time = time.time()
         idle_time = 0
 
-        if self.activity_graph:
-            activity = open(f'activity.{os.getpid()}.csv', 'w')
-
-        # notify we're ready
-        self.skt.send_multipart([ResponseType.IDLE.value])
+        # notify we're ready, or that we need to be configured first
+        if self.octree_metadata is None:
+            self.skt.send_multipart([ResponseType.REGISTER.value])
+        else:
+            self.skt.send_multipart([ResponseType.IDLE.value])
 
         while True:
             try:
@@ -98,36 +216,42 @@ class Worker(Process):
 
                 idle_time += after - before
 
-                message = self.skt.recv_multipart()
+                # point batches are received without copy, so they can be used in place
+                message = self.skt.recv_multipart(copy=False)
                 content = message[1:]
-                command = content[0]
+                command = content[0].bytes
 
-                delta = time.time() - pickle.loads(message[0])
+                delta = time.time() - pickle.loads(message[0].bytes)
                 if delta > 0.01 and self.verbosity >= 1:
                     print(f'{os.getpid()} / {round(after, 2)} : Delta time: {round(delta, 3)}')
 
-                if command == CommandType.READ_FILE.value:
-                    self.execute_read_file(content)
-                    command_type = 1
+                job_start = time.time()
+                self.sender.bytes_sent = 0
+                if command == CommandType.CONFIGURE.value:
+                    span = self.execute_configure(content)
+                elif command == CommandType.READ_FILE.value:
+                    span = self.execute_read_file(content)
                 elif command == CommandType.PROCESS_JOBS.value:
-                    self.execute_process_jobs(content)
-                    command_type = 2
+                    span = self.execute_process_jobs(content)
                 elif command == CommandType.WRITE_PNTS.value:
-                    self.execute_write_pnts(content)
-                    command_type = 3
+                    span = self.execute_write_pnts(content)
                 elif command == CommandType.SHUTDOWN.value:
                     break  # ack
                 else:
                     raise NotImplementedError(f'Unknown command {command}')
 
                 # notify we're idle
-                self.skt.send_multipart([ResponseType.IDLE.value])
-
-                if self.activity_graph:
-                    print(f'{before}, {command_type}', file=activity)
-                    print(f'{before}, 0', file=activity)
-                    print(f'{after}, 0', file=activity)
-                    print(f'{after}, {command_type}', file=activity)
+                if self.trace:
+                    span.update({
+                        'name': command.decode(),
+                        'pid': os.getpid(),
+                        'start': job_start,
+                        'duration': time.time() - job_start,
+                    })
+                    span['args'].update(bytes_in=get_frames_size(content), bytes_out=self.sender.bytes_sent)
+                    self.skt.send_multipart([ResponseType.IDLE.value, json.dumps(span).encode()])
+                else:
+                    self.skt.send_multipart([ResponseType.IDLE.value])
             except Exception as e:
                 traceback.print_exc()
                 # usually first arg is the explaining string.
@@ -135,9 +259,6 @@ class Worker(Process):
                 self.skt.send_multipart([ResponseType.ERROR.value, e.args[0].encode()])
                 # we still print it for stacktraces
 
-        if self.activity_graph:
-            activity.close()
-
         if self.verbosity >= 1:
             print('total: {} sec, idle: {}'.format(
                 round(time.time() - startup_time, 1),
@@ -146,35 +267,56 @@ class Worker(Process):
 
         self.skt.send_multipart([ResponseType.HALTED.value])
 
+    # The execute methods return the span of the job: a dict with its args,
+    # and optionally the spans of its steps in children.
+
+    def execute_configure(self, content):
+        config = pickle.loads(content[1].bytes)
+        self.trace = config['trace']
+        self.transformer = config['transformer']
+        self.octree_metadata = config['octree_metadata']
+        if self.folder is None:
+            self.folder = Path(config['folder'])
+        self.write_rgb = config['rgb']
+        self.overwrite_pnts = config['overwrite_pnts']
+        return {'args': {}}
+
     def execute_read_file(self, content):
-        parameters = pickle.loads(content[1])
+        parameters = pickle.loads(content[1].bytes)
+        portion = parameters['portion']
 
-        extension = PurePath(parameters['filename']).suffix
-        if extension in READER_MAP:
-            reader = READER_MAP[extension]
-        else:
-            raise ValueError(f"The file with {extension} extension can't be read, "
-                             f"the available extensions are: {READER_MAP.keys()}")
+        # the points of an ArraySource are sent with the job
+        read_portion(parameters, content[2:], self.sender, self.transformer)
 
-        reader.run(
-            parameters['filename'],
-            parameters['offset_scale'],
-            parameters['portion'],
-            self.skt,
-            self.transformer
-        )
+        return {'args': {'filename': parameters['filename'], 'portion': portion[:2], 'points': portion[1] - portion[0]}}
 
     def execute_write_pnts(self, content):
-        pnts_writer.run(self.skt, content[2], content[1], self.folder, self.write_rgb)
+        point_count = pnts_writer.run(
+            self.sender, content[2].bytes, content[1].bytes, self.folder, self.write_rgb, self.overwrite_pnts
+        )
+        return {'args': {'node': content[1].bytes.decode('ascii'), 'points': point_count}}
 
     def execute_process_jobs(self, content):
+        nodes = []
         node_process.run(
             content[1:],
             self.octree_metadata,
-            self.skt,
-            self.verbosity
+            self.sender,
+            self.verbosity,
+            nodes if self.trace else None
         )
 
+        children = []
+        args = {'nodes': [], 'points': 0, 'kept_points': 0, 'pickle': 0, 'insert': 0, 'flush': 0, 'balance': 0}
+        for node in nodes:
+            children.append({
+                'name': node.pop('name'), 'start': node.pop('start'), 'duration': node.pop('duration'), 'args': node
+            })
+            args['nodes'].append(children[-1]['name'])
+            for key, value in node.items():
+                args[key] += value
+        return {'args': args, 'children': children}
+
 
 # Manager
 class ZmqManager:
@@ -182,17 +324,22 @@ class ZmqManager:
     This class sends messages to the workers.
     We can also request general status.
     """
-    def __init__(self, number_of_jobs: int, process_args: tuple):
+    def __init__(self, number_of_jobs: int, process_args: tuple, uri: str = URI,
+                 job_timeout: Optional[float] = None):
         """
         For the process_args argument, see the init method of Worker
         to get the list of needed parameters.
+        Remote workers can also connect to uri, they are counted in number_of_jobs once registered.
+        If job_timeout is set, a worker that doesn't finish a job in job_timeout seconds
+        is considered dead (see check_job_timeout).
         """
         self.context = zmq.Context()
 
         self.number_of_jobs = number_of_jobs
+        self.job_timeout = job_timeout
 
         self.socket = self.context.socket(zmq.ROUTER)
-        self.socket.bind(URI)
+        self.socket.bind(uri)
         # Useful only when TCP is used to get the URI with the opened port
         self.uri = self.socket.getsockopt(zmq.LAST_ENDPOINT)
 
@@ -204,15 +351,20 @@ class ZmqManager:
 
         self.activities = [p.pid for p in self.processes]
         self.idle_clients = []
+        # client id -> (command, point count, start time) of the job sent to the client
+        self.jobs_in_progress = {}
 
         self.killing_processes = False
         self.number_processes_killed = 0
         self.time_waiting_an_idle_process = 0
 
-    def send_to_process(self, message):
+    def send_to_process(self, message, point_count=0):
         if not self.idle_clients:
             raise ValueError("idle_clients is empty")
-        self.socket.send_multipart([self.idle_clients.pop(), pickle.dumps(time.time())] + message)
+        client_id = self.idle_clients.pop()
+        now = time.time()
+        self.jobs_in_progress[client_id] = (message[0], point_count, now)
+        self.socket.send_multipart([client_id, pickle.dumps(now)] + message, copy=False)
 
     def send_to_all_idle_processes(self, message):
         if not self.idle_clients:
@@ -221,16 +373,43 @@ class ZmqManager:
             self.socket.send_multipart([client, pickle.dumps(time.time())] + message)
         self.idle_clients.clear()
 
+    def configure_remote_client(self, client_id, config: bytes):
+        now = time.time()
+        self.jobs_in_progress[client_id] = (CommandType.CONFIGURE.value, 0, now)
+        self.socket.send_multipart([client_id, pickle.dumps(now), CommandType.CONFIGURE.value, config])
+        self.number_of_jobs += 1
+
     def can_queue_more_jobs(self):
         return len(self.idle_clients) != 0
 
     def add_idle_client(self, client_id):
+        """
+        Returns the job finished by the client, if any, as a tuple (command, point count, start time).
+        """
         if client_id in self.idle_clients:
             raise ValueError(f"The client id {client_id} is already in idle_clients")
         self.idle_clients.append(client_id)
+        return self.jobs_in_progress.pop(client_id, None)
+
+    def check_job_timeout(self):
+        """
+        Raises a WorkerException if a job was sent more than job_timeout seconds ago.
+        A worker that dies (e.g. a remote host that is disconnected) never answers,
+        the conversion would otherwise wait for it forever.
+        """
+        if self.job_timeout is None:
+            return
+        now = time.time()
+        for client_id, (command, _, start_time) in self.jobs_in_progress.items():
+            if now - start_time > self.job_timeout:
+                raise WorkerException(
+                    f'The worker {client_id.hex()} did not finish its {command.decode()} job '
+                    f'in {self.job_timeout} seconds, it may have stopped'
+                )
 
     def are_all_processes_idle(self):
-        return len(self.idle_clients) == self.number_of_jobs
+        # without local worker, wait for the first remote worker
+        return self.number_of_jobs > 0 and len(self.idle_clients) == self.number_of_jobs
 
     def are_all_processes_killed(self):
         return self.number_processes_killed == self.number_of_jobs
@@ -257,8 +436,12 @@ def is_ancestor(node_name, ancestor):
 
 
 def is_ancestor_in_list(node_name, ancestors):
-    for ancestor in ancestors:
-        if not ancestor or is_ancestor(node_name, ancestor):
+    """
+    ancestors should be a set or a dict of node names, so that only the ancestors
+    of node_name are looked up.
+    """
+    for i in range(len(node_name) + 1):
+        if node_name[:i] in ancestors:
             return True
     return False
 
@@ -273,7 +456,10 @@ def can_pnts_be_written(node_name, finished_node, input_nodes, active_nodes):
 class State:
     def __init__(self, pointcloud_file_portions, max_reading_jobs: int):
         self.processed_points = 0
-        self.max_point_in_progress = 60_000_000
+        # the points read but not processed yet are kept in memory
+        self.max_point_in_progress = max(
+            5_000_000, psutil.virtual_memory().available // 4 // POINT_IN_PROGRESS_SIZE
+        )
         self.points_in_progress = 0
         self.points_in_pnts = 0
 
@@ -286,10 +472,11 @@ class State:
 
         # node_to_process is a dictionary of tasks,
         # each entry is a tile identified by its name (a string of numbers)
-        # so for each entry, it is a list of tasks
-        # a task is a tuple (list of points, point_count)
-        # points is a dictionary {xyz: list of coordinates, color: the associated color}
+        # so for each entry, it is a tuple (list of tasks, point_count)
+        # a task is the list of frames of a point batch (see encode_point_batch)
         self.node_to_process = {}
+        # the nodes of node_to_process that can be sent to a process, i.e. not in processing_nodes
+        self.scheduler = NodeScheduler()
         # when a node is sent to a process, the item moves to processing_nodes
         # the structure is different. The key remains the node name. But the value is : (len(tasks), point_count, now)
         # these values is for loging
@@ -297,15 +484,74 @@ class State:
         # when processing is finished, move the tile name in processed_nodes
         # since the content is at this stage, stored in the node_store,
         # just keep the name of the node.
-        # This list will be filled until the writing could be started.
-        self.waiting_writing_nodes = []
+        # This set will be filled until the writing could be started.
+        self.waiting_writing_nodes = NodeNameTrie()
         # when the node is writing, its name is moved from waiting_writing_nodes to pnts_to_writing
         # the data to write are stored in a node object.
         self.pnts_to_writing = []
+        # the names of the nodes written to pnts
+        self.written_nodes = set()
 
     def is_reading_finish(self):
         return not self.point_cloud_file_parts and self.number_of_reading_jobs == 0
 
+    def is_idle(self):
+        return (
+            self.number_of_reading_jobs == 0
+            and not self.processing_nodes
+            and self.number_of_writing_jobs == 0
+        )
+
+    def to_checkpoint(self) -> dict:
+        """
+        Export the state needed to resume the conversion. Should only be called
+        when no job is in progress (see is_idle).
+        """
+        if not self.is_idle():
+            raise ValueError("The state can't be saved while jobs are in progress")
+
+        return {
+            'processed_points': self.processed_points,
+            'points_in_progress': self.points_in_progress,
+            'points_in_pnts': self.points_in_pnts,
+            'point_cloud_file_parts': self.point_cloud_file_parts,
+            'initial_portion_count': self.initial_portion_count,
+            # the points of the shared batches are copied in the checkpoint, their segments don't survive a reboot
+            'node_to_process': {
+                name: (
+                    [[bytes(frame) for frame in encode_point_batch(*decode_point_batch(task, release=False))]
+                     for task in tasks],
+                    point_count
+                )
+                for name, (tasks, point_count) in self.node_to_process.items()
+            },
+            'waiting_writing_nodes': list(self.waiting_writing_nodes),
+            'pnts_to_writing': self.pnts_to_writing,
+            'written_nodes': self.written_nodes,
+        }
+
+    def load_checkpoint(self, checkpoint: dict):
+        self.processed_points = checkpoint['processed_points']
+        self.points_in_progress = checkpoint['points_in_progress']
+        self.points_in_pnts = checkpoint['points_in_pnts']
+        self.point_cloud_file_parts = checkpoint['point_cloud_file_parts']
+        self.initial_portion_count = checkpoint['initial_portion_count']
+        self.node_to_process = checkpoint['node_to_process']
+        self.scheduler = NodeScheduler()
+        for name, (_, point_count) in self.node_to_process.items():
+            self.scheduler.push(name, point_count)
+        self.waiting_writing_nodes = NodeNameTrie(checkpoint['waiting_writing_nodes'])
+        self.pnts_to_writing = checkpoint['pnts_to_writing']
+        self.written_nodes = checkpoint['written_nodes']
+
+    def release_tasks(self) -> None:
+        """
+        Release the point batches that won't be processed, e.g. when the conversion is interrupted.
+        """
+        for tasks, _ in self.node_to_process.values():
+            for task in tasks:
+                release_point_batch(task)
+
     def add_tasks_to_process(self, node_name, data, point_count):
         if point_count <= 0:
             raise ValueError("point_count should be strictly positive, currently", point_count)
@@ -317,6 +563,46 @@ class State:
             tasks.append(data)
             self.node_to_process[node_name] = (tasks, count + point_count)
 
+        # a key (=task) can be in node_to_process and processing_nodes if the node isn't completely processed,
+        # it will be scheduled once processed
+        if node_name not in self.processing_nodes:
+            self.scheduler.push(node_name, self.node_to_process[node_name][1])
+
+    def start_processing(self, node_name, now):
+        tasks, point_count = self.node_to_process.pop(node_name)
+        self.processing_nodes[node_name] = (len(tasks), point_count, now)
+        return tasks, point_count
+
+    def is_pending(self, node_name):
+        return node_name in self.node_to_process or node_name in self.processing_nodes
+
+    def end_processing(self, node_name):
+        del self.processing_nodes[node_name]
+        if node_name in self.node_to_process:
+            self.scheduler.push(node_name, self.node_to_process[node_name][1])
+
+    def add_processed_node(self, finished_node):
+        """
+        Add a processed node to the nodes waiting to be written,
+        then move the nodes that can be written to pnts_to_writing.
+        """
+        if finished_node:
+            self.waiting_writing_nodes.add(finished_node)
+
+        if not self.is_reading_finish():
+            return
+
+        # if all nodes aren't processed yet,
+        # we should check if linked ancestors are processed
+        if self.processing_nodes or self.node_to_process:
+            if can_pnts_be_written(finished_node, finished_node, self.node_to_process, self.processing_nodes):
+                # the waiting descendants can be written too, unless one of their ancestors isn't processed yet
+                self.pnts_to_writing += self.waiting_writing_nodes.pop_descendants(finished_node, self.is_pending)
+
+        else:
+            self.pnts_to_writing += list(self.waiting_writing_nodes)
+            self.waiting_writing_nodes = NodeNameTrie()
+
     def can_add_reading_jobs(self):
         return (
             self.point_cloud_file_parts
@@ -349,7 +635,7 @@ def convert(*args, **kwargs):
 
 class _Convert:
     def __init__(self,
-                 files: List[Union[str, Path]],
+                 files: Union[str, Path, ArraySource, List[Union[str, Path, ArraySource]]],
                  outfolder: Union[str, Path] = './3dtiles',
                  overwrite: bool = False,
                  jobs: int = CPU_COUNT,
@@ -359,11 +645,22 @@ class _Convert:
                  fraction: int = 100,
                  benchmark: Optional[str] = None,
                  rgb: bool = True,
-                 graph: bool = False,
+                 trace: Optional[Union[str, Path]] = None,
                  color_scale: Optional[float] = None,
-                 verbose: bool = False):
+                 checkpoint_interval: Optional[float] = None,
+                 resume: bool = False,
+                 append: bool = False,
+                 bind: Optional[str] = None,
+                 shared_memory: bool = False,
+                 metadata_cache: Optional[Union[str, Path]] = None,
+                 reprojection_max_error: Optional[float] = None,
+                 verbose: bool = False,
+                 engine: str = 'insert',
+                 job_timeout: Optional[float] = None):
         """
-        :param files: Filenames to process. The file must use the .las, .laz or .xyz format.
+        :param files: Filenames to process. The file must use the .las, .laz, .copc.laz, .xyz, .ply (binary)
+            or .npy format. Points in memory can be converted with an ArraySource (see py3dtiles.reader.array_reader) instead of a
+            filename, e.g. ArraySource(xyz, rgb, crs) or ArraySource.from_chunks(chunks, aabb, point_count, crs).
         :param outfolder: The folder where the resulting tileset will be written.
         :param overwrite: Overwrite the ouput folder if it already exists.
         :param jobs: The number of parallel jobs to start. Default to the number of cpu.
@@ -373,80 +670,191 @@ class _Convert:
         :param fraction: Percentage of the pointcloud to process, between 0 and 100.
         :param benchmark: Print summary at the end of the process
         :param rgb: Export rgb attributes.
-        :param graph: Produce debug graphs (requires pygal).
+        :param trace: If set, write a timeline of the jobs of the workers and of the manager in this file,
+            in the Chrome trace event format (it can be opened with Perfetto or chrome://tracing).
         :param color_scale: Force color scale
+        :param checkpoint_interval: If set, save a checkpoint of the conversion in the output folder
+            every checkpoint_interval seconds.
+        :param resume: Resume an interrupted conversion from the last checkpoint saved in the output folder.
+            The input files and the options must be the same as the interrupted conversion.
+        :param append: Add the points of the input files to the tileset of the output folder. The tileset
+            must have been created with append. If the output folder doesn't exist, a new tileset is created.
+            Only the tiles that receive new points are written again. The tileset keeps the bounds of its
+            first conversion, the new points out of these bounds are added to the border tiles.
+        :param bind: If set, remote workers (see py3dtiles.worker) can join the conversion by connecting to
+            this address, e.g. tcp://*:5555. They must have access to the input files and to the output folder.
+            jobs can then be 0 to only use remote workers.
+        :param shared_memory: Pass the points read and forwarded by the workers in shared memory segments
+            instead of copying them in the messages, the manager then only keeps handles to the points
+            waiting to be processed. Not available with remote workers.
+        :param metadata_cache: If set, the metadata of the input files (their bounds, point count, color scale
+            and CRS, the xyz files are read entirely to find them) are cached in this folder and reused by the
+            next conversions, as long as the files don't change.
+        :param reprojection_max_error: If set, the workers reproject the points approximately, by interpolating
+            them in a lattice of exactly reprojected points, with at most this error (in the unit of crs_out,
+            measured on a sample of the points). It's much faster than the exact reprojection of each point.
+        :param engine: How the tree is built: 'insert' inserts the points in the nodes as they are read,
+            'sort' writes the points sorted by node in runs in the output folder, then builds all the nodes
+            from the bottom while merging the runs. The sort engine reads each point once and keeps few nodes
+            in memory, the runs have about cache_size / jobs MB of points. It can't be used with bind,
+            shared_memory, trace, checkpoint_interval, resume, append or job_timeout.
+        :param job_timeout: If set, the conversion stops with a WorkerException when a worker doesn't finish
+            a job in job_timeout seconds, e.g. a remote worker whose host was disconnected. Otherwise the
+            conversion waits for it forever. It must be much longer than the longest job.
 
         :raises SrsInMissingException: if py3dtiles couldn't find srs informations in input files and srs_in is not specified
-        :raises SrsInMixinException: if the input files have different CRS
+        :raises SrsInMixinException: if the input files have different CRS, or a different CRS than the tileset
+            to append to
 
         """
+        if jobs < 1 and bind is None:
+            raise ValueError("jobs should be strictly positive if no remote worker can connect")
+        if shared_memory and bind is not None:
+            raise ValueError("The points can't be passed in shared memory to remote workers")
+        if reprojection_max_error is not None and crs_out is None:
+            raise ValueError("reprojection_max_error can only be used with crs_out")
+        if engine not in ENGINES:
+            raise ValueError(f"engine should be one of {', '.join(ENGINES)}, currently {engine}")
+        if engine == 'sort':
+            for option, is_set in [
+                ('bind', bind is not None), ('shared_memory', shared_memory), ('trace', trace is not None),
+                ('checkpoint_interval', checkpoint_interval is not None), ('resume', resume), ('append', append),
+                ('job_timeout', job_timeout is not None),
+            ]:
+                if is_set:
+                    raise ValueError(f"{option} can't be used with the sort engine")
+
         self.jobs = jobs
+        self.engine = engine
         self.cache_size = cache_size
+        self.metadata_cache = Path(metadata_cache) if metadata_cache is not None else None
         self.rgb = rgb
 
         # allow str directly if only one input
-        self.files = [files] if isinstance(files, str) or isinstance(files, Path) else files
-        self.files = [Path(file) for file in self.files]
+        self.files = [files] if isinstance(files, (str, Path, ArraySource)) else files
+        self.files = [file if isinstance(file, ArraySource) else Path(file) for file in self.files]
+        if (checkpoint_interval is not None or resume) and any(isinstance(file, ArraySource) for file in self.files):
+            raise ValueError("A conversion of points in memory (ArraySource) can't be resumed")
 
         self.verbose = verbose
-        self.graph = graph
+        self.trace = trace
+        self.trace_writer = None
+        self.shared_memory = shared_memory
         self.benchmark = benchmark
         self.startup = None
+        self.startup_cpu_time = None
+
+        self.out_folder = Path(outfolder)
+        self.working_dir = self.out_folder / "tmp"
+        self.append = append
+        # the sidecar of an appendable tileset, with the octree metadata and the node states
+        self.archive_dir = self.out_folder / "state"
+        self.archive = None
+        self.tile_aabbs = None
+        if append:
+            if resume:
+                raise ValueError("An append can't be resumed")
+            if not overwrite:
+                self.archive = self.load_archive()
+            if self.archive is not None and crs_in is None:
+                crs_in = self.archive['crs_in']
 
         self.file_info = self.get_file_info(color_scale, crs_in)
 
         transformer = self.get_transformer(crs_out)
-        self.rotation_matrix, self.original_aabb, self.avg_min = self.get_rotation_matrix(crs_out, transformer)
-        self.root_aabb, self.root_scale, self.root_spacing = self.get_root_aabb(self.original_aabb)
+        if self.archive is None:
+            self.rotation_matrix, self.original_aabb, self.avg_min = self.get_rotation_matrix(crs_out, transformer)
+            self.root_aabb, self.root_scale, self.root_spacing = self.get_root_aabb(self.original_aabb)
+        else:
+            self.check_archive_options(crs_out)
+            self.rotation_matrix = self.archive['rotation_matrix']
+            self.original_aabb = self.archive['original_aabb']
+            self.avg_min = self.archive['avg_min']
+            self.root_aabb = self.archive['root_aabb']
+            self.root_scale = self.archive['root_scale']
+            self.root_spacing = self.archive['root_spacing']
+        self.crs_out = crs_out
+        # the manager reprojects a few points exactly, the workers can reproject their points approximately
+        if reprojection_max_error is not None:
+            transformer = InterpolatedTransformer(transformer, reprojection_max_error)
+        self.transformer = transformer
         octree_metadata = OctreeMetadata(aabb=self.root_aabb, spacing=self.root_spacing, scale=self.root_scale[0])
 
         if self.verbose >= 1:
             self.print_summary()
-        if self.graph:
-            self.progression_log = open('progression.csv', 'w')
 
-        # create folder
-        self.out_folder = Path(outfolder)
-        if self.out_folder.is_dir():
-            if overwrite:
-                shutil.rmtree(self.out_folder, ignore_errors=True)
-            else:
-                raise FileExistsError(f"Folder '{self.out_folder}' already exists")
+        self.checkpoint_dir = self.working_dir / "checkpoint"
+        self.checkpoint_interval = checkpoint_interval
+        self.next_checkpoint = None
 
-        self.out_folder.mkdir()
-        self.working_dir = self.out_folder / "tmp"
-        self.working_dir.mkdir(parents=True)
+        if resume:
+            checkpoint = self.load_checkpoint()
+        elif self.archive is not None:
+            # the working dir of an interrupted append
+            shutil.rmtree(self.working_dir, ignore_errors=True)
+            self.working_dir.mkdir()
+        else:
+            # create folder
+            if self.out_folder.is_dir():
+                if overwrite:
+                    shutil.rmtree(self.out_folder, ignore_errors=True)
+                else:
+                    raise FileExistsError(f"Folder '{self.out_folder}' already exists")
 
-        self.zmq_manager = ZmqManager(self.jobs, (self.graph, transformer, octree_metadata, self.out_folder, self.rgb, self.verbose))
-        self.node_store = SharedNodeStore(self.working_dir)
+            self.out_folder.mkdir()
+            self.working_dir.mkdir(parents=True)
+
+        # the nodes of an appendable tileset are kept to insert the next points
+        self.node_store = SharedNodeStore((self.archive_dir if self.append else self.working_dir) / "nodes")
         self.state = State(self.file_info['portions'], max(1, self.jobs // 2))
+        self.job_sizes = JobSizeController()
+        if resume:
+            self.restore_checkpoint(checkpoint)
+
+        self.remote_worker_config = pickle.dumps({
+            'trace': self.trace is not None,
+            'transformer': transformer,
+            'octree_metadata': octree_metadata,
+            'folder': str(self.out_folder.resolve()),
+            'rgb': self.rgb,
+            'overwrite_pnts': self.append,
+        })
+        # the sort engine starts its own processes
+        self.zmq_manager = None
+        if self.engine == 'insert':
+            if self.shared_memory:
+                # the workers inherit the resource tracker of this process, it unlinks the shared segments
+                # left by killed workers (see share_point_batch)
+                resource_tracker.ensure_running()
+            self.zmq_manager = ZmqManager(
+                self.jobs,
+                (
+                    self.trace is not None, transformer, octree_metadata, self.out_folder, self.rgb, self.append,
+                    self.shared_memory, self.verbose
+                ),
+                bind or URI,
+                job_timeout
+            )
 
     def get_file_info(self, color_scale, crs_in: Optional[CRS]) -> dict:
 
         pointcloud_file_portions = []
         aabb = None
         color_scale_by_file = {}
+        chunk_size_by_file = {}
         total_point_count = 0
         avg_min = np.array([0., 0., 0.])
 
         # read all input files headers and determine the aabb/spacing
-        for file in self.files:
-            extension = file.suffix
-            if extension in READER_MAP:
-                reader = READER_MAP[extension]
-            else:
-                raise ValueError(f"The file with {extension} extension can't be read, "
-                                 f"the available extensions are: {READER_MAP.keys()}")
-
-            file_info = reader.get_metadata(file, color_scale=color_scale)
-
+        for file, file_info in zip(self.files, self.read_files_metadata(color_scale)):
             pointcloud_file_portions += file_info['portions']
             if aabb is None:
                 aabb = file_info['aabb']
             else:
                 aabb[0] = np.minimum(aabb[0], file_info['aabb'][0])
                 aabb[1] = np.maximum(aabb[1], file_info['aabb'][1])
-            color_scale_by_file[str(file)] = file_info['color_scale']
+            color_scale_by_file[get_file_key(file)] = file_info['color_scale']
+            chunk_size_by_file[get_file_key(file)] = file_info.get('chunk_size')
 
             file_crs_in = str_to_CRS(file_info['srs_in'])
             if file_crs_in is not None:
@@ -462,11 +870,48 @@ class _Convert:
             'portions': pointcloud_file_portions,
             'aabb': aabb,
             'color_scale': color_scale_by_file,
+            'chunk_size': chunk_size_by_file,
             'crs_in': crs_in,
             'point_count': total_point_count,
             'avg_min': avg_min
         }
 
+    def read_files_metadata(self, color_scale) -> List[dict]:
+        """
+        Read the metadata of the input files, in a process pool if there are several files.
+        """
+        for file in self.files:
+            if not isinstance(file, ArraySource) and get_extension(file) not in READER_MAP:
+                raise ValueError(f"The file with {get_extension(file)} extension can't be read, "
+                                 f"the available extensions are: {READER_MAP.keys()}")
+
+        paths = [file for file in self.files if not isinstance(file, ArraySource)]
+        if len(paths) < 2 or self.jobs < 2:
+            # a single xyz file is scanned by the processes of the jobs
+            return [
+                file.get_metadata(color_scale=color_scale) if isinstance(file, ArraySource)
+                else get_file_metadata(file, color_scale, max(1, self.jobs), self.metadata_cache)
+                for file in self.files
+            ]
+
+        # each file is read by one process
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.jobs, len(paths))) as executor:
+            futures = [
+                None if isinstance(file, ArraySource)
+                else executor.submit(get_file_metadata, file, color_scale, 1, self.metadata_cache)
+                for file in self.files
+            ]
+            try:
+                return [
+                    file.get_metadata(color_scale=color_scale) if future is None else future.result()
+                    for file, future in zip(self.files, futures)
+                ]
+            except BaseException:
+                for future in futures:
+                    if future is not None:
+                        future.cancel()
+                raise
+
     def get_transformer(self, crs_out: CRS) -> Union[Transformer, None]:
         if crs_out:
             if self.file_info['crs_in'] is None:
@@ -541,46 +986,105 @@ class _Convert:
         Convert pointclouds (xyz, las or laz) to 3dtiles tileset containing pnts node
         """
         self.startup = time.time()
+        self.startup_cpu_time = time.process_time()
+        if self.engine == 'sort':
+            self.convert_sorted()
+            return
+
+        if self.checkpoint_interval is not None:
+            self.next_checkpoint = self.checkpoint_interval
+        next_memory_control = MEMORY_CONTROL_INTERVAL
+        next_progress = 0
+        progress_pending = False
+        if self.trace is not None:
+            self.trace_writer = TraceWriter(self.trace, self.startup)
+            self.trace_writer.add_process_name(os.getpid(), 'manager')
+
+        # the state only changes when a worker sends a message, so the manager sleeps until then
+        # or until the next timer (memory control, progress output or checkpoint)
+        poller = zmq.Poller()
+        poller.register(self.zmq_manager.socket, zmq.POLLIN)
 
         try:
             while not self.zmq_manager.killing_processes:
-                now = time.time() - self.startup
+                next_timer = next_memory_control
+                if progress_pending:
+                    next_timer = min(next_timer, next_progress)
+                if self.next_checkpoint is not None:
+                    next_timer = min(next_timer, self.next_checkpoint)
+                timeout = max(0., next_timer - (time.time() - self.startup))
+                if self.zmq_manager.job_timeout is not None:
+                    timeout = min(timeout, self.zmq_manager.job_timeout)
 
                 at_least_one_job_ended = False
-                if not self.zmq_manager.can_queue_more_jobs() or self.zmq_manager.socket.poll(timeout=0, flags=zmq.POLLIN):
+                if poller.poll(timeout * 1000):
                     at_least_one_job_ended = self.process_message()
 
-                while self.state.pnts_to_writing and self.zmq_manager.can_queue_more_jobs():
-                    self.send_pnts_to_write()
-
-                if self.zmq_manager.can_queue_more_jobs():
-                    self.send_points_to_process(now)
-
-                while self.state.can_add_reading_jobs() and self.zmq_manager.can_queue_more_jobs():
-                    self.send_file_to_read()
+                now = time.time() - self.startup
+                self.zmq_manager.check_job_timeout()
+
+                # no new job is sent until a pending checkpoint is saved,
+                # it will be saved as soon as the in progress jobs are finished.
+                checkpoint_pending = self.is_checkpoint_pending(now)
+                if checkpoint_pending and self.state.is_idle():
+                    start = time.time()
+                    self.save_checkpoint(now)
+                    self.add_trace_span('checkpoint', start)
+                    checkpoint_pending = False
+
+                if not checkpoint_pending:
+                    while self.state.pnts_to_writing and self.zmq_manager.can_queue_more_jobs():
+                        self.send_pnts_to_write()
+
+                    if self.zmq_manager.can_queue_more_jobs():
+                        start = time.time()
+                        node_count = len(self.state.processing_nodes)
+                        self.send_points_to_process(now)
+                        node_count = len(self.state.processing_nodes) - node_count
+                        if node_count:
+                            self.add_trace_span('schedule', start, {'nodes': node_count})
+
+                    while self.state.can_add_reading_jobs() and self.zmq_manager.can_queue_more_jobs():
+                        self.send_file_to_read()
 
                 # if at this point we have no work in progress => we're done
                 if self.zmq_manager.are_all_processes_idle():
                     self.zmq_manager.kill_all_processes()
 
-                if at_least_one_job_ended:
+                progress_pending = progress_pending or at_least_one_job_ended
+                if progress_pending and (now >= next_progress or self.zmq_manager.killing_processes):
                     self.print_debug(now)
-                    if self.graph:
-                        percent = round(100 * self.state.processed_points / self.file_info['point_count'], 3)
-                        print(f'{time.time() - self.startup}, {percent}', file=self.progression_log)
-
-                self.node_store.control_memory_usage(self.cache_size, self.verbose)
+                    if self.trace_writer is not None:
+                        self.add_trace_counters()
+                    progress_pending = False
+                    next_progress = now + PROGRESS_INTERVAL
+
+                if now >= next_memory_control:
+                    start = time.time()
+                    removed = self.node_store.control_memory_usage(self.cache_size, self.verbose)
+                    if removed is not None:
+                        self.add_trace_span('node store spill', start, {'nodes': removed[0], 'bytes': removed[1]})
+                    next_memory_control = now + MEMORY_CONTROL_INTERVAL
 
             self.zmq_manager.join_all_processes()
 
-            if self.state.points_in_pnts != self.file_info['point_count']:
+            # when appending, the written pnts also contain the points of the previous conversions
+            if not self.append and self.state.points_in_pnts != self.file_info['point_count']:
                 raise ValueError("!!! Invalid point count in the written .pnts"
                                  + f"(expected: {self.file_info['point_count']}, was: {self.state.points_in_pnts})")
 
+            # The tileset writing could merge and remove some pnts,
+            # so a checkpoint can't be resumed from this point.
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+
             if self.verbose >= 1:
                 print('Writing 3dtiles {}'.format(self.file_info['avg_min']))
 
+            start = time.time()
             self.write_tileset()
+            self.add_trace_span('write tileset', start)
+            if self.append:
+                self.save_archive()
             shutil.rmtree(self.working_dir)
 
             if self.verbose >= 1:
@@ -594,31 +1098,194 @@ class _Convert:
                     round(time.time() - self.startup, 1)))
         finally:
             self.zmq_manager.terminate_all_processes()
+            self.state.release_tasks()
 
             if self.verbose >= 1:
                 print('destroy', round(self.zmq_manager.time_waiting_an_idle_process, 2))
+                print(f'manager cpu time: {round(time.process_time() - self.startup_cpu_time, 1)} sec')
 
-            # pygal chart
-            if self.graph:
-                self.progression_log.close()
-                self.draw_graph()
+            if self.trace_writer is not None:
+                self.trace_writer.close()
 
             self.zmq_manager.context.destroy()
 
+    def convert_sorted(self):
+        """
+        Convert the points with the sort engine: the jobs read the portions in runs sorted by node,
+        then build the subtrees of the tileset from the merged runs (see sort_builder).
+        """
+        runs_dir = self.working_dir / 'runs'
+        runs_dir.mkdir()
+        tree_depth = sort_builder.get_tree_depth(self.root_spacing, self.root_scale[0])
+        run_point_count = max(100_000, self.cache_size * 1024 * 1024 // (SORTED_POINT_SIZE * self.jobs))
+
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.jobs) as executor:
+            runs = []
+            # the next portions are submitted as the jobs end, so that few portions are waiting
+            # (the points of an ArraySource are copied in the submitted jobs)
+            futures = set()
+            while self.state.point_cloud_file_parts or futures:
+                while self.state.point_cloud_file_parts and len(futures) < 2 * self.jobs:
+                    file, portion = self.pop_file_portion(run_point_count)
+                    parameters, frames = self.get_read_parameters(file, portion)
+                    read = functools.partial(read_portion, parameters, frames, transformer=self.transformer)
+                    runs.append(runs_dir / f'{len(runs)}.npy')
+                    futures.add(executor.submit(sort_builder.write_run, read, self.root_aabb, tree_depth, runs[-1]))
+                done, futures = concurrent.futures.wait(futures, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+
+            if self.verbose >= 1:
+                print(f'{len(runs)} sorted runs, {round(time.time() - self.startup, 1)} sec')
+
+            runs = sort_builder.reduce_runs(executor, runs, runs_dir)
+            points_in_pnts = sort_builder.build_tiles(
+                executor, runs, self.root_aabb, self.root_spacing, tree_depth, self.out_folder, self.rgb,
+                max(MAX_LEAF_POINT_COUNT, self.file_info['point_count'] // (4 * self.jobs)))
+
+        if points_in_pnts != self.file_info['point_count']:
+            raise ValueError("!!! Invalid point count in the written .pnts"
+                             + f"(expected: {self.file_info['point_count']}, was: {points_in_pnts})")
+
+        if self.verbose >= 1:
+            print('Writing 3dtiles {}'.format(self.file_info['avg_min']))
+
+        self.write_tileset()
+        shutil.rmtree(self.working_dir)
+
+        if self.verbose >= 1:
+            print('Done')
+
+        if self.benchmark:
+            print('{},{},{},{}'.format(
+                self.benchmark,
+                ','.join([f.name for f in self.files]),
+                points_in_pnts,
+                round(time.time() - self.startup, 1)))
+
+    def add_trace_span(self, name, start, args=None):
+        if self.trace_writer is not None:
+            self.trace_writer.add_span(name, 'manager', start, time.time() - start, os.getpid(), args)
+
+    def add_trace_counters(self):
+        now = time.time()
+        pid = os.getpid()
+        self.trace_writer.add_counters('progress', now, pid, {
+            'percent': round(100 * self.state.processed_points / self.file_info['point_count'], 3)
+        })
+        self.trace_writer.add_counters('points in progress', now, pid, {'points': self.state.points_in_progress})
+        self.trace_writer.add_counters('nodes', now, pid, {
+            'to process': len(self.state.node_to_process),
+            'processing': len(self.state.processing_nodes),
+            'waiting writing': len(self.state.waiting_writing_nodes),
+            'to write': len(self.state.pnts_to_writing),
+        })
+        self.trace_writer.add_counters('workers', now, pid, {
+            'busy': self.zmq_manager.number_of_jobs - len(self.zmq_manager.idle_clients)
+        })
+
+    def add_worker_trace(self, span):
+        for child in span.get('children', []):
+            self.trace_writer.add_span(child['name'], 'node', child['start'], child['duration'], span['pid'],
+                                       child['args'])
+        self.trace_writer.add_span(span['name'], 'job', span['start'], span['duration'], span['pid'], span['args'])
+
+    def is_checkpoint_pending(self, now):
+        return self.next_checkpoint is not None and now >= self.next_checkpoint
+
+    def save_checkpoint(self, now):
+        new_checkpoint_dir = self.working_dir / "checkpoint.tmp"
+        old_checkpoint_dir = self.working_dir / "checkpoint.old"
+        shutil.rmtree(new_checkpoint_dir, ignore_errors=True)
+        new_checkpoint_dir.mkdir()
+
+        node_count = self.node_store.snapshot(new_checkpoint_dir / "nodes")
+        with (new_checkpoint_dir / "state.pickle").open('wb') as f:
+            pickle.dump({
+                'files': [str(file) for file in self.files],
+                'octree_metadata': (self.root_aabb, self.root_scale, self.avg_min, self.rgb),
+                'state': self.state.to_checkpoint(),
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        # replace the previous checkpoint
+        if self.checkpoint_dir.exists():
+            self.checkpoint_dir.rename(old_checkpoint_dir)
+        new_checkpoint_dir.rename(self.checkpoint_dir)
+        shutil.rmtree(old_checkpoint_dir, ignore_errors=True)
+
+        self.next_checkpoint = now + self.checkpoint_interval
+        if self.verbose >= 1:
+            print(f'Checkpoint saved ({node_count} nodes) in {round(time.time() - checkpoint_time, 2)} sec')
+
+    def load_checkpoint(self) -> dict:
+        # if the process was interrupted while the checkpoint was replaced
+        for checkpoint_dir in [self.checkpoint_dir, self.working_dir / "checkpoint.old"]:
+            checkpoint_path = checkpoint_dir / "state.pickle"
+            if checkpoint_path.exists():
+                break
+        else:
+            raise FileNotFoundError(f"No checkpoint found in '{self.out_folder}'")
+
+        if checkpoint_dir != self.checkpoint_dir:
+            shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+            checkpoint_dir.rename(self.checkpoint_dir)
+
+        with (self.checkpoint_dir / "state.pickle").open('rb') as f:
+            checkpoint = pickle.load(f)
+
+        root_aabb, root_scale, avg_min, rgb = checkpoint['octree_metadata']
+        if (
+            checkpoint['files'] != [str(file) for file in self.files]
+            or not np.array_equal(root_aabb, self.root_aabb)
+            or not np.array_equal(root_scale, self.root_scale)
+            or not np.array_equal(avg_min, self.avg_min)
+            or rgb != self.rgb
+        ):
+            raise ValueError("The checkpoint doesn't match the input files or the options of this conversion")
+
+        return checkpoint
+
+    def restore_checkpoint(self, checkpoint: dict):
+        shutil.rmtree(self.working_dir / "checkpoint.tmp", ignore_errors=True)
+        self.node_store.restore(self.checkpoint_dir / "nodes")
+        self.state.load_checkpoint(checkpoint['state'])
+
+        # the pnts written after the checkpoint will be written again
+        written_paths = {node_name_to_path(self.out_folder, name, '.pnts') for name in self.state.written_nodes}
+        for pnts_path in self.out_folder.rglob('*.pnts'):
+            if pnts_path not in written_paths:
+                pnts_path.unlink()
+
+        if self.verbose >= 1:
+            print(f"Resume the conversion from {round(100 * self.state.processed_points / self.file_info['point_count'], 2)} %")
+
     def process_message(self):
         one_job_ended = False
 
         # Blocking read but it's fine because either all our child processes are busy
         # or we know that there's something to read (zmq.POLLIN)
         start = time.time()
-        message = self.zmq_manager.socket.recv_multipart()
+        # point batches are kept as zmq frames and forwarded to the node workers without copy
+        message = self.zmq_manager.socket.recv_multipart(copy=False)
 
-        client_id = message[0]
+        client_id = message[0].bytes
         result = message[1:]
-        return_type = result[0]
+        return_type = result[0].bytes
+
+        if return_type == ResponseType.REGISTER.value:
+            self.zmq_manager.configure_remote_client(client_id, self.remote_worker_config)
+            self.state.max_reading_jobs = max(1, self.zmq_manager.number_of_jobs // 2)
+            if self.verbose >= 1:
+                print(f'A remote worker joined, {self.zmq_manager.number_of_jobs} workers')
+
+        elif return_type == ResponseType.IDLE.value:
+            if len(result) > 1 and self.trace_writer is not None:
+                self.add_worker_trace(json.loads(result[1].bytes))
 
-        if return_type == ResponseType.IDLE.value:
-            self.zmq_manager.add_idle_client(client_id)
+            finished_job = self.zmq_manager.add_idle_client(client_id)
+            if finished_job is not None:
+                command, point_count, start_time = finished_job
+                self.job_sizes.update(command, point_count, time.time() - start_time)
 
             if not self.zmq_manager.can_queue_more_jobs():
                 self.zmq_manager.time_waiting_an_idle_process += time.time() - start
@@ -631,68 +1298,41 @@ class _Convert:
             one_job_ended = True
 
         elif return_type == ResponseType.PROCESSED.value:
-            content = pickle.loads(result[-1])
-            self.state.processed_points += content['total']
-            self.state.points_in_progress -= content['total']
+            name = result[1].bytes
+            total = struct.unpack('>I', result[2].bytes)[0]
+            self.state.processed_points += total
+            self.state.points_in_progress -= total
 
-            del self.state.processing_nodes[content['name']]
+            self.state.end_processing(name)
 
-            self.dispatch_processed_nodes(content)
+            self.dispatch_processed_nodes(name, result[3].buffer)
 
             one_job_ended = True
 
         elif return_type == ResponseType.PNTS_WRITTEN.value:
-            self.state.points_in_pnts += struct.unpack('>I', result[1])[0]
+            self.state.points_in_pnts += struct.unpack('>I', result[1].bytes)[0]
             self.state.number_of_writing_jobs -= 1
+            self.state.written_nodes.add(result[2].bytes)
 
         elif return_type == ResponseType.NEW_TASK.value:
             self.state.add_tasks_to_process(
-                node_name=result[1], data=result[2], point_count=struct.unpack('>I', result[3])[0]
+                node_name=result[1].bytes, data=result[2:], point_count=get_point_batch_count(result[2])
             )
 
         elif return_type == ResponseType.ERROR.value:
-            raise WorkerException(f'An exception occurred in a worker: {result[1].decode()}')
+            raise WorkerException(f'An exception occurred in a worker: {result[1].bytes.decode()}')
 
         else:
             raise NotImplementedError(f"The command {return_type} is not implemented")
 
         return one_job_ended
 
-    def dispatch_processed_nodes(self, content):
-        if not content['name']:
-            return
-
-        self.node_store.put(content['name'], content['save'])
-        self.state.waiting_writing_nodes.append(content['name'])
-
-        if not self.state.is_reading_finish():
-            return
-
-        # if all nodes aren't processed yet,
-        # we should check if linked ancestors are processed
-        if self.state.processing_nodes or self.state.node_to_process:
-            finished_node = content['name']
-            if can_pnts_be_written(
-                finished_node, finished_node,
-                self.state.node_to_process, self.state.processing_nodes
-            ):
-                self.state.waiting_writing_nodes.pop(-1)
-                self.state.pnts_to_writing.append(finished_node)
-
-                for i in range(len(self.state.waiting_writing_nodes) - 1, -1, -1):
-                    candidate = self.state.waiting_writing_nodes[i]
-
-                    if can_pnts_be_written(
-                        candidate, finished_node,
-                        self.state.node_to_process, self.state.processing_nodes
-                    ):
-                        self.state.waiting_writing_nodes.pop(i)
-                        self.state.pnts_to_writing.append(candidate)
-
-        else:
-            for c in self.state.waiting_writing_nodes:
-                self.state.pnts_to_writing.append(c)
-            self.state.waiting_writing_nodes.clear()
+    def dispatch_processed_nodes(self, name, data):
+        # the root isn't stored (its points are all sent to its children), but its descendants
+        # waiting to be written may be waiting for it
+        if name:
+            self.node_store.put(name, data)
+        self.state.add_processed_node(name)
 
     def send_pnts_to_write(self):
         node_name = self.state.pnts_to_writing.pop()
@@ -701,59 +1341,91 @@ class _Convert:
             raise ValueError(f'{node_name} has no data')
 
         self.zmq_manager.send_to_process([CommandType.WRITE_PNTS.value, node_name, data])
-        self.node_store.remove(node_name)
+        if not self.append:
+            self.node_store.remove(node_name)
         self.state.number_of_writing_jobs += 1
 
     def send_points_to_process(self, now):
-        potentials = sorted(
-            # a key (=task) can be in node_to_process and processing_nodes if the node isn't completely processed
-            [
-                (node, task) for node, task in self.state.node_to_process.items()  # task: [data...], point_count
-                if node not in self.state.processing_nodes
-            ],
-            key=lambda task: -len(task[0]))  # sort by node name size, the root nodes first
-
-        while self.zmq_manager.can_queue_more_jobs() and potentials:
-            target_count = 100_000
+        scheduler = self.state.scheduler
+
+        while self.zmq_manager.can_queue_more_jobs() and scheduler:
+            target_count = self.job_sizes.get_process_count(
+                scheduler.total_point_count, len(self.zmq_manager.idle_clients)
+            )
             job_list = []
             count = 0
-            idx = len(potentials) - 1
-            while count < target_count and idx >= 0:
-                name, (tasks, point_count) = potentials[idx]
-                count += point_count
-                job_list += [
-                    name,
-                    self.node_store.get(name),
-                    struct.pack('>I', len(tasks)),
-                ] + tasks
-                del potentials[idx]
-
-                del self.state.node_to_process[name]
-                self.state.processing_nodes[name] = (len(tasks), point_count, now)
-
-                if name in self.state.waiting_writing_nodes:
-                    self.state.waiting_writing_nodes.pop(self.state.waiting_writing_nodes.index(name))
-                idx -= 1
+            while count < target_count and scheduler:
+                first_name = scheduler.pop()
+                # the siblings are sent together, they are often stored and written together
+                for name in [first_name] + scheduler.pop_siblings(first_name):
+                    tasks, point_count = self.state.start_processing(name, now)
+                    count += point_count
+                    job_list += [
+                        name,
+                        self.node_store.get(name),
+                        struct.pack('>I', len(tasks)),
+                    ]
+                    for task in tasks:
+                        job_list += task
+
+                    if name in self.state.waiting_writing_nodes:
+                        self.state.waiting_writing_nodes.remove(name)
 
             if job_list:
-                self.zmq_manager.send_to_process([CommandType.PROCESS_JOBS.value] + job_list)
+                self.zmq_manager.send_to_process([CommandType.PROCESS_JOBS.value] + job_list, point_count=count)
 
-    def send_file_to_read(self):
+    def pop_file_portion(self, read_count: int) -> tuple:
+        """
+        Pop the next portion to read, of about read_count points.
+        """
         if self.verbose >= 1:
             print(f'Submit next portion {self.state.point_cloud_file_parts[-1]}')
         file, portion = self.state.point_cloud_file_parts.pop()
-        self.state.points_in_progress += portion[1] - portion[0]
+        chunk_size = self.file_info['chunk_size'].get(get_file_key(file))
+        if chunk_size:
+            # the laz files are decompressed by chunks, the portions start at a chunk
+            read_count = max(1, read_count // chunk_size) * chunk_size
+        # the portions of the xyz files have a seek offset and the portions of the COPC files
+        # are groups of nodes, they are read as is
+        if len(portion) == 2 and portion[1] - portion[0] > read_count:
+            self.state.point_cloud_file_parts.append((file, (portion[0] + read_count, portion[1])))
+            portion = (portion[0], portion[0] + read_count)
+        return file, portion
+
+    def get_read_parameters(self, file, portion) -> Tuple[dict, list]:
+        """
+        Get the parameters of the reading of a portion (see read_portion), with the frames of the points
+        of an ArraySource.
+        """
+        parameters = {}
+        frames = []
+        if isinstance(file, ArraySource):
+            xyz, rgb = file.read(*portion)
+            parameters['filename'] = str(file)
+            parameters['rgb_dtype'] = rgb.dtype.str
+            frames = [np.ascontiguousarray(xyz), np.ascontiguousarray(rgb)]
+        else:
+            # the workers may not share the working directory of the manager
+            parameters['filename'] = str(Path(file).resolve())
 
-        self.zmq_manager.send_to_process([CommandType.READ_FILE.value, pickle.dumps({
-            'filename': file,
+        return {
+            **parameters,
             'offset_scale': (
                 -self.avg_min,
                 self.root_scale,
                 self.rotation_matrix[:3, :3].T if self.rotation_matrix is not None else None,
-                self.file_info['color_scale'].get(file) if self.file_info['color_scale'] is not None else None,
+                self.file_info['color_scale'].get(get_file_key(file)) if self.file_info['color_scale'] is not None else None,
             ),
             'portion': portion,
-        })])
+            'batch_size': self.job_sizes.process_count,
+        }, frames
+
+    def send_file_to_read(self):
+        file, portion = self.pop_file_portion(self.job_sizes.read_count)
+        self.state.points_in_progress += portion[1] - portion[0]
+        parameters, frames = self.get_read_parameters(file, portion)
+        self.zmq_manager.send_to_process(
+            [CommandType.READ_FILE.value, pickle.dumps(parameters)] + frames, point_count=portion[1] - portion[0])
 
         self.state.number_of_reading_jobs += 1
 
@@ -790,12 +1462,19 @@ class _Convert:
                     xyz.copy(),
                     rgb)
 
-        pnts_writer.node_to_pnts(b'', root_node, self.out_folder, self.rgb)
+        pnts_writer.node_to_pnts(b'', root_node, self.out_folder, self.rgb, overwrite=self.append)
 
-        executor = concurrent.futures.ProcessPoolExecutor()
-        root_tileset = Node.to_tileset(executor, b'', self.root_aabb, self.root_spacing,
-                                       self.out_folder, self.root_scale, prune=False)
-        executor.shutdown()
+        if self.append:
+            # the pnts are never pruned, so that they still match the saved nodes,
+            # and the bounding volumes of the unchanged tiles are taken from the archive.
+            self.tile_aabbs = self.archive['tile_aabbs'] if self.archive is not None else {}
+            root_tileset = Node.to_tileset(None, b'', self.root_aabb, self.root_spacing,
+                                           self.out_folder, self.root_scale, tile_aabbs=self.tile_aabbs)
+        else:
+            executor = concurrent.futures.ProcessPoolExecutor()
+            root_tileset = Node.to_tileset(executor, b'', self.root_aabb, self.root_spacing,
+                                           self.out_folder, self.root_scale, prune=False)
+            executor.shutdown()
 
         root_tileset['transform'] = transform.T.reshape(16).tolist()
         root_tileset['refine'] = 'REPLACE'  # The root tile is in the "REPLACE" refine mode
@@ -818,6 +1497,55 @@ class _Convert:
         with tileset_path.open('w') as f:
             f.write(json.dumps(tileset))
 
+    def load_archive(self) -> Optional[dict]:
+        if not self.out_folder.exists():
+            return None
+
+        archive_path = self.archive_dir / "metadata.pickle"
+        if not archive_path.exists():
+            raise ValueError(f"The tileset in '{self.out_folder}' can't be appended, "
+                             "it should be created with append")
+
+        with archive_path.open('rb') as f:
+            return pickle.load(f)
+
+    def check_archive_options(self, crs_out: Optional[CRS]):
+        if self.file_info['crs_in'] != self.archive['crs_in']:
+            raise SrsInMixinException("The input files should have the same srs in as the tileset, currently "
+                                      f"{self.file_info['crs_in']} instead of {self.archive['crs_in']}")
+        if crs_out != self.archive['crs_out']:
+            raise ValueError(f"The srs out should be the one of the tileset: {self.archive['crs_out']}")
+        if self.rgb != self.archive['rgb']:
+            raise ValueError("The rgb option should be the one used to create the tileset")
+
+    def save_archive(self):
+        self.node_store.remove_oldest_nodes(1)
+
+        point_count = self.file_info['point_count']
+        files = [str(file) for file in self.files]
+        if self.archive is not None:
+            point_count += self.archive['point_count']
+            files = self.archive['files'] + files
+
+        archive_path = self.archive_dir / "metadata.pickle"
+        tmp_path = archive_path.with_suffix('.tmp')
+        with tmp_path.open('wb') as f:
+            pickle.dump({
+                'files': files,
+                'point_count': point_count,
+                'crs_in': self.file_info['crs_in'],
+                'crs_out': self.crs_out,
+                'rgb': self.rgb,
+                'rotation_matrix': self.rotation_matrix,
+                'original_aabb': self.original_aabb,
+                'avg_min': self.avg_min,
+                'root_aabb': self.root_aabb,
+                'root_scale': self.root_scale,
+                'root_spacing': self.root_spacing,
+                'tile_aabbs': self.tile_aabbs,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, archive_path)
+
     def print_summary(self):
         print('Summary:')
         print('  - points to process: {}'.format(self.file_info['point_count']))
@@ -827,43 +1555,6 @@ class _Convert:
         print(f'  - original aabb: {self.original_aabb}')
         print(f'  - scale: {self.root_scale}')
 
-    def draw_graph(self):
-        import pygal  # type: ignore
-
-        dateline = pygal.XY(x_label_rotation=25, secondary_range=(0, 100))
-        for pid in self.zmq_manager.activities:
-            activity = []
-            activity_csv_path = Path(f'activity.{pid}.csv')
-            i = len(self.zmq_manager.activities) - self.zmq_manager.activities.index(pid) - 1
-            # activities.index(pid) =
-            with activity_csv_path.open() as f:
-                content = f.read().split('\n')
-                for line in content[1:]:
-                    line = line.split(',')
-                    if line[0]:
-                        ts = float(line[0])
-                        value = int(line[1]) / 3.0
-                        activity.append((ts, i + value * 0.9))
-
-            activity_csv_path.unlink()
-            if activity:
-                activity.append((activity[-1][0], activity[0][1]))
-                activity.append(activity[0])
-                dateline.add(str(pid), activity, show_dots=False, fill=True)
-
-        progression_csv_path = Path('progression.csv')
-        with progression_csv_path.open() as f:
-            values = []
-            for line in f.read().split('\n'):
-                if line:
-                    line = line.split(',')
-                    values += [(float(line[0]), float(line[1]))]
-        progression_csv_path.unlink()
-        dateline.add('progression', values, show_dots=False, secondary=True,
-                     stroke_style={'width': 2, 'color': 'black'})
-
-        dateline.render_to_file('activity.svg')
-
     def print_debug(self, now):
         if self.verbose >= 3:
             print('{:^16}|{:^8}|{:^8}'.format('Name', 'Points', 'Seconds'))
@@ -886,12 +1577,14 @@ class _Convert:
             self.state.print_debug()
 
         if self.verbose >= 1:
-            print('{} % points in {} sec [{} tasks, {} nodes, {} wip]'.format(
+            print('{} % points in {} sec [{} tasks, {} nodes, {} wip, jobs of {} read / {} processed points]'.format(
                 round(100 * self.state.processed_points / self.file_info['point_count'], 2),
                 round(now, 1),
-                self.jobs - len(self.zmq_manager.idle_clients),
+                self.zmq_manager.number_of_jobs - len(self.zmq_manager.idle_clients),
                 len(self.state.processing_nodes),
-                self.state.points_in_progress))
+                self.state.points_in_progress,
+                self.job_sizes.read_count,
+                self.job_sizes.process_count))
 
         elif self.verbose >= 0:
             percent = round(100 * self.state.processed_points / self.file_info['point_count'], 2)
@@ -908,7 +1601,8 @@ def init_parser(subparser):
     parser.add_argument(
         'files',
         nargs='+',
-        help='Filenames to process. The file must use the .las, .laz (lastools must be installed) or .xyz format.')
+        help='Filenames to process. The file must use the .las, .laz (a laz backend must be installed), .copc.laz, '
+             '.xyz, binary .ply or .npy format.')
     parser.add_argument(
         '--out',
         type=str,
@@ -943,11 +1637,61 @@ def init_parser(subparser):
         '--no-rgb',
         help="Don't export rgb attributes", action='store_true')
     parser.add_argument(
-        '--graph',
-        help='Produce debug graphes (requires pygal)', action='store_true')
+        '--trace',
+        help='Write a timeline of the jobs in this file, in the Chrome trace event format '
+             '(it can be opened with Perfetto or chrome://tracing).',
+        type=str)
     parser.add_argument(
         '--color_scale',
         help='Force color scale', type=float)
+    parser.add_argument(
+        '--checkpoint_interval',
+        help='Save a checkpoint of the conversion in the output folder every N seconds, '
+             'so that an interrupted conversion can be continued with --resume.',
+        type=float)
+    parser.add_argument(
+        '--resume',
+        help='Resume an interrupted conversion from the last checkpoint saved in the output folder. '
+             'The input files and the options must be the same as the interrupted conversion.',
+        action='store_true')
+    parser.add_argument(
+        '--append',
+        help='Add the points of the input files to the tileset of the output folder, which must have been '
+             'created with --append. Only the tiles with new points are written again.',
+        action='store_true')
+    parser.add_argument(
+        '--bind',
+        help='Let remote workers, started with "py3dtiles worker --connect", join the conversion on this address '
+             '(e.g. tcp://*:5555). They must have access to the input files and to the output folder.',
+        type=str)
+    parser.add_argument(
+        '--shared_memory',
+        help='Pass the points between the workers in shared memory instead of copying them in the messages. '
+             'Not available with --bind.',
+        action='store_true')
+    parser.add_argument(
+        '--reprojection_max_error',
+        help='Reproject the points approximately (and much faster) with at most this error, in the unit of '
+             '--srs_out (e.g. 0.001 for 1 mm with 4978), instead of reprojecting each point exactly.',
+        type=float)
+    parser.add_argument(
+        '--metadata_cache',
+        help='Cache the metadata of the input files in this folder (e.g. ~/.cache/py3dtiles), so that the next '
+             'conversions of the same files skip scanning them.',
+        type=str)
+    parser.add_argument(
+        '--engine',
+        help='How the tree is built: "insert" inserts the points in the nodes as they are read, "sort" sorts '
+             'the points by node in runs written in the output folder, then builds all the nodes at once. '
+             'Not available with --bind, --shared_memory, --trace, --checkpoint_interval, --resume, --append '
+             'or --job_timeout.',
+        choices=ENGINES,
+        default='insert')
+    parser.add_argument(
+        '--job_timeout',
+        help='Stop the conversion with an error if a worker does not finish a job in N seconds, e.g. a remote '
+             'worker whose host was disconnected. By default, the conversion waits for it forever.',
+        type=float)
 
     return parser
 
@@ -964,9 +1708,18 @@ def main(args):
                        fraction=args.fraction,
                        benchmark=args.benchmark,
                        rgb=not args.no_rgb,
-                       graph=args.graph,
+                       trace=args.trace,
                        color_scale=args.color_scale,
-                       verbose=args.verbose)
+                       checkpoint_interval=args.checkpoint_interval,
+                       resume=args.resume,
+                       append=args.append,
+                       bind=args.bind,
+                       shared_memory=args.shared_memory,
+                       metadata_cache=args.metadata_cache,
+                       reprojection_max_error=args.reprojection_max_error,
+                       verbose=args.verbose,
+                       engine=args.engine,
+                       job_timeout=args.job_timeout)
     except SrsInMissingException:
         print('No SRS information in input files, you should specify it with --srs_in')
         sys.exit(1)
@@ -0,0 +1,179 @@
+from __future__ import annotations
+
+from typing import Iterable, Iterator
+
+import numpy as np
+from pyproj import CRS
+
+from py3dtiles.utils import encode_point_batch, ResponseType, str_to_CRS
+
+
+class ArraySource:
+    """
+    Points in memory, to convert in place of a file (see convert).
+
+    The points are either arrays, or an iterable of (xyz, rgb) chunks. The chunks are read once,
+    while the conversion goes, so their aabb and their point count must be declared.
+    The points are sent to the workers with the reading jobs.
+    """
+
+    def __init__(self, xyz: np.ndarray, rgb: np.ndarray | None = None, crs: str | CRS | None = None,
+                 name: str = 'array') -> None:
+        """
+        :param xyz: The coordinates of the points, an array of shape (n, 3).
+        :param rgb: The colors of the points, an array of integers of shape (n, 3). The points are black if None.
+            The colors above 255 are scaled as 16 bits colors, unless the color_scale of the conversion is set.
+        :param crs: The CRS of the points.
+        :param name: The name of the source, used instead of a filename in the logs.
+        """
+        xyz = np.asarray(xyz, dtype=np.float64)
+        if xyz.ndim != 2 or xyz.shape[1] != 3:
+            raise ValueError(f"xyz should be an array of shape (n, 3), currently {xyz.shape}")
+
+        self.name = name
+        self.crs = str_to_CRS(crs)
+        self.point_count = len(xyz)
+        self.aabb = np.array([np.min(xyz, axis=0), np.max(xyz, axis=0)]) if len(xyz) else None
+        self._xyz = xyz
+        self._rgb = _check_rgb(rgb, len(xyz))
+        self._chunks = None
+        self._pending = None
+        self._position = 0
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[tuple[np.ndarray, np.ndarray | None]], aabb: np.ndarray,
+                    point_count: int, crs: str | CRS | None = None, name: str = 'chunks') -> ArraySource:
+        """
+        :param chunks: The (xyz, rgb) chunks of points, see the xyz and rgb parameters of ArraySource.
+            The colors of the chunks are only read during the conversion: the color_scale of the conversion
+            should be set if they are above 255.
+        :param aabb: The bounds of the points: [[min x, min y, min z], [max x, max y, max z]].
+        :param point_count: The total number of points of the chunks.
+        :param crs: The CRS of the points.
+        :param name: The name of the source, used instead of a filename in the logs.
+        """
+        source = cls(np.zeros((0, 3)), crs=crs, name=name)
+        source.point_count = point_count
+        source.aabb = np.array(aabb, dtype=np.float64)
+        source._chunks = iter(chunks)
+        return source
+
+    def __str__(self) -> str:
+        return self.name
+
+    def get_metadata(self, color_scale=None, fraction: int = 100) -> dict:
+        if self.aabb is None:
+            raise ValueError(f"{self.name} has no points")
+        point_count = self.point_count * fraction // 100
+        if not color_scale and self._chunks is None and len(self._rgb) and np.max(self._rgb) > 255:
+            # 16 bits colors, 65535 / 256 is still a valid color
+            color_scale = 1.0 / 256
+        return {
+            # the manager splits the portion in reading jobs
+            'portions': [(self, (0, point_count))] if point_count > 0 else [],
+            'aabb': self.aabb.copy(),
+            'color_scale': color_scale,
+            'srs_in': self.crs.to_wkt() if self.crs is not None else None,
+            'point_count': point_count,
+            'avg_min': self.aabb[0].copy(),
+        }
+
+    def read(self, start: int, end: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get the points of the portion [start, end[. The chunks can only be read in order.
+        """
+        if self._chunks is None:
+            return self._xyz[start:end], self._rgb[start:end]
+
+        if start != self._position:
+            raise ValueError(f"The chunks of {self.name} should be read in order, "
+                             f"expected the point {self._position} instead of {start}")
+
+        xyz_list = []
+        rgb_list = []
+        count = 0
+        while count < end - start:
+            if self._pending is None:
+                try:
+                    xyz, rgb = next(self._chunks)
+                except StopIteration:
+                    raise ValueError(f"The chunks of {self.name} have less points than "
+                                     f"the declared point count ({self.point_count})") from None
+                xyz = np.asarray(xyz, dtype=np.float64)
+                self._pending = (xyz, _check_rgb(rgb, len(xyz)))
+
+            xyz, rgb = self._pending
+            taken = min(len(xyz), end - start - count)
+            xyz_list.append(xyz[:taken])
+            rgb_list.append(rgb[:taken])
+            self._pending = (xyz[taken:], rgb[taken:]) if taken < len(xyz) else None
+            count += taken
+
+        self._position = end
+        if end == self.point_count and (self._pending is not None or _has_points(self._chunks)):
+            raise ValueError(f"The chunks of {self.name} have more points than "
+                             f"the declared point count ({self.point_count})")
+
+        return np.concatenate(xyz_list), np.concatenate(rgb_list)
+
+
+def _check_rgb(rgb: np.ndarray | None, point_count: int) -> np.ndarray:
+    if rgb is None:
+        return np.zeros((point_count, 3), dtype=np.uint8)
+
+    rgb = np.asarray(rgb)
+    if rgb.shape != (point_count, 3) or not np.issubdtype(rgb.dtype, np.integer):
+        raise ValueError(f"rgb should be an array of integers of shape ({point_count}, 3), "
+                         f"currently {rgb.dtype} {rgb.shape}")
+    return rgb
+
+
+def _has_points(chunks: Iterator) -> bool:
+    return any(len(xyz) for xyz, _ in chunks)
+
+
+def run(frames: list, rgb_dtype: str, offset_scale, queue, transformer, batch_size: int = 100_000):
+    """
+    Reads the points of an ArraySource, sent in the frames of the job
+    """
+    xyz = np.frombuffer(frames[0], dtype=np.float64).reshape((-1, 3))
+    rgb = np.frombuffer(frames[1], dtype=np.dtype(rgb_dtype)).reshape((-1, 3))
+
+    point_count = len(xyz)
+    step = min(point_count, batch_size)
+    color_scale = offset_scale[3]
+
+    for start in range(0, point_count, step):
+        x, y, z = (xyz[start:start + step, c] for c in [0, 1, 2])
+
+        if transformer:
+            x, y, z = transformer.transform(x, y, z)
+
+        x = (x + offset_scale[0][0]) * offset_scale[1][0]
+        y = (y + offset_scale[0][1]) * offset_scale[1][1]
+        z = (z + offset_scale[0][2]) * offset_scale[1][2]
+
+        coords = np.vstack((x, y, z)).transpose()
+
+        if offset_scale[2] is not None:
+            # Apply transformation matrix (because the tile's transform will contain
+            # the inverse of this matrix)
+            coords = np.dot(coords, offset_scale[2])
+
+        coords = np.ascontiguousarray(coords.astype(np.float32))
+
+        colors = rgb[start:start + step]
+        if color_scale:
+            colors = colors * color_scale
+        if len(colors) and (np.min(colors) < 0 or np.max(colors) >= 256):
+            raise ValueError(f"The colors should be between 0 and 255 once scaled, currently between "
+                             f"{np.min(colors)} and {np.max(colors)}, the color_scale should be set")
+        colors = colors.astype(np.uint8)
+
+        queue.send_multipart(
+            [
+                ResponseType.NEW_TASK.value,
+                b'',
+            ] + encode_point_batch(coords, colors), copy=False)
+
+    queue.send_multipart([ResponseType.READ.value])
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import laspy
+import numpy as np
+
+from py3dtiles.reader import las_reader, metadata_cache
+
+# the nodes are grouped in portions of about POINTS_PER_PORTION points
+POINTS_PER_PORTION = 1_000_000
+# an entry of a hierarchy page: the key of a node, and the offset, the size and the point count of its chunk
+HIERARCHY_ENTRY_DTYPE = np.dtype([
+    ('level', '<i4'), ('x', '<i4'), ('y', '<i4'), ('z', '<i4'),
+    ('offset', '<u8'), ('byte_size', '<i4'), ('point_count', '<i4'),
+])
+# the point count of the entries pointing to a child hierarchy page instead of a chunk
+CHILD_PAGE_POINT_COUNT = -1
+# the depth of the keys ordering the nodes, so that their Morton code fits in 64 bits
+MAX_ORDER_DEPTH = 21
+
+
+def get_metadata(path: Path, color_scale=None, fraction: int = 100, cache_dir: Optional[Path] = None) -> dict:
+    """
+    The aabb and the point count are read in the header and in the COPC hierarchy, the portions
+    are groups of nodes of the octree (see get_portions).
+
+    :param cache_dir: If set, the metadata of the file are cached in this folder (see metadata_cache)
+        and reused while the file doesn't change.
+    """
+    copc_info = metadata_cache.load(cache_dir, path, 'copc') if cache_dir is not None else None
+    if copc_info is None:
+        nodes = read_hierarchy(path)
+        copc_info = {
+            **las_reader.read_header_info(path),
+            'point_count': int(np.sum(nodes['point_count'], dtype=np.int64)),
+            'portions': get_portions(nodes),
+        }
+        if cache_dir is not None:
+            metadata_cache.save(cache_dir, path, 'copc', copc_info)
+
+    # the nodes are kept whole, the fraction is rounded to the next portion
+    max_point_count = copc_info['point_count'] * fraction // 100
+    portions = [portion for portion in copc_info['portions'] if portion[0] < max_point_count]
+    return {
+        'portions': [(str(path), portion) for portion in portions],
+        'aabb': copc_info['aabb'].copy(),
+        'color_scale': color_scale if color_scale else copc_info['color_scale'],
+        'srs_in': copc_info['srs_in'],
+        'point_count': portions[-1][1] if portions else 0,
+        'avg_min': copc_info['aabb'][0].copy(),
+    }
+
+
+def read_hierarchy(path: Path) -> np.ndarray:
+    """
+    Read the entries of the nodes with points in the hierarchy pages of a COPC file (see HIERARCHY_ENTRY_DTYPE).
+    The points aren't decompressed.
+    """
+    with path.open('rb') as f:
+        header = laspy.LasHeader.read_from(f)
+        copc_info_vlrs = header.vlrs.get('CopcInfoVlr')
+        if not copc_info_vlrs:
+            raise ValueError(f"{path} is not a COPC file, it has no COPC info VLR")
+
+        nodes = []
+        pages = [(copc_info_vlrs[0].hierarchy_root_offset, copc_info_vlrs[0].hierarchy_root_size)]
+        while pages:
+            offset, size = pages.pop()
+            f.seek(offset)
+            data = f.read(size)
+            if len(data) != size or size % HIERARCHY_ENTRY_DTYPE.itemsize != 0:
+                raise ValueError(f"The COPC hierarchy page of {path} at the offset {offset} is invalid")
+
+            entries = np.frombuffer(data, dtype=HIERARCHY_ENTRY_DTYPE)
+            nodes.append(entries[entries['point_count'] > 0])
+            child_pages = entries[entries['point_count'] == CHILD_PAGE_POINT_COUNT]
+            pages += zip(child_pages['offset'].tolist(), child_pages['byte_size'].tolist())
+
+    return np.concatenate(nodes)
+
+
+def get_depth_first_order(nodes: np.ndarray) -> np.ndarray:
+    """
+    Get the indices of the nodes in depth-first order: each node is followed by its descendants,
+    and the children by the Morton order of their keys. Consecutive nodes are then close in space.
+    """
+    if len(nodes) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    depth = int(nodes['level'].max())
+    order_depth = min(depth, MAX_ORDER_DEPTH)
+    codes = np.zeros(len(nodes), dtype=np.uint64)
+    for axis_index, axis in enumerate(['x', 'y', 'z']):
+        # the coordinates of the first descendant of the nodes at the depth of the order
+        coordinates = nodes[axis].astype(np.int64) << (depth - nodes['level'])
+        coordinates = (coordinates >> (depth - order_depth)).astype(np.uint64)
+        for bit in range(order_depth):
+            codes |= ((coordinates >> np.uint64(bit)) & np.uint64(1)) << np.uint64(3 * bit + axis_index)
+
+    # a node and its first descendants have the same code, the ancestors come first
+    return np.lexsort((nodes['level'], codes))
+
+
+def get_portions(nodes: np.ndarray) -> list[tuple[int, int, tuple[tuple[int, int], ...]]]:
+    """
+    Group the nodes in depth-first order in portions of about POINTS_PER_PORTION points, so that each reading
+    job gets points close to each other.
+
+    A portion is (start, end, ranges): [start, end[ is the range of its points in the depth-first order, and
+    ranges are the ranges of their indices in the file. The points of the nodes are stored in the order of the
+    offsets of their chunks.
+    """
+    point_counts = nodes['point_count'].astype(np.int64)
+    by_offset = np.argsort(nodes['offset'], kind='stable')
+    first_points = np.empty(len(nodes), dtype=np.int64)
+    first_points[by_offset] = np.cumsum(point_counts[by_offset]) - point_counts[by_offset]
+
+    portions = []
+    start = 0
+    end = 0
+    ranges: list[tuple[int, int]] = []
+    for node in get_depth_first_order(nodes).tolist():
+        node_start = int(first_points[node])
+        node_end = node_start + int(point_counts[node])
+        if ranges and ranges[-1][1] == node_start:
+            ranges[-1] = (ranges[-1][0], node_end)
+        else:
+            ranges.append((node_start, node_end))
+        end += node_end - node_start
+
+        if end - start >= POINTS_PER_PORTION:
+            portions.append((start, end, tuple(ranges)))
+            start = end
+            ranges = []
+
+    if ranges:
+        portions.append((start, end, tuple(ranges)))
+    return portions
+
+
+def run(filename: str, offset_scale, portion, queue, transformer, batch_size: int = 100_000):
+    """
+    Reads the points of a portion of nodes from a COPC file
+    """
+    las_reader.read_ranges(filename, offset_scale, portion[2], queue, transformer, batch_size)
@@ -1,125 +1,203 @@
-import json
 import math
 from pathlib import Path
-import pickle
 import struct
-import subprocess
+from typing import Optional
 
 import laspy
+from laspy.errors import LaspyException
 import numpy as np
+from pyproj.exceptions import CRSError
 
-from py3dtiles.utils import ResponseType
+from py3dtiles.reader import metadata_cache
+from py3dtiles.utils import encode_point_batch, ResponseType
 
+# the beginning of the laszip VLR, up to the number of points of the chunks
+LASZIP_VLR_FORMAT = '<HHBBHII'
+# the chunks of the laz files written with this chunk size have variable sizes
+LASZIP_VARIABLE_CHUNK_SIZE = 0xFFFFFFFF
 
-def get_metadata(path: Path, color_scale=None, fraction: int = 100) -> dict:
-    pointcloud_file_portions = []
-    srs_in = None
 
-    filename = str(path)
-    with laspy.open(filename) as f:
-        point_count = f.header.point_count * fraction // 100
+def get_metadata(path: Path, color_scale=None, fraction: int = 100, cache_dir: Optional[Path] = None) -> dict:
+    """
+    :param cache_dir: If set, the metadata of the file are cached in this folder (see metadata_cache)
+        and reused while the file doesn't change.
+    """
+    header_info = metadata_cache.load(cache_dir, path, 'las') if cache_dir is not None else None
+    if header_info is None:
+        header_info = read_header_info(path)
+        if cache_dir is not None:
+            metadata_cache.save(cache_dir, path, 'las', header_info)
+
+    point_count = header_info['point_count'] * fraction // 100
+    return {
+        # the manager splits the portion in reading jobs
+        'portions': [(str(path), (0, point_count))] if point_count > 0 else [],
+        'aabb': header_info['aabb'].copy(),
+        'color_scale': color_scale if color_scale else header_info['color_scale'],
+        'srs_in': header_info['srs_in'],
+        'point_count': point_count,
+        'avg_min': header_info['aabb'][0].copy(),
+        # the portions of a laz file should start at a chunk, see read_laz_chunk_size
+        'chunk_size': header_info['chunk_size'],
+    }
 
+
+def read_header_info(path: Path) -> dict:
+    """
+    Read the point count, the aabb, the color scale and the CRS (as WKT) of a las file from its header,
+    its VLRs and its first points.
+    """
+    with laspy.open(str(path)) as f:
         # read the first points red channel
-        if not color_scale:
-            if 'red' in f.header.point_format.dimension_names:
-                points = next(f.chunk_iterator(10_000))['red']
-                if np.max(points) > 255:
-                    color_scale = 1.0 / 255
-            else:
-                # the intensity is then used as color
+        color_scale = None
+        if 'red' in f.header.point_format.dimension_names:
+            points = next(f.chunk_iterator(10_000))['red']
+            if np.max(points) > 255:
                 color_scale = 1.0 / 255
+        else:
+            # the intensity is then used as color
+            color_scale = 1.0 / 255
+
+        # the CRS is described by the WKT or the GeoTIFF keys VLRs
+        try:
+            crs = f.header.parse_crs()
+        except (CRSError, LaspyException):
+            crs = None
+
+        return {
+            'point_count': f.header.point_count,
+            'aabb': np.array([f.header.mins, f.header.maxs]),
+            'color_scale': color_scale,
+            'srs_in': crs.to_wkt() if crs is not None else None,
+            'chunk_size': read_laz_chunk_size(path) if f.header.are_points_compressed else None,
+        }
+
+
+def read_laz_chunk_size(path: Path) -> Optional[int]:
+    """
+    Read the number of points of the compressed chunks of a laz file in its laszip VLR.
+    A laz file can only be read from the beginning of a chunk, so reading from another point
+    decompresses the points before it in its chunk.
 
-        _1M = min(point_count, 1_000_000)
-        steps = math.ceil(point_count / _1M)
-        portions = [(i * _1M, min(point_count, (i + 1) * _1M)) for i in range(steps)]
-        for p in portions:
-            pointcloud_file_portions += [(filename, p)]
+    Return None if the chunks have variable sizes, or if there is no laszip VLR.
+    """
+    with path.open('rb') as f:
+        # the header is read without decompressing the points, laspy.open removes the laszip VLR
+        header = laspy.LasHeader.read_from(f)
 
-        output = subprocess.check_output(['pdal', 'info', '--summary', filename])
-        summary = json.loads(output)['summary']
-        if 'srs' in summary:
-            srs_in = summary['srs'].get('proj4')
+    laszip_vlrs = header.vlrs.get('LasZipVlr')
+    if not laszip_vlrs or len(laszip_vlrs[0].record_data) < struct.calcsize(LASZIP_VLR_FORMAT):
+        return None
 
-    return {
-        'portions': pointcloud_file_portions,
-        'aabb': np.array([f.header.mins, f.header.maxs]),
-        'color_scale': color_scale,
-        'srs_in': srs_in,
-        'point_count': point_count,
-        'avg_min': np.array(f.header.mins)
-    }
+    chunk_size = struct.unpack_from(LASZIP_VLR_FORMAT, laszip_vlrs[0].record_data)[-1]
+    return chunk_size if 0 < chunk_size < LASZIP_VARIABLE_CHUNK_SIZE else None
 
 
-def run(filename: str, offset_scale, portion, queue, transformer):
+def memmap_points(filename: str, header: laspy.LasHeader) -> np.memmap:
+    """
+    Map the points of an uncompressed las file, with only the fields read by run: the integer coordinates,
+    the intensity and the colors.
+    """
+    record_dtype = header.point_format.dtype()
+    names = [name for name in ['X', 'Y', 'Z', 'intensity', 'red', 'green', 'blue'] if name in record_dtype.names]
+    dtype = np.dtype({
+        'names': names,
+        'formats': [record_dtype.fields[name][0] for name in names],
+        'offsets': [record_dtype.fields[name][1] for name in names],
+        'itemsize': record_dtype.itemsize,
+    })
+    return np.memmap(filename, dtype=dtype, mode='r', offset=header.offset_to_point_data, shape=(header.point_count,))
+
+
+def run(filename: str, offset_scale, portion, queue, transformer, batch_size: int = 100_000):
     """
     Reads points from a las file
     """
-    try:
-        with laspy.open(filename) as f:
+    read_ranges(filename, offset_scale, [portion], queue, transformer, batch_size)
 
-            point_count = portion[1] - portion[0]
 
-            step = min(point_count, max(point_count // 10, 100_000))
-
-            indices = [i for i in range(math.ceil(point_count / step))]
+def read_ranges(filename: str, offset_scale, ranges, queue, transformer, batch_size: int = 100_000):
+    """
+    Reads the points of the ranges [start, end[ of a las file, in order
+    """
+    try:
+        with laspy.open(filename) as f:
 
             color_scale = offset_scale[3]
 
-            for index in indices:
-                start_offset = portion[0] + index * step
-                num = min(step, portion[1] - start_offset)
-
-                # read scaled values and apply offset
-                f.seek(start_offset)
-                points = next(f.chunk_iterator(num))
-
-                x, y, z = points.x, points.y, points.z
-                if transformer:
-                    x, y, z = transformer.transform(x, y, z)
-
-                x = (x + offset_scale[0][0]) * offset_scale[1][0]
-                y = (y + offset_scale[0][1]) * offset_scale[1][1]
-                z = (z + offset_scale[0][2]) * offset_scale[1][2]
-
-                coords = np.vstack((x, y, z)).transpose()
-
-                if offset_scale[2] is not None:
-                    # Apply transformation matrix (because the tile's transform will contain
-                    # the inverse of this matrix)
-                    coords = np.dot(coords, offset_scale[2])
-
-                coords = np.ascontiguousarray(coords.astype(np.float32))
-
-                # Read colors
-
-                # todo: attributes
-                if 'red' in f.header.point_format.dimension_names:
-                    red = points['red']
-                    green = points['green']
-                    blue = points['blue']
-                else:
-                    red = points['intensity']
-                    green = points['intensity']
-                    blue = points['intensity']
-
-                if not color_scale:
-                    red = red.astype(np.uint8)
-                    green = green.astype(np.uint8)
-                    blue = blue.astype(np.uint8)
-                else:
-                    red = (red * color_scale).astype(np.uint8)
-                    green = (green * color_scale).astype(np.uint8)
-                    blue = (blue * color_scale).astype(np.uint8)
-
-                colors = np.vstack((red, green, blue)).transpose()
-
-                queue.send_multipart(
-                    [
-                        ResponseType.NEW_TASK.value,
-                        b'',
-                        pickle.dumps({'xyz': coords, 'rgb': colors}),
-                        struct.pack('>I', len(coords))
-                    ], copy=False)
+            # the uncompressed points are read in place
+            points_map = memmap_points(filename, f.header) if not f.header.are_points_compressed else None
+
+            for range_start, range_end in ranges:
+                point_count = range_end - range_start
+
+                step = min(point_count, batch_size)
+
+                indices = [i for i in range(math.ceil(point_count / step))]
+
+                if points_map is None:
+                    # the points are then read in sequence, each compressed chunk is decompressed once
+                    f.seek(range_start)
+
+                for index in indices:
+                    start_offset = range_start + index * step
+                    num = min(step, range_end - start_offset)
+
+                    # read scaled values and apply offset
+                    if points_map is not None:
+                        points = points_map[start_offset:start_offset + num]
+                        x, y, z = (
+                            points[name] * scale + offset
+                            for name, scale, offset in zip(['X', 'Y', 'Z'], f.header.scales, f.header.offsets)
+                        )
+                    else:
+                        points = f.read_points(num)
+                        x, y, z = points.x, points.y, points.z
+                    if transformer:
+                        x, y, z = transformer.transform(x, y, z)
+
+                    x = (x + offset_scale[0][0]) * offset_scale[1][0]
+                    y = (y + offset_scale[0][1]) * offset_scale[1][1]
+                    z = (z + offset_scale[0][2]) * offset_scale[1][2]
+
+                    # stacked as rows, so that the float32 coordinates are contiguous without another copy
+                    coords = np.stack((x, y, z), axis=1)
+
+                    if offset_scale[2] is not None:
+                        # Apply transformation matrix (because the tile's transform will contain
+                        # the inverse of this matrix)
+                        coords = np.dot(coords, offset_scale[2])
+
+                    coords = np.ascontiguousarray(coords.astype(np.float32))
+
+                    # Read colors
+
+                    # todo: attributes
+                    if 'red' in f.header.point_format.dimension_names:
+                        red = points['red']
+                        green = points['green']
+                        blue = points['blue']
+                    else:
+                        red = points['intensity']
+                        green = points['intensity']
+                        blue = points['intensity']
+
+                    if not color_scale:
+                        red = red.astype(np.uint8)
+                        green = green.astype(np.uint8)
+                        blue = blue.astype(np.uint8)
+                    else:
+                        red = (red * color_scale).astype(np.uint8)
+                        green = (green * color_scale).astype(np.uint8)
+                        blue = (blue * color_scale).astype(np.uint8)
+
+                    colors = np.stack((red, green, blue), axis=1)
+
+                    queue.send_multipart(
+                        [
+                            ResponseType.NEW_TASK.value,
+                            b'',
+                        ] + encode_point_batch(coords, colors), copy=False)
 
             queue.send_multipart([ResponseType.READ.value])
 
@@ -0,0 +1,57 @@
+import hashlib
+import os
+from pathlib import Path
+import pickle
+from typing import Any, Optional
+
+# change it when the format of the cached metadata changes
+CACHE_VERSION = 2
+
+
+def _get_entry_path(cache_dir: Path, path: Path, kind: str) -> Path:
+    key = hashlib.sha1(f'{kind}:{path.resolve()}'.encode()).hexdigest()
+    return Path(cache_dir) / f'{key}.pickle'
+
+
+def _get_file_key(path: Path) -> tuple:
+    stat = path.stat()
+    return str(path.resolve()), stat.st_mtime_ns, stat.st_size
+
+
+def load(cache_dir: Path, path: Path, kind: str) -> Optional[Any]:
+    """
+    Get the metadata of kind cached for the file at path, or None if the file has changed since.
+
+    :param cache_dir: The folder of the cache.
+    :param path: The file described by the metadata.
+    :param kind: The kind of metadata, e.g. the name of the reader that computes them.
+    """
+    try:
+        with _get_entry_path(cache_dir, path, kind).open('rb') as f:
+            entry = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+    if entry.get('version') != CACHE_VERSION or entry.get('file') != _get_file_key(path):
+        return None
+    return entry['metadata']
+
+
+def save(cache_dir: Path, path: Path, kind: str, metadata: Any) -> None:
+    """
+    Cache the metadata of kind computed for the file at path. The cache is only an optimization,
+    it isn't updated if the folder isn't writable.
+    """
+    entry_path = _get_entry_path(cache_dir, path, kind)
+    tmp_path = entry_path.with_suffix(f'.{os.getpid()}.tmp')
+    try:
+        entry_path.parent.mkdir(parents=True, exist_ok=True)
+        with tmp_path.open('wb') as f:
+            pickle.dump({
+                'version': CACHE_VERSION,
+                'file': _get_file_key(path),
+                'metadata': metadata,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_path.replace(entry_path)
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
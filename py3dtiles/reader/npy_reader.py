@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from py3dtiles.reader import metadata_cache
+from py3dtiles.utils import encode_point_batch, ResponseType
+
+# the names of the color fields of the points, by order of preference
+COLOR_FIELDS = [('red', 'green', 'blue'), ('diffuse_red', 'diffuse_green', 'diffuse_blue'), ('r', 'g', 'b')]
+INTENSITY_FIELDS = ['intensity', 'scalar_intensity']
+
+
+def load_points(path: Path) -> np.ndarray:
+    """
+    Map the structured array of a .npy file, with x, y and z fields.
+    """
+    points = np.load(path, mmap_mode='r', allow_pickle=False)
+    check_fields(path, points)
+    return points
+
+
+def check_fields(path: Path, points: np.ndarray) -> None:
+    if points.ndim != 1 or points.dtype.names is None or not {'x', 'y', 'z'}.issubset(points.dtype.names):
+        raise ValueError(f"The points of {path} should be a structured array with x, y and z fields, "
+                         f"currently {points.dtype} {points.shape}")
+
+
+def get_color_fields(dtype: np.dtype) -> Optional[tuple[str, str, str]]:
+    """
+    Get the names of the fields with the colors of the points, or of the intensity used as color,
+    None if the points have neither.
+    """
+    for fields in COLOR_FIELDS:
+        if set(fields).issubset(dtype.names):
+            return fields
+    for field in INTENSITY_FIELDS:
+        if field in dtype.names:
+            return field, field, field
+    return None
+
+
+def get_metadata(path: Path, color_scale=None, fraction: int = 100, cache_dir: Optional[Path] = None) -> dict:
+    """
+    :param cache_dir: If set, the metadata of the file are cached in this folder (see metadata_cache)
+        and reused while the file doesn't change.
+    """
+    return get_points_metadata(path, 'npy', load_points, color_scale, fraction, cache_dir)
+
+
+def get_points_metadata(path: Path, kind: str, load, color_scale=None, fraction: int = 100,
+                        cache_dir: Optional[Path] = None) -> dict:
+    """
+    Get the metadata of the points of a file mapped as a structured array.
+
+    :param kind: The name of the reader, to cache the metadata.
+    :param load: The function mapping the points of the file.
+    """
+    points_info = metadata_cache.load(cache_dir, path, kind) if cache_dir is not None else None
+    if points_info is None:
+        points_info = read_points_info(path, load(path))
+        if cache_dir is not None:
+            metadata_cache.save(cache_dir, path, kind, points_info)
+
+    point_count = points_info['point_count'] * fraction // 100
+    return {
+        # the manager splits the portion in reading jobs
+        'portions': [(str(path), (0, point_count))] if point_count > 0 else [],
+        'aabb': points_info['aabb'].copy(),
+        'color_scale': color_scale if color_scale else points_info['color_scale'],
+        'srs_in': None,
+        'point_count': point_count,
+        'avg_min': points_info['aabb'][0].copy(),
+    }
+
+
+def read_points_info(path: Path, points: np.ndarray) -> dict:
+    """
+    Compute the point count, the aabb and the color scale of the mapped points of a file.
+    """
+    if len(points) == 0:
+        raise ValueError(f"{path} has no points")
+
+    color_fields = get_color_fields(points.dtype)
+    color_scale = None
+    if color_fields is not None:
+        first_points = points[:10_000]
+        if max(np.max(first_points[field]) for field in color_fields) > 255:
+            color_scale = 1.0 / 255
+
+    return {
+        'point_count': len(points),
+        'aabb': np.array([
+            [np.min(points[axis]) for axis in ['x', 'y', 'z']],
+            [np.max(points[axis]) for axis in ['x', 'y', 'z']],
+        ], dtype=np.float64),
+        'color_scale': color_scale,
+    }
+
+
+def run(filename: str, offset_scale, portion, queue, transformer, batch_size: int = 100_000):
+    """
+    Reads points from a .npy file
+    """
+    read_points(load_points(Path(filename)), offset_scale, portion, queue, transformer, batch_size)
+
+
+def read_points(points: np.ndarray, offset_scale, portion, queue, transformer, batch_size: int = 100_000):
+    """
+    Reads the points of a portion of a structured array, the batches are views of the array.
+    """
+    color_scale = offset_scale[3]
+    color_fields = get_color_fields(points.dtype)
+
+    for start in range(portion[0], portion[1], batch_size):
+        batch = points[start:min(start + batch_size, portion[1])]
+        x, y, z = batch['x'], batch['y'], batch['z']
+
+        if transformer:
+            x, y, z = transformer.transform(x, y, z)
+
+        x = (x + offset_scale[0][0]) * offset_scale[1][0]
+        y = (y + offset_scale[0][1]) * offset_scale[1][1]
+        z = (z + offset_scale[0][2]) * offset_scale[1][2]
+
+        coords = np.stack((x, y, z), axis=1)
+
+        if offset_scale[2] is not None:
+            # Apply transformation matrix (because the tile's transform will contain
+            # the inverse of this matrix)
+            coords = np.dot(coords, offset_scale[2])
+
+        coords = np.ascontiguousarray(coords.astype(np.float32))
+
+        if color_fields is None:
+            colors = np.zeros((len(batch), 3), dtype=np.uint8)
+        else:
+            colors = np.stack([batch[field] for field in color_fields], axis=1)
+            if color_scale:
+                colors = colors * color_scale
+            colors = colors.astype(np.uint8)
+
+        queue.send_multipart(
+            [
+                ResponseType.NEW_TASK.value,
+                b'',
+            ] + encode_point_batch(coords, colors), copy=False)
+
+    queue.send_multipart([ResponseType.READ.value])
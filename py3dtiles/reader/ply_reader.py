@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from py3dtiles.reader import npy_reader
+
+# the types of the PLY properties, with their names of the version 1.0 and the usual aliases
+PLY_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+PLY_FORMATS = {'binary_little_endian': '<', 'binary_big_endian': '>'}
+# the header of a PLY file is short, a longer header is a sign of an invalid file
+MAX_HEADER_SIZE = 1024 * 1024
+
+
+def read_header(path: Path) -> tuple[np.dtype, int, int]:
+    """
+    Read the header of a binary PLY file.
+
+    Return the dtype of the vertex element, the offset of the vertices in the file and their count.
+    The elements before the vertices, if any, should have no list property.
+    """
+    with path.open('rb') as f:
+        if f.readline().rstrip(b'\r\n') != b'ply':
+            raise ValueError(f"{path} is not a PLY file")
+
+        byte_order = None
+        elements: list[tuple[str, int, list]] = []
+        while True:
+            line = f.readline()
+            if not line or f.tell() > MAX_HEADER_SIZE:
+                raise ValueError(f"The header of {path} has no end_header line")
+            words = line.decode('ascii', errors='replace').split()
+            if not words or words[0] in ('comment', 'obj_info'):
+                continue
+
+            if words[0] == 'end_header':
+                break
+            elif words[0] == 'format':
+                if len(words) != 3 or words[1] not in PLY_FORMATS:
+                    raise ValueError(f"The format of {path} should be binary_little_endian or binary_big_endian, "
+                                     f"currently {' '.join(words[1:])}")
+                byte_order = PLY_FORMATS[words[1]]
+            elif words[0] == 'element' and len(words) == 3:
+                elements.append((words[1], int(words[2]), []))
+            elif words[0] == 'property' and elements:
+                elements[-1][2].append(words[1:])
+            else:
+                raise ValueError(f"Invalid line {line!r} in the header of {path}")
+        data_offset = f.tell()
+
+    if byte_order is None:
+        raise ValueError(f"The header of {path} has no format line")
+
+    for name, count, properties in elements:
+        if any(property[0] == 'list' for property in properties):
+            if name == 'vertex':
+                raise ValueError(f"The vertices of {path} can't have list properties")
+            raise ValueError(f"The {name} element of {path} has list properties, it should be after the vertices")
+        for property in properties:
+            if len(property) != 2 or property[0] not in PLY_TYPES:
+                raise ValueError(f"Invalid property {' '.join(property)} in the header of {path}")
+
+        dtype = np.dtype([(property[1], byte_order + PLY_TYPES[property[0]]) for property in properties])
+        if name == 'vertex':
+            return dtype, data_offset, count
+        data_offset += dtype.itemsize * count
+
+    raise ValueError(f"{path} has no vertex element")
+
+
+def load_points(path: Path) -> np.ndarray:
+    """
+    Map the vertices of a binary PLY file, with x, y and z properties.
+    """
+    dtype, offset, count = read_header(path)
+    npy_reader.check_fields(path, np.zeros(0, dtype=dtype))
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    if offset + dtype.itemsize * count > path.stat().st_size:
+        raise ValueError(f"{path} is truncated, it should have {count} vertices")
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+
+def get_metadata(path: Path, color_scale=None, fraction: int = 100, cache_dir: Optional[Path] = None) -> dict:
+    """
+    :param cache_dir: If set, the metadata of the file are cached in this folder (see metadata_cache)
+        and reused while the file doesn't change.
+    """
+    return npy_reader.get_points_metadata(path, 'ply', load_points, color_scale, fraction, cache_dir)
+
+
+def run(filename: str, offset_scale, portion, queue, transformer, batch_size: int = 100_000):
+    """
+    Reads points from a binary PLY file
+    """
+    npy_reader.read_points(load_points(Path(filename)), offset_scale, portion, queue, transformer, batch_size)
@@ -1,35 +1,290 @@
-import math
+from __future__ import annotations
+
+import concurrent.futures
 from pathlib import Path
-import pickle
-import struct
+from typing import BinaryIO, Iterator, Optional
 
+from numba import njit
 import numpy as np
 
-from py3dtiles.utils import ResponseType
+from py3dtiles.reader import metadata_cache
+from py3dtiles.utils import encode_point_batch, ResponseType
+
+# the file is read by blocks of about this size, cut after their last line
+BLOCK_SIZE = 2 * 1024 * 1024
+# the seek offsets are saved every POINTS_PER_PORTION points
+POINTS_PER_PORTION = 1_000_000
+# the metadata of a file are scanned by byte ranges of at least MIN_RANGE_SIZE,
+# a few ranges per process to balance the load
+MIN_RANGE_SIZE = 64 * 1024 * 1024
+RANGES_PER_JOB = 4
+
+_NEWLINE = ord('\n')
+_CARRIAGE_RETURN = ord('\r')
+_SPACE = ord(' ')
+_TAB = ord('\t')
+_MINUS = ord('-')
+_PLUS = ord('+')
+_DOT = ord('.')
+_ZERO = ord('0')
+_NINE = ord('9')
+_LOWER_E = ord('e')
+_UPPER_E = ord('E')
+# the powers of ten exactly represented by a float64
+_POWERS_OF_TEN = np.array([10.0 ** i for i in range(23)])
+# the integers exactly represented by a float64
+_MAX_EXACT_MANTISSA = 2 ** 53
+# more digits would overflow the int64 mantissa
+_MAX_DIGITS = 18
+
+
+@njit(cache=True, nogil=True)
+def _is_separator(c):
+    return c == _SPACE or c == _TAB or c == _CARRIAGE_RETURN or c == _NEWLINE
+
+
+@njit(cache=True, nogil=True)
+def _parse_lines(data, points, line_starts, inexact):
+    """
+    Parse the lines of data in points (XYZIRGB columns) and the offsets of their lines in line_starts.
+    The lines with a number that can't be converted exactly are flagged in inexact.
+    Return the number of points, or -1 - the offset of the first invalid line.
+    """
+    point_count = 0
+    value_count = 0
+    line_inexact = False
+    line_start = 0
+    size = len(data)
+    i = 0
+    while i <= size:
+        c = data[i] if i < size else _NEWLINE
+
+        if c == _NEWLINE:
+            # the empty lines are skipped
+            if value_count > 0:
+                if value_count == 6:
+                    # XYZRGB
+                    for j in range(6, 3, -1):
+                        points[point_count, j] = points[point_count, j - 1]
+                    points[point_count, 3] = 0
+                elif value_count == 5 or value_count < 3:
+                    return -1 - line_start
+                line_starts[point_count] = line_start
+                inexact[point_count] = line_inexact
+                point_count += 1
+            value_count = 0
+            line_inexact = False
+            i += 1
+            line_start = i
+            continue
+
+        if _is_separator(c):
+            i += 1
+            continue
+
+        if value_count == 7:
+            return -1 - line_start
+
+        # a number: the digits are accumulated in an integer mantissa, so that the
+        # division by a power of ten gives the same result as float() for usual numbers
+        negative = c == _MINUS
+        if c == _MINUS or c == _PLUS:
+            i += 1
+        mantissa = 0
+        digit_count = 0
+        exponent = 0
+        has_digits = False
+        while i < size and _ZERO <= data[i] <= _NINE:
+            if digit_count < _MAX_DIGITS:
+                mantissa = mantissa * 10 + (data[i] - _ZERO)
+                if mantissa > 0:
+                    digit_count += 1
+            else:
+                exponent += 1
+                line_inexact = True
+            has_digits = True
+            i += 1
+        if i < size and data[i] == _DOT:
+            i += 1
+            while i < size and _ZERO <= data[i] <= _NINE:
+                if digit_count < _MAX_DIGITS:
+                    mantissa = mantissa * 10 + (data[i] - _ZERO)
+                    exponent -= 1
+                    if mantissa > 0:
+                        digit_count += 1
+                elif data[i] != _ZERO:
+                    line_inexact = True
+                has_digits = True
+                i += 1
+        if not has_digits:
+            return -1 - line_start
+        if i < size and (data[i] == _LOWER_E or data[i] == _UPPER_E):
+            i += 1
+            negative_exponent = i < size and data[i] == _MINUS
+            if i < size and (data[i] == _MINUS or data[i] == _PLUS):
+                i += 1
+            if i >= size or not _ZERO <= data[i] <= _NINE:
+                return -1 - line_start
+            written_exponent = 0
+            while i < size and _ZERO <= data[i] <= _NINE:
+                written_exponent = min(written_exponent * 10 + (data[i] - _ZERO), 1000)
+                i += 1
+            exponent += -written_exponent if negative_exponent else written_exponent
+        if i < size and not _is_separator(data[i]):
+            return -1 - line_start
+
+        # the product or the quotient of two exact floats is correctly rounded,
+        # the other numbers are converted by the caller
+        if mantissa > _MAX_EXACT_MANTISSA or abs(exponent) >= len(_POWERS_OF_TEN):
+            line_inexact = True
+            exponent = 0
+        value = float(mantissa)
+        if exponent < 0:
+            value /= _POWERS_OF_TEN[-exponent]
+        elif exponent > 0:
+            value *= _POWERS_OF_TEN[exponent]
+        points[point_count, value_count] = -value if negative else value
+        value_count += 1
+
+    return point_count
+
+
+def parse_lines(block: bytes) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Parse complete lines of a xyz file, with 3 (XYZ), 4 (XYZI), 6 (XYZRGB) or 7 (XYZIRGB)
+    numbers separated by spaces. The layouts of the lines can be mixed and the empty lines are skipped.
+
+    Return an array of shape (point count, 7) with the XYZIRGB columns, the missing columns are 0,
+    and the offsets in the block of the line of each point.
+    """
+    data = np.frombuffer(block, dtype=np.uint8)
+    line_count = block.count(b'\n') + 1
+    points = np.zeros((line_count, 7))
+    line_starts = np.zeros(line_count, dtype=np.int64)
+    inexact = np.zeros(line_count, dtype=np.bool_)
+
+    point_count = _parse_lines(data, points, line_starts, inexact)
+    if point_count < 0:
+        line = _get_line(block, -1 - point_count)
+        raise ValueError(f'Invalid xyz line {line!r}, the lines should have 3, 4, 6 or 7 numbers separated by spaces')
+
+    # very long or very small numbers, converted like float() does
+    for i in np.flatnonzero(inexact[:point_count]):
+        values = [float(value) for value in _get_line(block, line_starts[i]).split()]
+        points[i] = 0
+        if len(values) == 6:
+            points[i, :3] = values[:3]
+            points[i, 4:] = values[3:]
+        else:
+            points[i, :len(values)] = values
+
+    return points[:point_count], line_starts[:point_count]
+
+
+def _get_line(block: bytes, start: int) -> bytes:
+    end = block.find(b'\n', start)
+    return block[start:end if end >= 0 else len(block)]
+
+
+def read_blocks(f: BinaryIO, block_size: int = BLOCK_SIZE, size: Optional[int] = None) -> Iterator[tuple[int, bytes]]:
+    """
+    Read a file from its current position by blocks of complete lines.
+    Yield the offset of each block in the file and its content.
+
+    :param size: If set, stop after size bytes, which should end with a complete line.
+    """
+    offset = f.tell()
+    remainder = b''
+    while True:
+        data = f.read(block_size if size is None else min(block_size, size))
+        if size is not None:
+            size -= len(data)
+        if not data:
+            if remainder:
+                yield offset, remainder
+            return
+
+        data = remainder + data
+        end = data.rfind(b'\n') + 1
+        if end == 0:
+            # a line longer than a block
+            remainder = data
+            continue
+
+        yield offset, data[:end]
+        offset += end
+        remainder = data[end:]
+
+
+def read_points(f: BinaryIO, point_count: int, batch_size: int) -> Iterator[np.ndarray]:
+    """
+    Read point_count points from the current position of the file, by batches of batch_size points.
+    """
+    pending = []
+    pending_count = 0
+    read_count = 0
+    for _, block in read_blocks(f):
+        points = parse_lines(block)[0][:point_count - read_count]
+        read_count += len(points)
+        pending.append(points)
+        pending_count += len(points)
+
+        if pending_count >= batch_size:
+            points = np.concatenate(pending)
+            batch_end = len(points) - len(points) % batch_size
+            for start in range(0, batch_end, batch_size):
+                yield points[start:start + batch_size]
+            pending = [points[batch_end:]]
+            pending_count = len(pending[0])
+
+        if read_count >= point_count:
+            break
+
+    if pending_count:
+        yield np.concatenate(pending)
+
+
+def split_in_ranges(path: Path, range_count: int) -> list[tuple[int, int]]:
+    """
+    Split a file in range_count byte ranges [start, end[ of about the same size, starting at a line.
+    """
+    size = path.stat().st_size
+    starts = [0]
+    with path.open('rb') as f:
+        for i in range(1, range_count):
+            # the next line starting at or after the approximate start
+            f.seek(max(size * i // range_count - 1, starts[-1]))
+            f.readline()
+            if f.tell() >= size:
+                break
+            if f.tell() > starts[-1]:
+                starts.append(f.tell())
+
+    return list(zip(starts, starts[1:] + [size]))
 
-def get_metadata(path: Path, color_scale=None, fraction: int =100) -> dict:
+
+def scan_range(path: Path, start: int, end: int) -> tuple[int, Optional[np.ndarray], list[int]]:
+    """
+    Scan the lines of the byte range [start, end[ of a file.
+    Return their point count, their aabb (None without points) and the offset of every POINTS_PER_PORTION-th point.
+    """
     aabb = None
     count = 0
     seek_values = []
 
-    with path.open() as f:
-        while True:
-            batch = 10_000
-            points = np.zeros((batch, 3))
-
-            offset = f.tell()
-            for i in range(batch):
-                line = f.readline()
-                if not line:
-                    points = np.resize(points, (i, 3))
-                    break
-                points[i] = [float(s) for s in line.split(" ")][:3]
-
+    with path.open('rb') as f:
+        f.seek(start)
+        for offset, block in read_blocks(f, size=end - start):
+            points, line_starts = parse_lines(block)
+            points = points[:, :3]
             if points.shape[0] == 0:
-                break
+                continue
 
-            if not count % 1_000_000:
-                seek_values += [offset]
+            # the offsets of the lines starting a portion
+            seek_values += [
+                offset + int(line_starts[i])
+                for i in range(-count % POINTS_PER_PORTION, points.shape[0], POINTS_PER_PORTION)
+            ]
 
             count += points.shape[0]
             batch_aabb = np.array([
@@ -43,22 +298,74 @@ def get_metadata(path: Path, color_scale=None, fraction: int =100) -> dict:
                 aabb[0] = np.minimum(aabb[0], batch_aabb[0])
                 aabb[1] = np.maximum(aabb[1], batch_aabb[1])
 
-        # We need an exact point count
-        point_count = count * fraction / 100
+    return count, aabb, seek_values
 
-        _1M = min(count, 1_000_000)
-        steps = math.ceil(count / _1M)
-        if steps != len(seek_values):
-            raise ValueError("the size of seek_values should be equal to steps,"
-                             f"currently steps = {steps} and len(seek_values) = {len(seek_values)}")
-        portions = [
-            (i * _1M, min(count, (i + 1) * _1M), seek_values[i]) for i in range(steps)
-        ]
 
-        pointcloud_file_portions = [
-            (str(path), p) for p in portions
+def scan(path: Path, jobs: int = 1) -> dict:
+    """
+    Scan a xyz file to get its point count, its aabb and its portions (start, end, seek offset)
+    of at most POINTS_PER_PORTION points.
+
+    :param jobs: The number of processes scanning the byte ranges of a big file in parallel.
+    """
+    range_count = max(1, min(jobs * RANGES_PER_JOB, path.stat().st_size // MIN_RANGE_SIZE))
+    ranges = split_in_ranges(path, range_count)
+    if len(ranges) == 1:
+        scans = [scan_range(path, *ranges[0])]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(jobs, len(ranges))) as executor:
+            scans = list(executor.map(scan_range, *zip(*[(path, start, end) for start, end in ranges])))
+
+    # merge the scans of the ranges, a range can end with a portion smaller than POINTS_PER_PORTION
+    aabb = None
+    count = 0
+    portions = []
+    for range_point_count, range_aabb, seek_values in scans:
+        if range_aabb is None:
+            continue
+
+        portions += [
+            (count + i * POINTS_PER_PORTION, count + min(range_point_count, (i + 1) * POINTS_PER_PORTION), seek_value)
+            for i, seek_value in enumerate(seek_values)
         ]
+        count += range_point_count
+        if aabb is None:
+            aabb = range_aabb
+        else:
+            aabb[0] = np.minimum(aabb[0], range_aabb[0])
+            aabb[1] = np.maximum(aabb[1], range_aabb[1])
+
+    if aabb is None:
+        raise ValueError(f"{path} has no points")
 
+    return {
+        'point_count': count,
+        'aabb': aabb,
+        'portions': portions,
+    }
+
+
+def get_metadata(path: Path, color_scale=None, fraction: int = 100, jobs: int = 1,
+                 cache_dir: Optional[Path] = None) -> dict:
+    """
+    :param jobs: The number of processes scanning a big file in parallel.
+    :param cache_dir: If set, the scan of the file is cached in this folder (see metadata_cache)
+        and reused while the file doesn't change.
+    """
+    file_scan = metadata_cache.load(cache_dir, path, 'xyz') if cache_dir is not None else None
+    if file_scan is None:
+        file_scan = scan(path, jobs)
+        if cache_dir is not None:
+            metadata_cache.save(cache_dir, path, 'xyz', file_scan)
+
+    # We need an exact point count
+    point_count = file_scan['point_count'] * fraction / 100
+
+    pointcloud_file_portions = [
+        (str(path), p) for p in file_scan['portions']
+    ]
+
+    aabb = file_scan['aabb'].copy()
     return {
         "portions": pointcloud_file_portions,
         "aabb": aabb,
@@ -68,7 +375,8 @@ def get_metadata(path: Path, color_scale=None, fraction: int =100) -> dict:
         "avg_min": aabb[0],
     }
 
-def run(filename: str, offset_scale, portion, queue, transformer):
+
+def run(filename: str, offset_scale, portion, queue, transformer, batch_size: int = 100_000):
     """
     Reads points from a xyz file
 
@@ -82,32 +390,17 @@ def run(filename: str, offset_scale, portion, queue, transformer):
     (*) See: https://docs.safe.com/fme/html/FME_Desktop_Documentation/FME_ReadersWriters/pointcloudxyz/pointcloudxyz.htm
     """
     try:
-        with open(filename) as f:
+        with open(filename, 'rb') as f:
 
             point_count = portion[1] - portion[0]
 
-            step = min(point_count, max((point_count) // 10, 100000))
+            step = min(point_count, batch_size)
 
             f.seek(portion[2])
 
-            feature_nb = 7
-
-            for _ in range(0, point_count, step):
-                points = np.zeros((step, feature_nb), dtype=np.float32)
-
-                for j in range(0, step):
-                    line = f.readline()
-                    if not line:
-                        points = np.resize(points, (j, feature_nb))
-                        break
-                    line_features = [float(s) for s in line.split(" ")]
-                    if len(line_features) == 3:
-                        line_features += [None] * 4  # Insert intensity and RGB
-                    elif len(line_features) == 4:
-                        line_features += [None] * 3  # Insert RGB
-                    elif len(line_features) == 6:
-                        line_features.insert(3, None)  # Insert intensity
-                    points[j] = line_features
+            for points in read_points(f, point_count, step):
+                # the coordinates are read as float32
+                points = points.astype(np.float32)
 
                 x, y, z = (points[:, c] for c in [0, 1, 2])
 
@@ -134,9 +427,7 @@ def run(filename: str, offset_scale, portion, queue, transformer):
                     [
                         ResponseType.NEW_TASK.value,
                         b"",
-                        pickle.dumps({"xyz": coords, "rgb": colors}),
-                        struct.pack(">I", len(coords)),
-                    ],
+                    ] + encode_point_batch(coords, colors),
                     copy=False,
                 )
 
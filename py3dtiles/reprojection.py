@@ -0,0 +1,130 @@
+from __future__ import annotations
+
+from numba import njit
+import numpy as np
+from pyproj import Transformer
+
+# below this number of points, the exact transformation is cheaper than the lattice
+MIN_POINT_COUNT = 4096
+# the number of points of a batch transformed exactly to check the error of the interpolation
+SAMPLE_COUNT = 256
+# the number of cells of the first lattice along x, y and z, then refined along x and y until the error is small enough
+INITIAL_CELL_COUNT = (8, 8, 2)
+MAX_HORIZONTAL_CELL_COUNT = 256
+
+
+@njit(cache=True, nogil=True)
+def _interpolate(x, y, z, origin, inv_step, cell_count, lattice):
+    """
+    Trilinear interpolation of the values of a lattice (with a shape (cell count + 1) x 3) at the points x, y, z.
+    """
+    # the strides of the nodes in the flattened lattice
+    stride_y = cell_count[2] + 1
+    stride_x = (cell_count[1] + 1) * stride_y
+    nodes = lattice.reshape((-1, 3))
+
+    result = np.empty((len(x), 3))
+    for i in range(len(x)):
+        fx = (x[i] - origin[0]) * inv_step[0]
+        fy = (y[i] - origin[1]) * inv_step[1]
+        fz = (z[i] - origin[2]) * inv_step[2]
+        # the points on the upper bounds are in the last cells
+        ix = min(max(int(fx), 0), cell_count[0] - 1)
+        iy = min(max(int(fy), 0), cell_count[1] - 1)
+        iz = min(max(int(fz), 0), cell_count[2] - 1)
+        tx = fx - ix
+        ty = fy - iy
+        tz = fz - iz
+
+        # the weights of the corners of the cell
+        w000 = (1 - tx) * (1 - ty) * (1 - tz)
+        w100 = tx * (1 - ty) * (1 - tz)
+        w010 = (1 - tx) * ty * (1 - tz)
+        w110 = tx * ty * (1 - tz)
+        w001 = (1 - tx) * (1 - ty) * tz
+        w101 = tx * (1 - ty) * tz
+        w011 = (1 - tx) * ty * tz
+        w111 = tx * ty * tz
+
+        n = ix * stride_x + iy * stride_y + iz
+        for c in range(3):
+            result[i, c] = (
+                w000 * nodes[n, c] + w100 * nodes[n + stride_x, c]
+                + w010 * nodes[n + stride_y, c] + w110 * nodes[n + stride_x + stride_y, c]
+                + w001 * nodes[n + 1, c] + w101 * nodes[n + stride_x + 1, c]
+                + w011 * nodes[n + stride_y + 1, c] + w111 * nodes[n + stride_x + stride_y + 1, c]
+            )
+    return result
+
+
+class InterpolatedTransformer:
+    """
+    Approximate a pyproj Transformer by transforming a coarse lattice over the bounding box of each batch
+    of points, and by interpolating the points in the lattice.
+
+    The error of the interpolation is measured on a sample of the points and on the centers of the
+    lattice cells, which are transformed exactly. The lattice is refined until this error is below
+    max_error, and the points are transformed exactly if the lattice would be too big.
+    """
+
+    def __init__(self, transformer: Transformer, max_error: float) -> None:
+        """
+        :param transformer: The exact transformation.
+        :param max_error: The maximum distance between the interpolated and the exact points,
+            in the unit of the output CRS.
+        """
+        if max_error <= 0:
+            raise ValueError(f"max_error should be strictly positive, currently {max_error}")
+        self.transformer = transformer
+        self.max_error = max_error
+
+    def transform(self, x, y, z) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        z = np.asarray(z, dtype=np.float64)
+        if len(x) < MIN_POINT_COUNT:
+            return self.transformer.transform(x, y, z)
+
+        origin = np.array([x.min(), y.min(), z.min()])
+        size = np.array([x.max(), y.max(), z.max()]) - origin
+        # a flat bounding box still has one cell
+        size[size == 0] = 1
+
+        sample = np.linspace(0, len(x) - 1, SAMPLE_COUNT).astype(np.int64)
+        sample_xyz = np.vstack((x[sample], y[sample], z[sample]))
+        cell_count = np.array(INITIAL_CELL_COUNT)
+        while True:
+            node_count = np.prod(cell_count + 1)
+            if node_count > len(x) // 4:
+                # the lattice costs as much as the exact transformation
+                return self.transformer.transform(x, y, z)
+
+            step = size / cell_count
+            inv_step = 1 / step
+            lattice = self._transform_lattice(origin, step, cell_count)
+
+            # the interpolation error is usually the biggest at the centers of the cells
+            centers = np.stack(np.meshgrid(
+                *[origin[axis] + (np.arange(cell_count[axis]) + 0.5) * step[axis] for axis in range(3)], indexing='ij'
+            )).reshape((3, -1))
+            check_xyz = np.hstack((sample_xyz, centers))
+            exact = np.vstack(self.transformer.transform(*check_xyz)).T
+            interpolated = _interpolate(*check_xyz, origin, inv_step, cell_count, lattice)
+            error = np.max(np.linalg.norm(interpolated - exact, axis=1))
+            # a nan error, e.g. out of the domain of the CRS, is also too big
+            if error <= self.max_error:
+                break
+
+            if cell_count[0] >= MAX_HORIZONTAL_CELL_COUNT:
+                return self.transformer.transform(x, y, z)
+            cell_count = cell_count * np.array([2, 2, 1])
+
+        result = _interpolate(x, y, z, origin, inv_step, cell_count, lattice)
+        return result[:, 0], result[:, 1], result[:, 2]
+
+    def _transform_lattice(self, origin: np.ndarray, step: np.ndarray, cell_count: np.ndarray) -> np.ndarray:
+        nodes = np.meshgrid(
+            *[origin[axis] + np.arange(cell_count[axis] + 1) * step[axis] for axis in range(3)], indexing='ij'
+        )
+        lattice = np.stack(self.transformer.transform(*[axis.ravel() for axis in nodes]), axis=-1)
+        return lattice.reshape(tuple(cell_count + 1) + (3,))
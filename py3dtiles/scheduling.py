@@ -0,0 +1,207 @@
+"""
+The scheduling of the jobs of a conversion by the manager: the order of the nodes to process,
+the nodes waiting to be written and the size of the jobs.
+"""
+from __future__ import annotations
+
+import heapq
+from typing import List, Optional
+
+from py3dtiles.utils import CommandType
+
+
+class NodeNameTrie:
+    """
+    A set of node names stored as a trie, to find the names starting with a given prefix
+    without going through the whole set.
+    """
+    # the key of the trie nodes marking the end of a name
+    END = -1
+
+    def __init__(self, names=()):
+        self.root = {}
+        self.count = 0
+        for name in names:
+            self.add(name)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, name):
+        node = self.root
+        for char in name:
+            node = node.get(char)
+            if node is None:
+                return False
+        return NodeNameTrie.END in node
+
+    def __iter__(self):
+        stack = [(b'', self.root)]
+        while stack:
+            prefix, node = stack.pop()
+            for char, child in node.items():
+                if char == NodeNameTrie.END:
+                    yield prefix
+                else:
+                    stack.append((prefix + bytes([char]), child))
+
+    def add(self, name):
+        node = self.root
+        for char in name:
+            node = node.setdefault(char, {})
+        if NodeNameTrie.END not in node:
+            node[NodeNameTrie.END] = True
+            self.count += 1
+
+    def remove(self, name):
+        path = [self.root]
+        for char in name:
+            path.append(path[-1][char])
+        del path[-1][NodeNameTrie.END]
+        self.count -= 1
+
+        # remove the trie nodes without name
+        for i in range(len(name) - 1, -1, -1):
+            if path[i + 1]:
+                break
+            del path[i][name[i]]
+
+    def pop_descendants(self, name, is_blocked):
+        """
+        Remove and return name and its descendants in the set.
+        is_blocked(prefix) is called on name and its descendant prefixes, the names
+        starting with a blocked prefix are kept.
+        """
+        node = self.root
+        for char in name:
+            node = node.get(char)
+            if node is None:
+                return []
+
+        result = []
+        stack = [(name, node)]
+        while stack:
+            prefix, node = stack.pop()
+            if is_blocked(prefix):
+                continue
+            for char, child in node.items():
+                if char == NodeNameTrie.END:
+                    result.append(prefix)
+                else:
+                    stack.append((prefix + bytes([char]), child))
+
+        for descendant in result:
+            self.remove(descendant)
+        return result
+
+
+class JobSizeController:
+    """
+    Size the reading and processing jobs from the throughput measured on the previous jobs.
+    A job should last about target_duration seconds: long enough so that the manager isn't
+    flooded with small messages, short enough to balance the load between the workers.
+    """
+    def __init__(self,
+                 target_duration: float = 0.5,
+                 read_count: int = 1_000_000,
+                 process_count: int = 100_000,
+                 smoothing: float = 0.3):
+        self.target_duration = target_duration
+        self.smoothing = smoothing
+        # current job size, min and max, by command
+        self.sizes = {
+            CommandType.READ_FILE.value: [read_count, 100_000, 10_000_000],
+            CommandType.PROCESS_JOBS.value: [process_count, 10_000, 2_000_000],
+        }
+        # smoothed throughput in points per second, by command
+        self.rates = {}
+
+    @property
+    def read_count(self) -> int:
+        return self.sizes[CommandType.READ_FILE.value][0]
+
+    @property
+    def process_count(self) -> int:
+        return self.sizes[CommandType.PROCESS_JOBS.value][0]
+
+    def get_process_count(self, pending_point_count: int, idle_worker_count: int) -> int:
+        """
+        The size of the next processing job. The throughput only gives the size of a job when there are
+        enough pending points to keep the workers busy. Otherwise the idle workers would wait while a few
+        of them process all the pending points, so these points are shared between the idle workers.
+        """
+        return min(self.process_count, pending_point_count // max(1, idle_worker_count) + 1)
+
+    def update(self, command: bytes, point_count: int, duration: float):
+        if command not in self.sizes or point_count <= 0 or duration <= 0:
+            return
+
+        rate = point_count / duration
+        if command in self.rates:
+            rate = self.smoothing * rate + (1 - self.smoothing) * self.rates[command]
+        self.rates[command] = rate
+
+        size = self.sizes[command]
+        size[0] = int(min(max(rate * self.target_duration, size[1]), size[2]))
+
+
+class NodeScheduler:
+    """
+    Priority queue of the nodes waiting to be processed. The nodes closest to the root
+    are popped first, then the ones with the most points, then by name so that
+    neighbour nodes are processed together.
+
+    The heap entries aren't updated in place: a push adds a new entry, and the
+    outdated ones are skipped when popped.
+    """
+    def __init__(self):
+        self.heap = []
+        # point count of the valid heap entry of each scheduled node
+        self.point_counts = {}
+        self.total_point_count = 0
+        # the scheduled nodes by parent name
+        self.siblings = {}
+
+    def __len__(self):
+        return len(self.point_counts)
+
+    def __contains__(self, name):
+        return name in self.point_counts
+
+    def push(self, name: bytes, point_count: int):
+        """
+        Schedule a node, or update its point count if it is already scheduled.
+        """
+        self.total_point_count += point_count - self.point_counts.get(name, 0)
+        self.point_counts[name] = point_count
+        heapq.heappush(self.heap, (len(name), -point_count, name))
+        if name:
+            self.siblings.setdefault(name[:-1], set()).add(name)
+
+        if len(self.heap) > 4 * len(self.point_counts) + 1024:
+            self.heap = [(len(name), -count, name) for name, count in self.point_counts.items()]
+            heapq.heapify(self.heap)
+
+    def remove(self, name: bytes):
+        self.total_point_count -= self.point_counts.pop(name)
+        if name:
+            siblings = self.siblings[name[:-1]]
+            siblings.discard(name)
+            if not siblings:
+                del self.siblings[name[:-1]]
+
+    def pop(self) -> Optional[bytes]:
+        while self.heap:
+            _, point_count, name = heapq.heappop(self.heap)
+            if self.point_counts.get(name) == -point_count:
+                self.remove(name)
+                return name
+        return None
+
+    def pop_siblings(self, name: bytes) -> List[bytes]:
+        if not name:
+            return []
+        siblings = sorted(self.siblings.pop(name[:-1], []))
+        for sibling in siblings:
+            self.total_point_count -= self.point_counts.pop(sibling)
+        return siblings
@@ -1,4 +1,4 @@
 from . import node_process
-from .node import DummyNode, Node
+from .node import DummyNode, Node, split_nodes
 from .points_grid import Grid
 from .shared_node_store import SharedNodeStore
@@ -21,6 +21,40 @@ def xyz_to_child_index(xyz, aabb_center):
     return np.sum(np.left_shift(test, np.array([2, 1, 0])), axis=1)
 
 
+@njit(cache=True, nogil=True)
+def count_child_indices(xyz, aabb_center, counts):
+    """
+    Compute the child index of each point (see xyz_to_child_index) and add the point count of each child to counts.
+    """
+    indices = np.empty(xyz.shape[0], dtype=np.int8)
+    for i in range(xyz.shape[0]):
+        index = 0
+        if xyz[i, 0] >= aabb_center[0]:
+            index |= 4
+        if xyz[i, 1] >= aabb_center[1]:
+            index |= 2
+        if xyz[i, 2] >= aabb_center[2]:
+            index |= 1
+        indices[i] = index
+        counts[index] += 1
+    return indices
+
+
+@njit(cache=True, nogil=True)
+def scatter_by_child(xyz, rgb, indices, offsets, out_xyz, out_rgb):
+    """
+    Copy each point at the offset of its child in out_xyz and out_rgb, then increment this offset.
+    The points of a child keep their order.
+    """
+    for i in range(xyz.shape[0]):
+        index = indices[i]
+        j = offsets[index]
+        for axis in range(3):
+            out_xyz[j, axis] = xyz[i, axis]
+            out_rgb[j, axis] = rgb[i, axis]
+        offsets[index] = j + 1
+
+
 @njit("int32[:](float32[:,:], int32[:], float32[:], float32[:], int32)", cache=True, nogil=True)
 def xyz_to_key(xyz, cell_count, aabb_min, inv_aabb_size, shift):
     a = ((cell_count * inv_aabb_size) * (xyz - aabb_min)).astype(np.int64)
@@ -30,3 +64,44 @@ def xyz_to_key(xyz, cell_count, aabb_min, inv_aabb_size, shift):
     a[:, 1] <<= shift
     a[:, 2] <<= (2 * shift)
     return np.sum(a, axis=1).astype(np.int32)
+
+
+# the slots of the voxel hash tables without voxel
+EMPTY_VOXEL_SLOT = -1
+
+
+@njit(cache=True, nogil=True)
+def find_voxel_slot(voxel_keys, k, vx, vy, vz):
+    """
+    Find the slot of the voxel (vx, vy, vz) of the cell k in an open addressing hash table,
+    or the empty slot where it should be added. The keys of the table are rows (k, vx, vy, vz),
+    its size is a power of two and it always has empty slots.
+    """
+    mask = voxel_keys.shape[0] - 1
+    slot = ((k * 73856093) ^ (vx * 19349663) ^ (vy * 83492791) ^ (vz * 50331653)) & mask
+    while voxel_keys[slot, 0] != EMPTY_VOXEL_SLOT and (
+            voxel_keys[slot, 0] != k or voxel_keys[slot, 1] != vx
+            or voxel_keys[slot, 2] != vy or voxel_keys[slot, 3] != vz):
+        slot = (slot + 1) & mask
+    return slot
+
+
+@njit(fastmath=True, cache=True, nogil=True)
+def is_point_far_enough_in_voxels(points, point_next, voxel_keys, voxel_heads, k, vx, vy, vz,
+                                  tested_point, squared_min_distance):
+    """
+    Same test as is_point_far_enough, only on the points in the 27 voxels around the voxel (vx, vy, vz)
+    of the tested point. The points of a voxel are chained from the head of its slot by point_next,
+    and the voxels are at least as big as the minimum distance.
+    """
+    for dx in range(-1, 2):
+        for dy in range(-1, 2):
+            for dz in range(-1, 2):
+                i = voxel_heads[find_voxel_slot(voxel_keys, k, vx + dx, vy + dy, vz + dz)]
+                while i >= 0:
+                    if (tested_point[0] - points[i][0]) ** 2 + \
+                       (tested_point[1] - points[i][1]) ** 2 + \
+                       (tested_point[2] - points[i][2]) ** 2 < squared_min_distance:
+                        return False
+                    i = point_next[i]
+    return True
@@ -3,7 +3,7 @@ from __future__ import annotations
 import concurrent.futures
 import json
 from pathlib import Path
-import pickle
+import struct
 from typing import Iterator, TYPE_CHECKING
 
 import numpy as np
@@ -12,26 +12,84 @@ from py3dtiles.tilers.pnts import MIN_POINT_SIZE
 from py3dtiles.tilers.pnts.pnts_writer import points_to_pnts
 from py3dtiles.tileset.feature_table import SemanticPoint
 from py3dtiles.tileset.utils import TileContentReader
-from py3dtiles.utils import aabb_size_to_subdivision_type, node_from_name, node_name_to_path, SubdivisionType
-from .distance import xyz_to_child_index
+from py3dtiles.utils import (
+    aabb_size_to_subdivision_type, encode_point_batch, node_from_name, node_name_to_path, SubdivisionType
+)
+from .distance import count_child_indices, scatter_by_child
 from .points_grid import Grid
 
 if TYPE_CHECKING:
     from .node_catalog import NodeCatalog
 
 
+# A serialized node is a record of NODE_HEADER (version, flags, children bitmask, name length, point count),
+# followed by the name, then for an inner node GRID_HEADER (cell count, key count, squared spacing) and the point
+# count of each of the key count cells, then the coordinates and the colors of the points. The sections are aligned,
+# so that the arrays can be read without copy from an aligned buffer of records.
+NODE_VERSION = 2
+NODE_HEADER = struct.Struct('<BBBxHI')
+GRID_HEADER = struct.Struct('<3iId')
+NODE_INNER_FLAG = 1
+NODE_ALIGNMENT = 8
+# a leaf is split when it has this many points, unless its spacing is lower than MIN_NODE_SPACING (before scaling)
+MAX_LEAF_POINT_COUNT = 20_000
+MIN_NODE_SPACING = 0.001
+
+
+def _align(size: int) -> int:
+    return -(-size // NODE_ALIGNMENT) * NODE_ALIGNMENT
+
+
 def node_to_tileset(args):
     return Node.to_tileset(None, args[0], args[1], args[2], args[3], args[4])
 
 
 class DummyNode:
-    def __init__(self, _bytes):
-        if 'children' in _bytes:
-            self.children = _bytes['children']
-            self.grid = _bytes['grid']
+    """
+    A serialized node read without copy (see Node.save_to_bytes).
+    The arrays are views of data, they are only writable if data is.
+    """
+    def __init__(self, data, offset: int = 0):
+        start = offset
+        version, flags, children_mask, name_length, point_count = NODE_HEADER.unpack_from(data, offset)
+        if version != NODE_VERSION:
+            raise ValueError(f'Unsupported node version {version}, expected {NODE_VERSION}')
+        self.name = bytes(data[offset + NODE_HEADER.size:offset + NODE_HEADER.size + name_length])
+        offset += _align(NODE_HEADER.size + name_length)
+
+        if flags & NODE_INNER_FLAG:
+            self.children = [self.name + str(i).encode('ascii') for i in range(8) if children_mask & (1 << i)]
+            *cell_count, key_count, self.spacing = GRID_HEADER.unpack_from(data, offset)
+            self.cell_count = np.array(cell_count, dtype=np.int32)
+            offset += GRID_HEADER.size
+            self.cell_counts = np.frombuffer(data, dtype='<u4', count=key_count, offset=offset)
+            offset += self.cell_counts.nbytes
         else:
             self.children = None
-            self.points = _bytes['points']
+
+        self.points_offset = offset
+        self.xyz = np.frombuffer(data, dtype=np.float32, count=3 * point_count, offset=offset).reshape((point_count, 3))
+        self.rgb = np.frombuffer(data, dtype=np.uint8, count=3 * point_count, offset=offset + self.xyz.nbytes).reshape(
+            (point_count, 3))
+        self.data = data
+        self.end = offset + _align(self.xyz.nbytes + self.rgb.nbytes)
+        # the bytes of the serialized node
+        self.record = memoryview(data)[start:self.end]
+
+    def get_points(self, include_rgb: bool) -> np.ndarray:
+        size = self.xyz.nbytes + (self.rgb.nbytes if include_rgb else 0)
+        return np.frombuffer(self.data, dtype=np.uint8, count=size, offset=self.points_offset)
+
+
+def split_nodes(data) -> Iterator[DummyNode]:
+    """
+    Read the serialized nodes concatenated in data (see NodeCatalog.dump).
+    """
+    offset = 0
+    while offset < len(data):
+        node = DummyNode(data, offset)
+        yield node
+        offset = node.end
 
 
 class Node:
@@ -56,24 +114,63 @@ class Node:
         self.points = []
         self.dirty = False
 
-    def save_to_bytes(self) -> bytes:
-        sub_pickle = {}
+    def save_to_bytes(self) -> bytearray:
+        """
+        Serialize the node to a binary record, read by load_from_bytes or DummyNode.
+        """
+        flags = 0
+        children_mask = 0
+        grid_header = b''
+        key_count = 0
         if self.children is not None:
-            sub_pickle['children'] = self.children
-            sub_pickle['grid'] = self.grid
+            flags = NODE_INNER_FLAG
+            for child in self.children:
+                children_mask |= 1 << int(child[len(self.name):])
+            key_count = len(self.grid.cell_counts)
+            grid_header = GRID_HEADER.pack(*self.grid.cell_count.tolist(), key_count, self.grid.spacing)
+            point_count = self.grid.get_point_count()
         else:
-            sub_pickle['points'] = self.points
-
-        d = pickle.dumps(sub_pickle)
-        return d
+            point_count = sum(xyz.shape[0] for xyz, _ in self.points)
+
+        grid_offset = _align(NODE_HEADER.size + len(self.name))
+        points_offset = grid_offset + len(grid_header) + 4 * key_count
+        record = bytearray(points_offset + _align(15 * point_count))
+        NODE_HEADER.pack_into(record, 0, NODE_VERSION, flags, children_mask, len(self.name), point_count)
+        record[NODE_HEADER.size:NODE_HEADER.size + len(self.name)] = self.name
+        xyz = np.frombuffer(record, dtype=np.float32, count=3 * point_count, offset=points_offset).reshape(
+            (point_count, 3))
+        rgb = np.frombuffer(record, dtype=np.uint8, count=3 * point_count, offset=points_offset + xyz.nbytes).reshape(
+            (point_count, 3))
 
-    def load_from_bytes(self, byt: bytes) -> None:
-        sub_pickle = pickle.loads(byt)
-        if 'children' in sub_pickle:
-            self.children = sub_pickle['children']
-            self.grid = sub_pickle['grid']
+        if self.children is not None:
+            record[grid_offset:grid_offset + GRID_HEADER.size] = grid_header
+            np.frombuffer(record, dtype='<u4', count=key_count, offset=grid_offset + GRID_HEADER.size)[:] = \
+                self.grid.cell_counts
+            self.grid.pack_points(xyz, rgb)
+        elif self.points:
+            np.concatenate([xyz for xyz, _ in self.points], out=xyz)
+            np.concatenate([rgb for _, rgb in self.points], out=rgb)
+        return record
+
+    def load_from_bytes(self, byt) -> None:
+        """
+        Load a record of save_to_bytes. The points are read without copy if byt is writable.
+        """
+        node = DummyNode(byt)
+        # the points of the grid are updated in place, the buffers should be writable
+        xyz = np.require(node.xyz, requirements=['C', 'A', 'W'])
+        rgb = np.require(node.rgb, requirements=['C', 'A', 'W'])
+        if node.children is not None:
+            self.children = node.children
+            self.grid.__setstate__({
+                'cell_count': node.cell_count,
+                'spacing': node.spacing,
+                'cell_counts': node.cell_counts.astype(np.int64),
+                'cells_xyz': xyz,
+                'cells_rgb': rgb,
+            })
         else:
-            self.points = sub_pickle['points']
+            self.points = [(xyz, rgb)] if len(xyz) else []
 
     def insert(self, node_catalog: NodeCatalog, scale: float, xyz: np.ndarray, rgb: np.ndarray, make_empty_node: bool = False):
         if make_empty_node:
@@ -87,7 +184,7 @@ class Node:
             self.points.append((xyz, rgb))
             count = sum([xyz.shape[0] for xyz, rgb in self.points])
             # stop subdividing if spacing is 1mm
-            if count >= 20000 and self.spacing > 0.001 * scale:
+            if count >= MAX_LEAF_POINT_COUNT and self.spacing > MIN_NODE_SPACING * scale:
                 self._split(node_catalog, scale)
             self.dirty = True
 
@@ -118,9 +215,9 @@ class Node:
         self.pending_xyz = []
         self.pending_rgb = []
 
-    def dump_pending_points(self) -> list[tuple[bytes, bytes, int]]:
+    def dump_pending_points(self) -> list[tuple[bytes, list, int]]:
         result = [
-            (name, pickle.dumps({'xyz': xyz, 'rgb': rgb}), len(xyz))
+            (name, encode_point_batch(xyz, rgb), len(xyz))
             for name, xyz, rgb in self._get_pending_points()
         ]
 
@@ -132,27 +229,30 @@ class Node:
         return sum([xyz.shape[0] for xyz in self.pending_xyz])
 
     def _get_pending_points(self) -> Iterator[tuple[bytes, np.ndarray, np.ndarray]]:
+        """
+        Partition the pending points by child, with a counting sort: the points of each child
+        are a contiguous range of one buffer, in their pending order.
+        """
         if not self.pending_xyz:
             return
 
-        pending_xyz_arr = np.concatenate(self.pending_xyz)
-        pending_rgb_arr = np.concatenate(self.pending_rgb)
         t = aabb_size_to_subdivision_type(self.aabb_size)
         if t == SubdivisionType.QUADTREE:
-            indices = xyz_to_child_index(
-                pending_xyz_arr,
-                np.array(
-                    [self.aabb_center[0], self.aabb_center[1], self.aabb[1][2]],
-                    dtype=np.float32)
-            )
+            center = np.array([self.aabb_center[0], self.aabb_center[1], self.aabb[1][2]], dtype=np.float32)
         else:
-            indices = xyz_to_child_index(pending_xyz_arr, self.aabb_center)
-
-        # unique children list
-        childs = np.unique(indices)
-
-        # make sure all children nodes exist
-        for child in childs:
+            center = self.aabb_center
+
+        counts = np.zeros(8, dtype=np.int64)
+        indices = [count_child_indices(xyz, center, counts) for xyz in self.pending_xyz]
+        offsets = np.cumsum(counts) - counts
+        point_count = int(counts.sum())
+        pending_xyz_arr = np.empty((point_count, 3), dtype=np.float32)
+        pending_rgb_arr = np.empty((point_count, 3), dtype=np.uint8)
+        ends = offsets.copy()
+        for xyz, rgb, child_indices in zip(self.pending_xyz, self.pending_rgb, indices):
+            scatter_by_child(xyz, rgb, child_indices, ends, pending_xyz_arr, pending_rgb_arr)
+
+        for child in np.flatnonzero(counts):
             name = '{}{}'.format(self.name.decode('ascii'), child).encode('ascii')
             # create missing nodes, only for remembering they exist.
             # We don't want to serialize them
@@ -160,12 +260,8 @@ class Node:
             if name not in self.children:
                 self.children += [name]
                 self.dirty = True
-                # print('Added node {}'.format(name))
 
-            mask = np.where(indices - child == 0)
-            xyz = pending_xyz_arr[mask]
-            if len(xyz) > 0:
-                yield name, xyz, pending_rgb_arr[mask]
+            yield name, pending_xyz_arr[offsets[child]:ends[child]], pending_rgb_arr[offsets[child]:ends[child]]
 
     def _split(self, node_catalog: NodeCatalog, scale: float) -> None:
         self.children = []
@@ -186,6 +282,8 @@ class Node:
 
     @staticmethod
     def get_points(data: Node | DummyNode, include_rgb: bool) -> np.ndarray:  # todo remove staticmethod
+        if isinstance(data, DummyNode):
+            return data.get_points(include_rgb)
         if data.children is None:
             points = data.points
             xyz = np.concatenate(tuple([xyz for xyz, rgb in points])).view(np.uint8).ravel()
@@ -208,17 +306,39 @@ class Node:
                    parent_spacing: float,
                    folder: Path,
                    scale: np.ndarray,
-                   prune: bool = True) -> dict:
+                   prune: bool = True,
+                   tile_aabbs: dict | None = None) -> dict:
+        """
+        Build the tileset of the node and its descendants.
+
+        If prune is True, the pnts of the small children are merged in the pnts of this node.
+        tile_aabbs is an optional cache of the real AABB of the pnts, by node name, updated by this method.
+        An entry is reused as long as the size and the modification time of the pnts don't change.
+        When it is used, no pnts is merged (it would invalidate the cache), and it is not shared with
+        the processes of the executor.
+        """
+        if tile_aabbs is not None:
+            prune = False
+
         node = node_from_name(name, parent_aabb, parent_spacing)
         aabb = node.aabb
         tile_path = node_name_to_path(folder, name, '.pnts')
         xyz = np.array(0)
         rgb = np.array(0)
 
+        tile_stat = tile_path.stat() if tile_path.exists() else None
+        cached_aabb = None
+        if tile_aabbs is not None and tile_stat is not None:
+            cached = tile_aabbs.get(name)
+            if cached is not None and cached[0] == (tile_stat.st_size, tile_stat.st_mtime_ns):
+                cached_aabb = cached[1]
+
+        if cached_aabb is not None:
+            aabb = cached_aabb.copy()
         # Read tile's pnts file, if existing, we'll need it for:
         #   - computing the real AABB (instead of the one based on the octree)
         #   - merging this tile's small (<100 points) children
-        if tile_path.exists():
+        elif tile_stat is not None:
             tile = TileContentReader.read_file(tile_path)
 
             fth = tile.body.feature_table.header
@@ -230,13 +350,15 @@ class Node:
             aabb = np.array([
                 np.amin(xyz_float, axis=0),
                 np.amax(xyz_float, axis=0)])
+            if tile_aabbs is not None:
+                tile_aabbs[name] = ((tile_stat.st_size, tile_stat.st_mtime_ns), aabb.copy())
 
         # geometricError is in meters, so we divide it by the scale
         tileset = {'geometricError': 10 * node.spacing / scale[0]}
 
         children = []
         tile_needs_rewrite = False
-        if tile_path.exists():
+        if tile_stat is not None:
             tileset['content'] = {'uri': str(tile_path.relative_to(folder))}
         for child in ['0', '1', '2', '3', '4', '5', '6', '7']:
             child_name = '{}{}'.format(
@@ -247,7 +369,7 @@ class Node:
 
             if child_tile_path.exists():
                 # See if we should merge this child in tile
-                if len(xyz):
+                if prune and len(xyz):
                     # Read pnts content
                     tile = TileContentReader.read_file(child_tile_path)
 
@@ -257,7 +379,7 @@ class Node:
                     # prune should be set at False is the refine mode is REPLACE.
                     # In some cases, we cannot know which point in the parent tile should be deleted
                     # (for example when 2 points are at the same location)
-                    if prune and fth.points_length < 100:
+                    if fth.points_length < 100:
                         xyz = np.concatenate(
                             (xyz,
                              tile.body.feature_table.body.positions_arr))
@@ -284,7 +406,9 @@ class Node:
                 if executor is not None:
                     children += [(child_name, node.aabb, node.spacing, folder, scale)]
                 else:
-                    children += [Node.to_tileset(None, child_name, node.aabb, node.spacing, folder, scale)]
+                    children += [
+                        Node.to_tileset(None, child_name, node.aabb, node.spacing, folder, scale, tile_aabbs=tile_aabbs)
+                    ]
 
         # If we merged at least one child tile in the current tile
         # the pnts file needs to be rewritten.
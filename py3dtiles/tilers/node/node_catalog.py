@@ -1,12 +1,11 @@
 from __future__ import annotations
 
 import math
-import pickle
 from typing import TYPE_CHECKING
 
 import lz4.frame as gzip
 
-from py3dtiles.tilers.node.node import Node
+from py3dtiles.tilers.node.node import Node, split_nodes
 from py3dtiles.utils import split_aabb
 
 if TYPE_CHECKING:
@@ -41,7 +40,7 @@ class NodeCatalog:
         return node
 
     def dump(self, name: bytes, max_depth: int) -> bytes:
-        """Serialize the stored nodes to a bytes list"""
+        """Serialize the stored nodes, as the concatenation of their records (see Node.save_to_bytes)"""
         node = self.nodes[name]
         if node.dirty:
             self.node_bytes[name] = node.save_to_bytes()
@@ -50,19 +49,20 @@ class NodeCatalog:
             for n in node.children:
                 self.dump(n, max_depth - 1)
 
-        return pickle.dumps(self.node_bytes)
+        return b''.join(self.node_bytes.values())
 
     def _load_from_store(self, name: bytes, data: bytes) -> Node:
         if len(data) > 0:
-            out = pickle.loads(gzip.decompress(data))
-            for n in out:
+            # the points of the nodes are views of the decompressed buffer, it should be writable
+            for record in split_nodes(gzip.decompress(data, return_bytearray=True)):
+                n = record.name
                 spacing = self.root_spacing / math.pow(2, len(n))
                 aabb = self.root_aabb
                 for i in n:
                     aabb = split_aabb(aabb, int(i))
                 node = Node(n, aabb, spacing)
-                node.load_from_bytes(out[n])
-                self.node_bytes[n] = out[n]
+                node.load_from_bytes(record.record)
+                self.node_bytes[n] = record.record
                 self.nodes[n] = node
         else:
             spacing = self.root_spacing / math.pow(2, len(name))
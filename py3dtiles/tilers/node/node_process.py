@@ -1,10 +1,9 @@
 import os
-import pickle
 import struct
 import time
 
 from py3dtiles.tilers.node.node_catalog import NodeCatalog
-from py3dtiles.utils import ResponseType
+from py3dtiles.utils import decode_point_batch, get_point_batch_count, POINT_BATCH_FRAME_COUNT, ResponseType
 
 
 def _forward_unassigned_points(node, queue, log_file):
@@ -20,8 +19,7 @@ def _forward_unassigned_points(node, queue, log_file):
             queue.send_multipart([
                 ResponseType.NEW_TASK.value,
                 r[0],
-                r[1],
-                struct.pack('>I', r[2])], copy=False, block=False)
+            ] + r[1], copy=False, block=False)
 
     return total
 
@@ -69,13 +67,20 @@ def _balance(node_catalog, node, max_depth=1, depth=0):
                 depth + 1)
 
 
-def _process(nodes, octree_metadata, name, tasks, queue, begin, log_file):
+def _process(nodes, octree_metadata, name, tasks, queue, begin, log_file, timings):
+    """
+    timings is updated with the time spent in each step, in seconds.
+    """
+    start = time.time()
     node_catalog = NodeCatalog(nodes, name, octree_metadata)
+    timings['pickle'] += time.time() - start
 
     log_enabled = log_file is not None
 
+    task_count = len(tasks) // POINT_BATCH_FRAME_COUNT
+
     if log_enabled:
-        print(f'[>] process_node: "{name}", {len(tasks)}',
+        print(f'[>] process_node: "{name}", {task_count}',
               file=log_file,
               flush=True)
 
@@ -94,21 +99,23 @@ def _process(nodes, octree_metadata, name, tasks, queue, begin, log_file):
     total = 0
     index = 0
 
-    for task in tasks:
+    for i in range(0, len(tasks), POINT_BATCH_FRAME_COUNT):
         if log_enabled:
             print(f'  -> read source [{time.time() - begin}]', file=log_file, flush=True)
 
-        data = pickle.loads(task)
+        xyz, rgb = decode_point_batch(tasks[i:i + POINT_BATCH_FRAME_COUNT])
 
-        point_count = len(data['xyz'])
+        point_count = len(xyz)
 
         if log_enabled:
             print('  -> insert {} [{} points]/ {} files [{}]'.format(
                 index + 1, point_count,
-                len(tasks), time.time() - begin), file=log_file, flush=True)
+                task_count, time.time() - begin), file=log_file, flush=True)
 
         # insert points in node (no children handling here)
-        node.insert(node_catalog, octree_metadata.scale, data['xyz'], data['rgb'], halt_at_depth == 0)
+        start = time.time()
+        node.insert(node_catalog, octree_metadata.scale, xyz, rgb, halt_at_depth == 0)
+        timings['insert'] += time.time() - start
 
         total += point_count
 
@@ -116,21 +123,27 @@ def _process(nodes, octree_metadata, name, tasks, queue, begin, log_file):
             print(f'  -> _flush [{time.time() - begin}]', file=log_file, flush=True)
         # _flush push pending points (= call insert) from level N to level N + 1
         # (_flush is recursive)
-        written = _flush(node_catalog, octree_metadata.scale, node, queue, halt_at_depth - 1, index == len(tasks) - 1, log_file)
+        start = time.time()
+        written = _flush(node_catalog, octree_metadata.scale, node, queue, halt_at_depth - 1, index == task_count - 1, log_file)
+        timings['flush'] += time.time() - start
         total -= written
 
         index += 1
 
+    start = time.time()
     _balance(node_catalog, node, halt_at_depth - 1)
+    timings['balance'] += time.time() - start
 
     if log_enabled:
         print(f'save on disk {name} [{time.time() - begin}]', file=log_file)
 
     # save node state on disk
+    start = time.time()
     if halt_at_depth > 0:
         data = node_catalog.dump(name, halt_at_depth - 1)
     else:
         data = b''
+    timings['pickle'] += time.time() - start
 
     if log_enabled:
         print(f'saved on disk [{time.time() - begin}]', file=log_file)
@@ -138,7 +151,10 @@ def _process(nodes, octree_metadata, name, tasks, queue, begin, log_file):
     return total, data
 
 
-def run(work, octree_metadata, queue, verbose):
+def run(work, octree_metadata, queue, verbose, trace=None):
+    """
+    If trace is a list, a dict with the name, the point count and the timings of each processed node is appended to it.
+    """
     try:
         begin = time.time()
         log_enabled = verbose >= 2
@@ -152,19 +168,29 @@ def run(work, octree_metadata, queue, verbose):
 
         i = 0
         while i < len(work):
-            name = work[i]
-            node = work[i + 1]
-            count = struct.unpack('>I', work[i + 2])[0]
+            name = work[i].bytes
+            node = work[i + 1].bytes
+            count = struct.unpack('>I', work[i + 2])[0] * POINT_BATCH_FRAME_COUNT
             tasks = work[i + 3:i + 3 + count]
             i += 3 + count
-            result, data = _process(node, octree_metadata, name, tasks, queue, begin, log_file)
+            start = time.time()
+            timings = {'pickle': 0, 'insert': 0, 'flush': 0, 'balance': 0}
+            result, data = _process(node, octree_metadata, name, tasks, queue, begin, log_file, timings)
             total += result
 
-            queue.send_multipart([ResponseType.PROCESSED.value, pickle.dumps({
-                'name': name,
-                'total': result,
-                'save': data,
-            })], copy=False)
+            if trace is not None:
+                trace.append({
+                    'name': name.decode('ascii'),
+                    'start': start,
+                    'duration': time.time() - start,
+                    'points': sum(
+                        get_point_batch_count(tasks[j]) for j in range(0, len(tasks), POINT_BATCH_FRAME_COUNT)
+                    ),
+                    'kept_points': result,
+                    **timings,
+                })
+
+            queue.send_multipart([ResponseType.PROCESSED.value, name, struct.pack('>I', result), data], copy=False)
 
         if log_enabled:
             print('[<] return result [{} sec] [{}]'.format(
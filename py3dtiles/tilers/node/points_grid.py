@@ -3,80 +3,296 @@ from __future__ import annotations
 from typing import TYPE_CHECKING
 
 from numba import njit
-from numba.typed import List
 import numpy as np
 
 from py3dtiles.utils import aabb_size_to_subdivision_type, SubdivisionType
-from .distance import is_point_far_enough, xyz_to_key
+from .distance import EMPTY_VOXEL_SLOT, find_voxel_slot, is_point_far_enough_in_voxels, xyz_to_key
 
 if TYPE_CHECKING:
     from .node import Node
 
 
+# the capacity of a cell when its first point is inserted, doubled each time the cell is full
+INITIAL_CELL_CAPACITY = 16
+# the voxels of the spacing test are a bit bigger than the spacing, so that the rounding errors can't put
+# two points closer than the spacing in voxels that aren't neighbours
+VOXEL_SIZE_MARGIN = 1e-3
+# the voxel coordinates are clamped, the points out of these bounds are compared to more points
+MAX_VOXEL_COORDINATE = 1 << 30
+
+
+@njit(cache=True)
+def _copy_cell(xyz, rgb, point_next, new_xyz, new_rgb, new_point_next, offset, new_offset, count):
+    for i in range(count):
+        for c in range(3):
+            new_xyz[new_offset + i, c] = xyz[offset + i, c]
+            new_rgb[new_offset + i, c] = rgb[offset + i, c]
+        new_point_next[new_offset + i] = point_next[offset + i]
+
+
+@njit(cache=True)
+def _grow_cell(xyz, rgb, point_next, size, cell_offsets, cell_counts, cell_capacities, k):
+    """
+    Double the capacity of the cell k. The cell is extended in place if it is the last one of the buffers,
+    otherwise it is moved after the last one.
+
+    When the buffers are full, the cells are packed in new buffers of twice their capacities (the cell k last),
+    so that the space left by the moved cells is reclaimed.
+    """
+    capacity = max(INITIAL_CELL_CAPACITY, 2 * cell_capacities[k])
+    if cell_capacities[k] > 0 and cell_offsets[k] + cell_capacities[k] == size:
+        offset = cell_offsets[k]
+    else:
+        offset = size
+
+    if offset + capacity > xyz.shape[0]:
+        buffer_size = 2 * (np.sum(cell_capacities) - cell_capacities[k] + capacity)
+        new_xyz = np.empty((buffer_size, 3), dtype=np.float32)
+        new_rgb = np.empty((buffer_size, 3), dtype=np.uint8)
+        new_point_next = np.empty(buffer_size, dtype=np.int32)
+        offset = 0
+        for j in range(len(cell_counts)):
+            if j != k and cell_capacities[j] > 0:
+                _copy_cell(xyz, rgb, point_next, new_xyz, new_rgb, new_point_next,
+                           cell_offsets[j], offset, cell_counts[j])
+                cell_offsets[j] = offset
+                offset += cell_capacities[j]
+        _copy_cell(xyz, rgb, point_next, new_xyz, new_rgb, new_point_next, cell_offsets[k], offset, cell_counts[k])
+        cell_offsets[k] = offset
+        cell_capacities[k] = capacity
+        return new_xyz, new_rgb, new_point_next, offset + capacity
+
+    if offset != cell_offsets[k]:
+        _copy_cell(xyz, rgb, point_next, xyz, rgb, point_next, cell_offsets[k], offset, cell_counts[k])
+        cell_offsets[k] = offset
+    cell_capacities[k] = capacity
+    return xyz, rgb, point_next, offset + capacity
+
+
+@njit(cache=True)
+def _get_voxel_coordinate(value, aabmin, inv_voxel_size):
+    v = np.floor((np.float64(value) - aabmin) * inv_voxel_size)
+    return int(min(max(v, -MAX_VOXEL_COORDINATE), MAX_VOXEL_COORDINATE))
+
+
+@njit(cache=True)
+def _get_voxel(point, aabmin, inv_voxel_size):
+    return (
+        _get_voxel_coordinate(point[0], aabmin[0], inv_voxel_size),
+        _get_voxel_coordinate(point[1], aabmin[1], inv_voxel_size),
+        _get_voxel_coordinate(point[2], aabmin[2], inv_voxel_size),
+    )
+
+
+@njit(cache=True)
+def _add_to_voxel(voxel_keys, voxel_heads, voxel_count, point_next, offset, index, k, voxel):
+    """
+    Add the point index of the cell k (at offset in the buffers) at the head of the chain of its voxel.
+    The hash table is twice as big when it is half full.
+    """
+    if 2 * (voxel_count + 1) > voxel_keys.shape[0]:
+        old_keys = voxel_keys
+        old_heads = voxel_heads
+        voxel_keys = np.full((2 * old_keys.shape[0], 4), EMPTY_VOXEL_SLOT, dtype=np.int64)
+        voxel_heads = np.full(2 * old_keys.shape[0], EMPTY_VOXEL_SLOT, dtype=np.int32)
+        for old_slot in range(old_keys.shape[0]):
+            if old_keys[old_slot, 0] != EMPTY_VOXEL_SLOT:
+                slot = find_voxel_slot(
+                    voxel_keys, old_keys[old_slot, 0], old_keys[old_slot, 1], old_keys[old_slot, 2], old_keys[old_slot, 3])
+                voxel_keys[slot] = old_keys[old_slot]
+                voxel_heads[slot] = old_heads[old_slot]
+
+    slot = find_voxel_slot(voxel_keys, k, voxel[0], voxel[1], voxel[2])
+    if voxel_keys[slot, 0] == EMPTY_VOXEL_SLOT:
+        voxel_keys[slot, 0] = k
+        voxel_keys[slot, 1] = voxel[0]
+        voxel_keys[slot, 2] = voxel[1]
+        voxel_keys[slot, 3] = voxel[2]
+        voxel_count += 1
+    point_next[offset + index] = voxel_heads[slot]
+    voxel_heads[slot] = index
+    return voxel_keys, voxel_heads, voxel_count
+
+
+@njit(cache=True)
+def _pack_cells(cells_xyz, cells_rgb, cell_offsets, cell_counts, xyz, rgb):
+    """
+    Copy the points of the cells in xyz and rgb, packed in the order of the cells.
+    """
+    start = 0
+    for k in range(len(cell_counts)):
+        count = cell_counts[k]
+        offset = cell_offsets[k]
+        xyz[start:start + count] = cells_xyz[offset:offset + count]
+        rgb[start:start + count] = cells_rgb[offset:offset + count]
+        start += count
+
+
+@njit(cache=True)
+def _build_voxels(cells_xyz, cell_offsets, cell_counts, aabmin, inv_voxel_size):
+    """
+    Build the hash table of the voxels of the points of the cells, see _insert.
+    """
+    point_next = np.empty(cells_xyz.shape[0], dtype=np.int32)
+    capacity = 64
+    while capacity < 2 * np.sum(cell_counts):
+        capacity *= 2
+    voxel_keys = np.full((capacity, 4), EMPTY_VOXEL_SLOT, dtype=np.int64)
+    voxel_heads = np.full(capacity, EMPTY_VOXEL_SLOT, dtype=np.int32)
+    voxel_count = 0
+    for k in range(len(cell_counts)):
+        for i in range(cell_counts[k]):
+            voxel = _get_voxel(cells_xyz[cell_offsets[k] + i], aabmin, inv_voxel_size)
+            voxel_keys, voxel_heads, voxel_count = _add_to_voxel(
+                voxel_keys, voxel_heads, voxel_count, point_next, cell_offsets[k], i, k, voxel)
+    return point_next, voxel_keys, voxel_heads, voxel_count
+
+
 @njit(fastmath=True, cache=True)
-def _insert(cells_xyz, cells_rgb, aabmin, inv_aabb_size, cell_count, xyz, rgb, spacing, shift, force=False):
+def _insert(cells_xyz, cells_rgb, size, cell_offsets, cell_counts, cell_capacities,
+            point_next, voxel_keys, voxel_heads, voxel_count, inv_voxel_size,
+            aabmin, inv_aabb_size, cell_count, xyz, rgb, spacing, shift, force=False):
+    """
+    Append the points far enough from the points of their cell (or all the points if force is True)
+    to the cells. The cells are stored in the cells_xyz and cells_rgb buffers, the cell k in
+    [cell_offsets[k], cell_offsets[k] + cell_counts[k][.
+
+    The points of the cells are also chained by voxel, the voxels of a cell are found in the voxel_keys and
+    voxel_heads hash table, and point_next gives the index of the next point of the voxel of each point.
+    The minimum distance test then only compares a point to the points in the voxels around it.
+    The voxels aren't updated by a forced insertion.
+
+    Return the buffers, their used size, the voxels, the points not inserted and whether a cell is too big.
+    """
     keys = xyz_to_key(xyz, cell_count, aabmin, inv_aabb_size, shift)
 
-    if force:
-        # allocate this one once and for all
-        for k in np.unique(keys):
-            idx = np.where(keys - k == 0)
-            cells_xyz[k] = np.concatenate((cells_xyz[k], xyz[idx]))
-            cells_rgb[k] = np.concatenate((cells_rgb[k], rgb[idx]))
-    else:
-        notinserted = np.full(len(xyz), False)
-        needs_balance = False
+    notinserted = np.full(len(xyz), False)
+    needs_balance = False
 
-        for i in range(len(xyz)):
-            k = keys[i]
-            if cells_xyz[k].shape[0] == 0 or is_point_far_enough(cells_xyz[k], xyz[i], spacing):
-                cells_xyz[k] = np.concatenate((cells_xyz[k], xyz[i].reshape(1, 3)))
-                cells_rgb[k] = np.concatenate((cells_rgb[k], rgb[i].reshape(1, 3)))
-                if cell_count[0] < 8:
-                    needs_balance = needs_balance or cells_xyz[k].shape[0] > 200000
-            else:
-                notinserted[i] = True
+    squared_min_distance = np.float32(spacing)
+    for i in range(len(xyz)):
+        k = keys[i]
+        count = cell_counts[k]
+        offset = cell_offsets[k]
+        voxel = _get_voxel(xyz[i], aabmin, inv_voxel_size)
+        if force or count == 0 or is_point_far_enough_in_voxels(
+                cells_xyz[offset:offset + count], point_next[offset:offset + count], voxel_keys, voxel_heads,
+                k, voxel[0], voxel[1], voxel[2], xyz[i], squared_min_distance):
+            if count == cell_capacities[k]:
+                cells_xyz, cells_rgb, point_next, size = _grow_cell(
+                    cells_xyz, cells_rgb, point_next, size, cell_offsets, cell_counts, cell_capacities, k)
+                offset = cell_offsets[k]
+            for c in range(3):
+                cells_xyz[offset + count, c] = xyz[i, c]
+                cells_rgb[offset + count, c] = rgb[i, c]
+            if not force:
+                voxel_keys, voxel_heads, voxel_count = _add_to_voxel(
+                    voxel_keys, voxel_heads, voxel_count, point_next, offset, count, k, voxel)
+            cell_counts[k] = count + 1
+            if cell_count[0] < 8:
+                needs_balance = needs_balance or count + 1 > 200000
+        else:
+            notinserted[i] = True
 
-        return xyz[notinserted], rgb[notinserted], needs_balance
+    return (cells_xyz, cells_rgb, point_next, size, voxel_keys, voxel_heads, voxel_count,
+            xyz[notinserted], rgb[notinserted], needs_balance)
 
 
 class Grid:
-    """docstring for Grid"""
+    """
+    The points of a node kept by its grid, at most one point in a sphere of radius spacing.
+
+    The cells are ranges of two buffers of coordinates and colors, with their offset, point count and capacity.
+    A cell grows by doubling its capacity, only the cells with points take space in the buffers.
+
+    The points are also hashed by voxel of the size of the spacing, to test the distance of a new point only
+    to the points around it (see _insert). The voxels are built at the first insertion, they aren't serialized.
+    """
 
-    __slots__ = ('cell_count', 'cells_xyz', 'cells_rgb', 'spacing')
+    __slots__ = ('cell_count', 'spacing', 'cells_xyz', 'cells_rgb', 'size', 'cell_offsets', 'cell_counts',
+                 'cell_capacities', 'point_next', 'voxel_keys', 'voxel_heads', 'voxel_count')
 
     def __init__(self, node: Node, initial_count: int = 3) -> None:
         self.cell_count = np.array([initial_count, initial_count, initial_count], dtype=np.int32)
         self.spacing = node.spacing * node.spacing
-
-        self.cells_xyz = List()
-        self.cells_rgb = List()
-        for _ in range(self.max_key_value):
-            self.cells_xyz.append(np.zeros((0, 3), dtype=np.float32))
-            self.cells_rgb.append(np.zeros((0, 3), dtype=np.uint8))
+        self._set_cells(np.zeros(self.max_key_value, dtype=np.int64),
+                        np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.uint8))
 
     def __getstate__(self) -> dict:
+        xyz, rgb = self._get_cells_points()
         return {
             "cell_count": self.cell_count,
             "spacing": self.spacing,
-            "cells_xyz": list(self.cells_xyz),
-            "cells_rgb": list(self.cells_rgb),
+            "cell_counts": self.cell_counts,
+            "cells_xyz": xyz,
+            "cells_rgb": rgb,
         }
 
     def __setstate__(self, state: dict):
         self.cell_count = state['cell_count']
         self.spacing = state['spacing']
-        self.cells_xyz = List(state['cells_xyz'])
-        self.cells_rgb = List(state['cells_rgb'])
+        self._set_cells(state['cell_counts'], state['cells_xyz'], state['cells_rgb'])
+
+    def _set_cells(self, cell_counts: np.ndarray, xyz: np.ndarray, rgb: np.ndarray) -> None:
+        """
+        Set the points of the cells, packed in the order of the cells.
+        """
+        self.cell_counts = cell_counts
+        self.cell_offsets = np.cumsum(cell_counts) - cell_counts
+        self.cell_capacities = cell_counts.copy()
+        self.cells_xyz = xyz
+        self.cells_rgb = rgb
+        self.size = len(xyz)
+        self.point_next = None
+        self.voxel_keys = None
+        self.voxel_heads = None
+        self.voxel_count = 0
+
+    def _get_cells_points(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Get the points of the cells packed in the order of the cells.
+        """
+        point_count = self.get_point_count()
+        xyz = np.empty((point_count, 3), dtype=np.float32)
+        rgb = np.empty((point_count, 3), dtype=np.uint8)
+        self.pack_points(xyz, rgb)
+        return xyz, rgb
+
+    def pack_points(self, xyz: np.ndarray, rgb: np.ndarray) -> None:
+        """
+        Copy the points of the cells in xyz and rgb, of get_point_count() points, packed in the order of the cells.
+        """
+        _pack_cells(self.cells_xyz, self.cells_rgb, self.cell_offsets, self.cell_counts, xyz, rgb)
+
+    @property
+    def inv_voxel_size(self) -> float:
+        return 1 / (np.sqrt(self.spacing) * (1 + VOXEL_SIZE_MARGIN))
 
     @property
     def max_key_value(self) -> int:
         return 1 << (2 * int(self.cell_count[0]).bit_length() + int(self.cell_count[2]).bit_length())
 
     def insert(self, aabmin: np.ndarray, inv_aabb_size: np.ndarray, xyz: np.ndarray, rgb: np.ndarray, force: bool = False) -> tuple[np.ndarray, np.ndarray, bool]:
-        return _insert(
+        if self.voxel_keys is None:
+            self.point_next, self.voxel_keys, self.voxel_heads, self.voxel_count = _build_voxels(
+                self.cells_xyz, self.cell_offsets, self.cell_counts, aabmin, self.inv_voxel_size)
+
+        (
+            self.cells_xyz, self.cells_rgb, self.point_next, self.size,
+            self.voxel_keys, self.voxel_heads, self.voxel_count,
+            remainder_xyz, remainder_rgb, needs_balance
+        ) = _insert(
             self.cells_xyz,
             self.cells_rgb,
+            self.size,
+            self.cell_offsets,
+            self.cell_counts,
+            self.cell_capacities,
+            self.point_next,
+            self.voxel_keys,
+            self.voxel_heads,
+            self.voxel_count,
+            self.inv_voxel_size,
             aabmin,
             inv_aabb_size,
             self.cell_count,
@@ -84,13 +300,13 @@ class Grid:
             rgb,
             self.spacing,
             int(self.cell_count[0] - 1).bit_length(), force)
+        if force:
+            # the voxels are built again at the next insertion
+            self.voxel_keys = None
+        return remainder_xyz, remainder_rgb, needs_balance
 
     def needs_balance(self) -> bool:
-        if self.cell_count[0] < 8:
-            for cell in self.cells_xyz:
-                if cell.shape[0] > 100000:
-                    return True
-        return False
+        return bool(self.cell_count[0] < 8 and np.max(self.cell_counts) > 100000)
 
     def balance(self, aabb_size: np.ndarray, aabmin: np.ndarray, inv_aabb_size: np.ndarray) -> None:
         t = aabb_size_to_subdivision_type(aabb_size)
@@ -102,35 +318,18 @@ class Grid:
             raise ValueError(f'The first value of the attribute cell count should be lower or equal to 8,'
                              f'actual it is {self.cell_count[0]}')
 
-        old_cells_xyz = self.cells_xyz
-        old_cells_rgb = self.cells_rgb
-        self.cells_xyz = List()
-        self.cells_rgb = List()
-        for _ in range(self.max_key_value):
-            self.cells_xyz.append(np.zeros((0, 3), dtype=np.float32))
-            self.cells_rgb.append(np.zeros((0, 3), dtype=np.uint8))
-
-        for cellxyz, cellrgb in zip(old_cells_xyz, old_cells_rgb):
-            self.insert(aabmin, inv_aabb_size, cellxyz, cellrgb, True)
+        # the points are sorted by their new cell, keeping their order in each cell
+        xyz, rgb = self._get_cells_points()
+        keys = xyz_to_key(xyz, self.cell_count, aabmin, inv_aabb_size, int(self.cell_count[0] - 1).bit_length())
+        order = np.argsort(keys, kind='stable')
+        self._set_cells(np.bincount(keys, minlength=self.max_key_value).astype(np.int64), xyz[order], rgb[order])
 
     def get_points(self, include_rgb: bool) -> np.ndarray:
-        xyz = []
-        rgb = []
-        pt = 0
-        for i in range(len(self.cells_xyz)):
-            xyz.append(self.cells_xyz[i].view(np.uint8).ravel())
-            rgb.append(self.cells_rgb[i].ravel())
-            pt += self.cells_xyz[i].shape[0]
-
+        xyz, rgb = self._get_cells_points()
         if include_rgb:
-            res = np.concatenate((np.concatenate(xyz), np.concatenate(rgb)))
-            assert len(res) == pt * (3 * 4 + 3)
-            return res
+            return np.concatenate((xyz.view(np.uint8).ravel(), rgb.ravel()))
         else:
-            return np.concatenate(xyz)
+            return xyz.view(np.uint8).ravel()
 
     def get_point_count(self) -> int:
-        pt = 0
-        for i in range(len(self.cells_xyz)):
-            pt += self.cells_xyz[i].shape[0]
-        return pt
+        return int(np.sum(self.cell_counts))
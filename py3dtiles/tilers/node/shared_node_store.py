@@ -1,8 +1,10 @@
 import gc
+import os
 from pathlib import Path
+import shutil
 from sys import getsizeof
 import time
-from typing import Tuple
+from typing import Optional, Tuple
 
 import lz4.frame as gzip
 
@@ -24,7 +26,11 @@ class SharedNodeStore:
             'container': getsizeof(self.data) + getsizeof(self.metadata),
         }
 
-    def control_memory_usage(self, max_size_mb: int, verbose: int) -> None:
+    def control_memory_usage(self, max_size_mb: int, verbose: int) -> Optional[Tuple[int, int]]:
+        """
+        Write the cached nodes on disk if the cache is bigger than max_size_mb.
+        Return the number of nodes and bytes written, or None if the cache was small enough.
+        """
         bytes_to_mb = 1.0 / (1024 * 1024)
         max_size_mb = max(max_size_mb, 200)
 
@@ -36,16 +42,18 @@ class SharedNodeStore:
 
         before = cache_size
         if before < max_size_mb:
-            return
+            return None
 
         if verbose >= 2:
             print(f'>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>> CACHE CLEANING [{before}]')
-        self.remove_oldest_nodes(1 - max_size_mb / before)
+        removed = self.remove_oldest_nodes(1 - max_size_mb / before)
         gc.collect()
 
         if verbose >= 2:
             print('<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<< CACHE CLEANING')
 
+        return removed
+
     def get(self, name: bytes, stat_inc: int = 1) -> bytes:
         metadata = self.metadata.get(name, None)
         data = b''
@@ -105,6 +113,25 @@ class SharedNodeStore:
         assert len(self.data) == 0
         return count
 
+    def snapshot(self, destination: Path) -> int:
+        """
+        Write all the cached nodes on disk, then link every node file in destination.
+        Nodes files are never modified in place, so the snapshot isn't changed by
+        later updates of the store.
+        """
+        self.remove_oldest_nodes(1)
+        return _link_tree(self.folder, destination)
+
+    def restore(self, source: Path) -> int:
+        """
+        Replace the content of the store by the node files of a snapshot.
+        The store shouldn't have cached nodes.
+        """
+        if self.metadata:
+            raise ValueError("The store should be empty to be restored")
+        shutil.rmtree(self.folder, ignore_errors=True)
+        return _link_tree(source, self.folder)
+
     def print_statistics(self) -> None:
         print('Stats: Hits = {}, Miss = {}, New = {}'.format(
             self.stats['hit'],
@@ -119,10 +146,28 @@ def _remove_all(store: SharedNodeStore) -> Tuple[int, int]:
     for name, meta in store.metadata.items():
         data = store.data[meta[1]]
         node_path = node_name_to_path(store.folder, name)
-        with node_path.open('wb') as f:
+        # write then rename, so the files linked in a snapshot are never modified
+        tmp_path = node_path.with_name(node_path.name + '.tmp')
+        with tmp_path.open('wb') as f:
             bytes_written += f.write(data)
+        os.replace(tmp_path, node_path)
 
     store.metadata = {}
     store.data = []
 
     return count, bytes_written
+
+
+def _link_tree(source: Path, destination: Path) -> int:
+    count = 0
+    for root, _, filenames in os.walk(source):
+        target_dir = destination / Path(root).relative_to(source)
+        target_dir.mkdir(parents=True, exist_ok=True)
+        for filename in filenames:
+            try:
+                os.link(Path(root) / filename, target_dir / filename)
+            except OSError:
+                # hard links are not supported everywhere
+                shutil.copy2(Path(root) / filename, target_dir / filename)
+            count += 1
+    return count
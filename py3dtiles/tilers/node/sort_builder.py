@@ -0,0 +1,406 @@
+from __future__ import annotations
+
+import bisect
+import concurrent.futures
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from numba import njit
+import numpy as np
+
+from py3dtiles.tilers.pnts import MIN_POINT_SIZE
+from py3dtiles.tilers.pnts.pnts_writer import points_to_pnts
+from py3dtiles.utils import decode_point_batch, ResponseType, split_aabb
+from .node import MAX_LEAF_POINT_COUNT, MIN_NODE_SPACING, Node
+
+# The code of a point is the index of the node containing it at each depth of the tree, 3 bits by depth from
+# the children of the root, so that the points sorted by code are sorted depth first, and the points of a node
+# are a range of codes. The nodes deeper than CODE_DEPTH are not split (see get_tree_depth).
+CODE_DEPTH = 21
+RUN_DTYPE = np.dtype([('code', '<i8'), ('xyz', '<f4', (3,)), ('rgb', 'u1', (3,))])
+# the point count read from each run at each step of a merge
+MERGE_BLOCK_SIZE = 65_536
+# the runs merged at once, the runs are merged in several passes if there are more
+MAX_MERGED_RUNS = 64
+
+
+def get_tree_depth(root_spacing: float, scale: float) -> int:
+    """
+    Get the depth of the deepest nodes: the nodes with a spacing lower than MIN_NODE_SPACING aren't split.
+    """
+    depth = 1
+    while depth < CODE_DEPTH and root_spacing / 2 ** depth > MIN_NODE_SPACING * scale:
+        depth += 1
+    return depth
+
+
+@njit(cache=True, nogil=True, error_model='numpy')
+def xyz_to_codes(xyz, root_aabb, tree_depth):
+    """
+    Compute the code of each point, down to tree_depth, the next levels of the codes are 0.
+    The nodes are split as the nodes of the incremental engine: the child index is computed
+    as in Node._get_pending_points and the aabb of the child as in split_aabb.
+    """
+    codes = np.empty(xyz.shape[0], dtype=np.int64)
+    for i in range(xyz.shape[0]):
+        x0, y0, z0 = root_aabb[0, 0], root_aabb[0, 1], root_aabb[0, 2]
+        x1, y1, z1 = root_aabb[1, 0], root_aabb[1, 1], root_aabb[1, 2]
+        code = 0
+        for depth in range(tree_depth):
+            # the child of the point, with the float32 bounds of the node
+            size_x = np.float32(max(x1 - x0, MIN_POINT_SIZE))
+            size_y = np.float32(max(y1 - y0, MIN_POINT_SIZE))
+            size_z = np.float32(max(z1 - z0, MIN_POINT_SIZE))
+            if size_z / min(size_x, size_y) < 0.5:
+                center_z = np.float32(z1)
+            else:
+                center_z = np.float32((z0 + z1) * 0.5)
+            index = 0
+            if xyz[i, 0] >= np.float32((x0 + x1) * 0.5):
+                index |= 4
+            if xyz[i, 1] >= np.float32((y0 + y1) * 0.5):
+                index |= 2
+            if xyz[i, 2] >= center_z:
+                index |= 1
+            code |= index << (3 * (CODE_DEPTH - 1 - depth))
+
+            # the aabb of the child
+            half_x = (x1 - x0) * 0.5
+            half_y = (y1 - y0) * 0.5
+            half_z = (z1 - z0) * 0.5
+            if index & 4:
+                x0 += half_x
+            x1 = x0 + half_x
+            if index & 2:
+                y0 += half_y
+            y1 = y0 + half_y
+            if half_z / min(half_x, half_y) < 0.5:
+                z1 = z0 + half_z + half_z
+            else:
+                if index & 1:
+                    z0 += half_z
+                z1 = z0 + half_z
+        codes[i] = code
+    return codes
+
+
+def get_code_range(name: bytes) -> Tuple[int, int]:
+    """
+    Get the range of the codes of the points of a node, the end is excluded.
+    """
+    code = 0
+    for depth, index in enumerate(name):
+        code |= (index - ord('0')) << (3 * (CODE_DEPTH - 1 - depth))
+    return code, code + (1 << (3 * (CODE_DEPTH - len(name))))
+
+
+def _search_run(codes: np.ndarray, code: int) -> int:
+    """
+    Find the first point of a run with a code greater or equal to code. np.searchsorted would copy all the codes
+    of the mapped run (they are not contiguous), the bisection only reads a few of them.
+    """
+    return bisect.bisect_left(codes, code)
+
+
+class _PointBatches:
+    """
+    Collect the point batches sent by a reader, in place of the socket of a worker.
+    """
+
+    def __init__(self) -> None:
+        self.xyz: List[np.ndarray] = []
+        self.rgb: List[np.ndarray] = []
+
+    def send_multipart(self, frames, copy=True):
+        if frames[0] == ResponseType.NEW_TASK.value:
+            xyz, rgb = decode_point_batch(frames[2:])
+            self.xyz.append(xyz)
+            self.rgb.append(rgb)
+
+
+def write_run(read: Callable, root_aabb: np.ndarray, tree_depth: int, path: Path) -> int:
+    """
+    Read points, sort them by code and write them in a run, a .npy file of RUN_DTYPE.
+
+    :param read: Read the points and send them to its queue argument, e.g. a reader run function
+        with all the other arguments set.
+    :return: The point count of the run.
+    """
+    batches = _PointBatches()
+    read(queue=batches)
+
+    xyz = np.concatenate(batches.xyz) if batches.xyz else np.zeros((0, 3), dtype=np.float32)
+    rgb = np.concatenate(batches.rgb) if batches.rgb else np.zeros((0, 3), dtype=np.uint8)
+    codes = xyz_to_codes(xyz, root_aabb, tree_depth)
+    order = np.argsort(codes, kind='stable')
+
+    run = np.empty(len(codes), dtype=RUN_DTYPE)
+    run['code'] = codes[order]
+    run['xyz'] = xyz[order]
+    run['rgb'] = rgb[order]
+    np.save(path, run)
+    return len(run)
+
+
+def merge_runs(paths: List[Path], start: int = 0, end: Optional[int] = None,
+               block_size: int = MERGE_BLOCK_SIZE) -> Iterator[np.ndarray]:
+    """
+    Merge the points of the runs with a code in [start, end), by blocks sorted by code.
+    The points of the same code keep the order of the runs.
+    """
+    runs = []
+    positions = []
+    for path in paths:
+        run = np.load(path, mmap_mode='r')
+        run_start = _search_run(run['code'], start)
+        run_end = _search_run(run['code'], end) if end is not None else len(run)
+        if run_end > run_start:
+            runs.append(run[:run_end])
+            positions.append(run_start)
+
+    while runs:
+        if len(runs) == 1:
+            yield from (np.asarray(runs[0][i:i + block_size]) for i in range(positions[0], len(runs[0]), block_size))
+            return
+
+        blocks = [run[position:position + block_size] for run, position in zip(runs, positions)]
+        # no point after the blocks has a code lower than the last code of a block,
+        # unless it's the end of its run
+        cut_runs = [i for i, (run, position, block) in enumerate(zip(runs, positions, blocks))
+                    if position + len(block) < len(run)]
+        if cut_runs:
+            limit = min(blocks[i]['code'][-1] for i in cut_runs)
+            # the points of the limit code of the first run with more of them after its block are merged,
+            # the ones of the next runs wait for the next step so that they stay after them
+            first_cut = next(i for i in cut_runs if blocks[i]['code'][-1] == limit)
+            counts = [int(np.searchsorted(block['code'], limit, side='right' if i <= first_cut else 'left'))
+                      for i, block in enumerate(blocks)]
+        else:
+            counts = [len(block) for block in blocks]
+
+        merged = np.concatenate([block[:count] for block, count in zip(blocks, counts)])
+        yield merged[np.argsort(merged['code'], kind='stable')]
+
+        positions = [position + count for position, count in zip(positions, counts)]
+        remaining = [i for i, run in enumerate(runs) if positions[i] < len(run)]
+        runs = [runs[i] for i in remaining]
+        positions = [positions[i] for i in remaining]
+
+
+def write_merged_run(paths: List[Path], path: Path) -> int:
+    """
+    Merge runs in a new run, the merged runs are removed.
+    """
+    point_count = sum(np.load(run_path, mmap_mode='r').shape[0] for run_path in paths)
+    run = np.lib.format.open_memmap(path, mode='w+', dtype=RUN_DTYPE, shape=(point_count,))
+    position = 0
+    for block in merge_runs(paths):
+        run[position:position + len(block)] = block
+        position += len(block)
+    run.flush()
+    del run
+    for run_path in paths:
+        run_path.unlink()
+    return point_count
+
+
+def reduce_runs(executor: concurrent.futures.Executor, paths: List[Path], folder: Path,
+                max_merged_runs: int = MAX_MERGED_RUNS) -> List[Path]:
+    """
+    Merge the runs by groups, until there are at most max_merged_runs runs. The groups keep the order of the runs.
+    """
+    merge_pass = 0
+    while len(paths) > max_merged_runs:
+        groups = [paths[i:i + max_merged_runs] for i in range(0, len(paths), max_merged_runs)]
+        # the last group can be a single run
+        merged = [folder / f'merged-{merge_pass}-{i}.npy' if len(group) > 1 else group[0]
+                  for i, group in enumerate(groups)]
+        for future in [executor.submit(write_merged_run, group, path)
+                       for group, path in zip(groups, merged) if len(group) > 1]:
+            future.result()
+        paths = merged
+        merge_pass += 1
+    return paths
+
+
+class _SortedPoints:
+    """
+    Read merged points in order, with a look ahead to count the points of the next node.
+    """
+
+    def __init__(self, blocks: Iterator[np.ndarray]) -> None:
+        self.blocks = blocks
+        self.points = np.zeros(0, dtype=RUN_DTYPE)
+        # the codes of the points, contiguous to be searched
+        self.codes = self.points['code'].copy()
+        self.position = 0
+
+    def _read_block(self) -> bool:
+        block = next(self.blocks, None)
+        if block is None:
+            return False
+        self.points = np.concatenate((self.points[self.position:], block))
+        self.codes = self.points['code'].copy()
+        self.position = 0
+        return True
+
+    def count(self, end: int, max_count: int) -> int:
+        """
+        Count the next points with a code lower than end, up to max_count.
+        """
+        while True:
+            count = int(np.searchsorted(self.codes[self.position:], end))
+            if count < len(self.points) - self.position or count >= max_count or not self._read_block():
+                return min(count, max_count)
+
+    def take(self, end: int) -> np.ndarray:
+        """
+        Take the next points with a code lower than end.
+        """
+        parts = []
+        while True:
+            count = int(np.searchsorted(self.codes[self.position:], end))
+            parts.append(self.points[self.position:self.position + count])
+            self.position += count
+            if self.position < len(self.points) or not self._read_block():
+                return np.concatenate(parts) if len(parts) > 1 else parts[0]
+
+
+class TreeBuilder:
+    """
+    Build the nodes of a tree from the bottom: the points of a node are sampled with its grid from the points
+    of its children, the points not taken by the node are written in the pnts of the children.
+    """
+
+    def __init__(self, tree_depth: int, out_folder: Path, include_rgb: bool) -> None:
+        self.tree_depth = tree_depth
+        self.out_folder = out_folder
+        self.include_rgb = include_rgb
+        self.point_count = 0
+
+    def write_pnts(self, name: bytes, xyz: np.ndarray, rgb: np.ndarray) -> None:
+        if self.include_rgb:
+            points = np.concatenate((xyz.view(np.uint8).ravel(), rgb.ravel()))
+        else:
+            points = xyz.view(np.uint8).ravel()
+        self.point_count += points_to_pnts(name, points, self.out_folder, self.include_rgb)[0]
+
+    def sample_children(self, name: bytes, aabb: np.ndarray, spacing: float,
+                        children: Iterable[Tuple[bytes, np.ndarray, np.ndarray, bool]]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Take the points of the node from the points of its children and write the pnts of the children.
+
+        :param children: The name of each child with its points and whether it has children, in the order of
+            the children. A child with children keeps its first point, so that its pnts exists and the tileset
+            reaches its children.
+        :return: The points of the node.
+        """
+        node = Node(name, aabb, spacing)
+        node.children = []
+        for child_name, xyz, rgb, is_inner in children:
+            kept = 1 if is_inner else 0
+            remainder_xyz, remainder_rgb, needs_balance = node.grid.insert(
+                node.aabb[0], node.inv_aabb_size, xyz[kept:], rgb[kept:])
+            if needs_balance:
+                node.grid.balance(node.aabb_size, node.aabb[0], node.inv_aabb_size)
+            if kept:
+                remainder_xyz = np.concatenate((xyz[:kept], remainder_xyz))
+                remainder_rgb = np.concatenate((rgb[:kept], remainder_rgb))
+            self.write_pnts(child_name, remainder_xyz, remainder_rgb)
+        return node.grid._get_cells_points()
+
+    def is_leaf(self, depth: int, point_count: int) -> bool:
+        return point_count < MAX_LEAF_POINT_COUNT or depth >= self.tree_depth
+
+    def build(self, points: _SortedPoints, name: bytes, aabb: np.ndarray,
+              spacing: float) -> Tuple[np.ndarray, np.ndarray, bool]:
+        """
+        Build the subtree of a node from its sorted points, and write the pnts of its descendants.
+
+        :return: The points of the node, not written yet, and whether it has children.
+        """
+        start, end = get_code_range(name)
+        if self.is_leaf(len(name), points.count(end, MAX_LEAF_POINT_COUNT)):
+            leaf = points.take(end)
+            return np.ascontiguousarray(leaf['xyz']), np.ascontiguousarray(leaf['rgb']), False
+
+        def build_children():
+            for index in range(8):
+                child_name = name + str(index).encode('ascii')
+                if points.count(get_code_range(child_name)[1], 1):
+                    child_aabb = split_aabb(aabb, index)
+                    yield (child_name, *self.build(points, child_name, child_aabb, spacing / 2))
+
+        return (*self.sample_children(name, aabb, spacing, build_children()), True)
+
+
+def build_subtree(paths: List[Path], name: bytes, aabb: np.ndarray, spacing: float, tree_depth: int,
+                  out_folder: Path, include_rgb: bool) -> Tuple[np.ndarray, np.ndarray, bool, int]:
+    """
+    Build the subtree of a node from the points of the runs in its code range.
+
+    :return: The points of the node and whether it has children (see TreeBuilder.build),
+        with the point count written in the pnts of its descendants.
+    """
+    start, end = get_code_range(name)
+    builder = TreeBuilder(tree_depth, out_folder, include_rgb)
+    xyz, rgb, is_inner = builder.build(_SortedPoints(merge_runs(paths, start, end)), name, aabb, spacing)
+    return xyz, rgb, is_inner, builder.point_count
+
+
+def build_tiles(executor: concurrent.futures.Executor, paths: List[Path], root_aabb: np.ndarray,
+                root_spacing: float, tree_depth: int, out_folder: Path, include_rgb: bool,
+                subtree_point_count: int) -> int:
+    """
+    Build the tiles from the sorted runs. The subtrees of at most subtree_point_count points are built in parallel
+    by the executor, each one reads the range of its points in every run. Their parents are then built from
+    the points of their roots. The pnts of the root isn't written, it's sampled from its children
+    at the end of the conversion.
+
+    :return: The point count written in the pnts.
+    """
+    codes = [np.load(path, mmap_mode='r')['code'] for path in paths]
+    builder = TreeBuilder(tree_depth, out_folder, include_rgb)
+
+    def count_points(name):
+        start, end = get_code_range(name)
+        return sum(_search_run(run, end) - _search_run(run, start) for run in codes)
+
+    def plan(name, aabb, spacing):
+        """
+        Submit the subtrees of a node, and return a function building the node from their results.
+        """
+        point_count = count_points(name)
+        if name and (point_count <= subtree_point_count or builder.is_leaf(len(name), point_count)):
+            future = executor.submit(build_subtree, paths, name, aabb, spacing, tree_depth, out_folder, include_rgb)
+
+            def get_subtree():
+                xyz, rgb, is_inner, point_count = future.result()
+                builder.point_count += point_count
+                return xyz, rgb, is_inner
+
+            return get_subtree
+
+        children = []
+        for index in range(8):
+            child_name = name + str(index).encode('ascii')
+            if count_points(child_name):
+                children.append((child_name, plan(child_name, split_aabb(aabb, index), spacing / 2)))
+
+        def get_node():
+            results = ((child_name, *get_child()) for child_name, get_child in children)
+            return (*builder.sample_children(name, aabb, spacing, results), True)
+
+        if name:
+            return get_node
+
+        def get_root():
+            # the points of the root are in its children
+            for child_name, get_child in children:
+                xyz, rgb, _ = get_child()
+                builder.write_pnts(child_name, xyz, rgb)
+
+        return get_root
+
+    plan(b'', root_aabb, root_spacing)()
+    return builder.point_count
@@ -1,5 +1,4 @@
 from pathlib import Path
-import pickle
 import struct
 from typing import Tuple, Union
 
@@ -13,7 +12,7 @@ from py3dtiles.tileset.tile_content import TileContent
 from py3dtiles.utils import node_name_to_path, ResponseType
 
 
-def points_to_pnts(name, points, out_folder: Path, include_rgb) -> Tuple[int, Union[Path, None]]:
+def points_to_pnts(name, points, out_folder: Path, include_rgb, overwrite: bool = False) -> Tuple[int, Union[Path, None]]:
     count = int(len(points) / (3 * 4 + (3 if include_rgb else 0)))
 
     if count == 0:
@@ -36,7 +35,7 @@ def points_to_pnts(name, points, out_folder: Path, include_rgb) -> Tuple[int, Un
 
     node_path = node_name_to_path(out_folder, name, '.pnts')
 
-    if node_path.exists():
+    if node_path.exists() and not overwrite:
         raise FileExistsError(f"{node_path} already written")
 
     tile.save_as(node_path)
@@ -44,19 +43,21 @@ def points_to_pnts(name, points, out_folder: Path, include_rgb) -> Tuple[int, Un
     return count, node_path
 
 
-def node_to_pnts(name, node, out_folder: Path, include_rgb):
+def node_to_pnts(name, node, out_folder: Path, include_rgb, overwrite: bool = False):
     points = py3dtiles.tilers.node.Node.get_points(node, include_rgb)
-    return points_to_pnts(name, points, out_folder, include_rgb)
+    return points_to_pnts(name, points, out_folder, include_rgb, overwrite)
 
 
-def run(sender, data, node_name, folder: Path, write_rgb):
+def run(sender, data, node_name, folder: Path, write_rgb, overwrite: bool = False) -> int:
+    """
+    Write the pnts of the nodes in data, and returns the written point count.
+    """
+    total = 0
     # we can safely write the .pnts file
     if len(data):
-        root = pickle.loads(gzip.decompress(data))
-        # print('write ', node_name.decode('ascii'))
-        total = 0
-        for name in root:
-            node = py3dtiles.tilers.node.DummyNode(pickle.loads(root[name]))
-            total += node_to_pnts(name, node, folder, write_rgb)[0]
+        for node in py3dtiles.tilers.node.split_nodes(gzip.decompress(data)):
+            total += node_to_pnts(node.name, node, folder, write_rgb, overwrite)[0]
 
         sender.send_multipart([ResponseType.PNTS_WRITTEN.value, struct.pack('>I', total), node_name])
+
+    return total
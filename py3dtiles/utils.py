@@ -2,7 +2,10 @@ from __future__ import annotations
 
 from enum import Enum
 from io import StringIO
+import json
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path, PurePath
+import struct
 from typing import Callable
 
 import numpy as np
@@ -16,6 +19,8 @@ def str_to_CRS(srs: str | CRS | None) -> CRS | None:
     """
     if srs is None:
         return None
+    if isinstance(srs, CRS):
+        return srs
 
     try:
         return CRS.from_epsg(int(srs))
@@ -24,6 +29,7 @@ def str_to_CRS(srs: str | CRS | None) -> CRS | None:
 
 
 class CommandType(Enum):
+    CONFIGURE = b'configure'
     READ_FILE = b'read_file'
     WRITE_PNTS = b'write_pnts'
     PROCESS_JOBS = b'process_jobs'
@@ -31,6 +37,7 @@ class CommandType(Enum):
 
 
 class ResponseType(Enum):
+    REGISTER = b'register'
     IDLE = b'idle'
     HALTED = b'halted'
     READ = b'read'
@@ -40,6 +47,160 @@ class ResponseType(Enum):
     ERROR = b'error'
 
 
+# A point batch travels between processes as 3 frames: a fixed-size header
+# (format version, point count), then the raw float32 xyz and uint8 rgb buffers.
+# A shared point batch keeps the same header, but its points are in a shared memory segment:
+# the second frame is the name of the segment and the third one is empty.
+POINT_BATCH_VERSION = 1
+POINT_BATCH_SHARED_VERSION = 2
+POINT_BATCH_HEADER = struct.Struct('>BI')
+POINT_BATCH_FRAME_COUNT = 3
+
+
+def encode_point_batch(xyz: np.ndarray, rgb: np.ndarray) -> list:
+    """
+    Build the multipart frames of a point batch. The arrays are not copied,
+    so the frames should be sent with copy=False.
+    """
+    xyz = np.ascontiguousarray(xyz, dtype=np.float32)
+    rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+    if xyz.shape[0] != rgb.shape[0]:
+        raise ValueError(f'xyz and rgb should have the same length, currently {xyz.shape[0]} and {rgb.shape[0]}')
+
+    return [POINT_BATCH_HEADER.pack(POINT_BATCH_VERSION, xyz.shape[0]), xyz, rgb]
+
+
+def _unpack_point_batch_header(header) -> tuple[int, int]:
+    version, point_count = POINT_BATCH_HEADER.unpack(header)
+    if version not in (POINT_BATCH_VERSION, POINT_BATCH_SHARED_VERSION):
+        raise ValueError(f'Unsupported point batch version {version}, '
+                         f'expected {POINT_BATCH_VERSION} or {POINT_BATCH_SHARED_VERSION}')
+    return version, point_count
+
+
+def get_point_batch_count(header) -> int:
+    return _unpack_point_batch_header(header)[1]
+
+
+def is_shared_point_batch(frames: list) -> bool:
+    return _unpack_point_batch_header(frames[0])[0] == POINT_BATCH_SHARED_VERSION
+
+
+def share_point_batch(frames: list) -> list:
+    """
+    Copy the points of a point batch in a new shared memory segment, and return the frames
+    of the shared batch. The segment is unlinked when the batch is decoded or released.
+
+    The segment stays registered in the resource tracker, which unlinks it if no process does, e.g. if the
+    processes of the conversion are killed. The processes passing shared batches should use the same
+    resource tracker (started before them, see resource_tracker.ensure_running): the segment is unregistered
+    by the process unlinking it.
+    """
+    header, xyz, rgb = frames
+    point_count = get_point_batch_count(header)
+    xyz = memoryview(xyz).cast('B')
+    rgb = memoryview(rgb).cast('B')
+
+    segment = SharedMemory(create=True, size=max(1, xyz.nbytes + rgb.nbytes))
+    segment.buf[:xyz.nbytes] = xyz
+    segment.buf[xyz.nbytes:xyz.nbytes + rgb.nbytes] = rgb
+    segment.close()
+
+    return [POINT_BATCH_HEADER.pack(POINT_BATCH_SHARED_VERSION, point_count), segment.name.encode('ascii'), b'']
+
+
+def decode_point_batch(frames: list, release: bool = True) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Rebuild the xyz and rgb arrays of a point batch from its frames, without copy.
+    The arrays are only writable if the frames are (e.g. zmq frames received with copy=False).
+
+    The points of a shared batch are copied out of its segment, which is then unlinked, unless release is False.
+    """
+    header, xyz, rgb = frames
+    version, point_count = _unpack_point_batch_header(header)
+
+    if version == POINT_BATCH_SHARED_VERSION:
+        segment = SharedMemory(name=bytes(xyz).decode('ascii'))
+        xyz = np.frombuffer(segment.buf, dtype=np.float32, count=point_count * 3).reshape((point_count, 3)).copy()
+        rgb = np.frombuffer(
+            segment.buf, dtype=np.uint8, count=point_count * 3, offset=xyz.nbytes
+        ).reshape((point_count, 3)).copy()
+        segment.close()
+        if release:
+            segment.unlink()
+        return xyz, rgb
+
+    xyz = np.frombuffer(xyz, dtype=np.float32).reshape((point_count, 3))
+    rgb = np.frombuffer(rgb, dtype=np.uint8).reshape((point_count, 3))
+    return xyz, rgb
+
+
+def release_point_batch(frames: list) -> None:
+    """
+    Unlink the segment of a shared point batch that won't be decoded.
+    """
+    if is_shared_point_batch(frames):
+        try:
+            segment = SharedMemory(name=bytes(frames[1]).decode('ascii'))
+        except FileNotFoundError:
+            return
+        segment.close()
+        segment.unlink()
+
+
+def get_frames_size(frames: list) -> int:
+    """
+    Total size in bytes of message frames (bytes, numpy arrays or zmq frames).
+    """
+    return sum(memoryview(frame).nbytes for frame in frames)
+
+
+class TraceWriter:
+    """
+    Write events in the Chrome trace event format (JSON array format), which can be
+    opened with Perfetto or chrome://tracing. The events are written as they come,
+    so that the trace of an interrupted run can still be opened.
+    """
+    def __init__(self, path: str | Path, origin: float) -> None:
+        """
+        :param path: The path of the trace file.
+        :param origin: The time of the start of the trace, the event times are relative to it.
+        """
+        self.file = open(path, 'w')
+        self.file.write('[')
+        self.origin = origin
+        self.event_count = 0
+
+    def _write(self, event: dict) -> None:
+        if self.event_count:
+            self.file.write(',\n')
+        self.file.write(json.dumps(event))
+        self.event_count += 1
+
+    def _to_us(self, t: float) -> int:
+        return int((t - self.origin) * 1_000_000)
+
+    def add_process_name(self, pid: int, name: str) -> None:
+        self._write({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': name}})
+
+    def add_span(self, name: str, category: str, start: float, duration: float, pid: int,
+                 args: dict | None = None) -> None:
+        """
+        Add a span of duration seconds starting at start (a time.time() value).
+        """
+        self._write({
+            'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': pid,
+            'ts': self._to_us(start), 'dur': int(duration * 1_000_000), 'args': args or {},
+        })
+
+    def add_counters(self, name: str, t: float, pid: int, values: dict) -> None:
+        self._write({'name': name, 'ph': 'C', 'pid': pid, 'ts': self._to_us(t), 'args': values})
+
+    def close(self) -> None:
+        self.file.write(']\n')
+        self.file.close()
+
+
 def profile(func: Callable) -> Callable:
     from line_profiler import LineProfiler
 
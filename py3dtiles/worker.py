@@ -0,0 +1,51 @@
+import argparse
+from pathlib import Path
+
+from py3dtiles.convert import CPU_COUNT, Worker
+
+
+def start_workers(uri: str, jobs: int = CPU_COUNT, folder: Path = None, verbose: int = 0):
+    """
+    Start workers joining the conversion served on uri (see the bind parameter of convert)
+    and wait until the end of the conversion.
+
+    :param uri: The address of the conversion, e.g. tcp://host:5555
+    :param jobs: The number of workers to start.
+    :param folder: The output folder of the conversion, if it is mounted on another path on this host.
+    :param verbose: The verbosity of the workers.
+    """
+    workers = [
+        Worker(trace=False, transformer=None, octree_metadata=None, folder=folder,
+               write_rgb=None, overwrite_pnts=None, shared_memory=False, verbosity=verbose, uri=uri)
+        for _ in range(jobs)
+    ]
+    [w.start() for w in workers]
+    for w in workers:
+        w.join()
+
+
+def init_parser(subparser):
+    parser = subparser.add_parser(
+        'worker',
+        help='Start workers for a conversion running on another host (see the --bind option of convert).',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        '--connect',
+        help='The address of the conversion, e.g. tcp://host:5555',
+        required=True,
+        type=str)
+    parser.add_argument(
+        '--jobs',
+        help='The number of workers to start. Default to the number of cpu.',
+        default=CPU_COUNT,
+        type=int)
+    parser.add_argument(
+        '--out',
+        help='The output folder of the conversion, if it is mounted on another path on this host.',
+        type=str)
+
+    return parser
+
+
+def main(args):
+    start_workers(args.connect, args.jobs, Path(args.out) if args.out else None, args.verbose)
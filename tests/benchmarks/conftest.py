@@ -0,0 +1,53 @@
+from pathlib import Path
+
+from pytest import fixture
+
+from .synthetic import format_point_count, parse_point_count
+
+DEFAULT_SCALES = '10k'
+# the kernels process the points of one job at most
+KERNEL_MAX_POINT_COUNT = 1_000_000
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('synthetic benchmarks')
+    group.addoption(
+        '--synthetic-scales',
+        default=DEFAULT_SCALES,
+        help='Comma separated point counts of the synthetic datasets, e.g. 1M,10M,100M')
+    group.addoption(
+        '--synthetic-dir',
+        default=None,
+        help='Folder where the synthetic datasets are kept between runs (a temporary folder by default)')
+
+
+def _get_scales(config) -> list[int]:
+    # the options are not registered if this conftest is not loaded at startup (e.g. pytest run from the root)
+    scales = config.getoption('synthetic_scales', default=DEFAULT_SCALES)
+    return [parse_point_count(scale) for scale in scales.split(',')]
+
+
+def pytest_generate_tests(metafunc):
+    scales = _get_scales(metafunc.config)
+    if 'point_count' in metafunc.fixturenames:
+        metafunc.parametrize('point_count', scales, ids=format_point_count)
+    if 'kernel_point_count' in metafunc.fixturenames:
+        kernel_scales = sorted({min(scale, KERNEL_MAX_POINT_COUNT) for scale in scales})
+        metafunc.parametrize('kernel_point_count', kernel_scales, ids=format_point_count)
+
+
+def pytest_benchmark_update_json(config, benchmarks, output_json):
+    output_json['synthetic'] = {
+        'scales': _get_scales(config),
+        'kernel_max_point_count': KERNEL_MAX_POINT_COUNT,
+    }
+
+
+@fixture(scope='session')
+def synthetic_dir(request, tmp_path_factory) -> Path:
+    folder = request.config.getoption('synthetic_dir', default=None)
+    if folder is None:
+        return tmp_path_factory.mktemp('synthetic')
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    return folder
@@ -0,0 +1,198 @@
+"""
+Synthetic point clouds for the benchmarks.
+
+The points are generated by chunks, so that the biggest datasets can be written without
+holding them in memory. A dataset only depends on its distribution, its point count and its seed.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+from typing import Iterator
+
+import laspy
+import numpy as np
+
+DISTRIBUTIONS = ('uniform', 'terrain', 'clusters', 'duplicates', 'urban')
+FORMATS = ('las', 'xyz')
+
+CHUNK_SIZE = 1_000_000
+# a 1km x 1km survey with projected coordinates
+ORIGIN = np.array([500_000.0, 5_000_000.0, 0.0])
+EXTENT = np.array([1000.0, 1000.0, 100.0])
+CLUSTER_COUNT = 20
+CLUSTER_SIGMA = 0.5
+# each point of the duplicates distribution is repeated this number of times on average
+DUPLICATE_FACTOR = 10
+# the urban distribution is a dense mobile mapping scan of the streets of a district, in the middle of the extent
+URBAN_DISTRICT_SIZE = 200.0
+URBAN_STREET_SPACING = 40.0
+URBAN_STREET_HALF_WIDTH = 6.0
+URBAN_FACADE_HEIGHT = 25.0
+URBAN_NOISE_SIGMA = 0.01
+
+_SUFFIXES = {'k': 1_000, 'M': 1_000_000, 'G': 1_000_000_000}
+
+
+def parse_point_count(value: str) -> int:
+    """
+    Parse a point count like 10k, 1M or 100M.
+    """
+    value = value.strip()
+    if value[-1] in _SUFFIXES:
+        return int(float(value[:-1]) * _SUFFIXES[value[-1]])
+    return int(value)
+
+
+def format_point_count(point_count: int) -> str:
+    for suffix, factor in reversed(_SUFFIXES.items()):
+        if point_count >= factor and point_count % factor == 0:
+            return f'{point_count // factor}{suffix}'
+    return str(point_count)
+
+
+def _uniform(rng: np.random.Generator, count: int, point_count: int, seed: int) -> np.ndarray:
+    return rng.random((count, 3)) * EXTENT
+
+
+def _terrain(rng: np.random.Generator, count: int, point_count: int, seed: int) -> np.ndarray:
+    # a 2.5D surface: hills, ripples and some noise
+    xyz = rng.random((count, 3)) * EXTENT
+    x, y = xyz[:, 0], xyz[:, 1]
+    xyz[:, 2] = (
+        50
+        + 30 * np.sin(x / 160) * np.cos(y / 240)
+        + 5 * np.sin(x / 13 + y / 17)
+        + rng.normal(0, 0.1, count)
+    )
+    return xyz
+
+
+def _clusters(rng: np.random.Generator, count: int, point_count: int, seed: int) -> np.ndarray:
+    centers = np.random.default_rng(seed).random((CLUSTER_COUNT, 3)) * EXTENT
+    xyz = centers[rng.integers(0, CLUSTER_COUNT, count)] + rng.normal(0, CLUSTER_SIGMA, (count, 3))
+    return np.clip(xyz, 0, EXTENT)
+
+
+def _duplicates(rng: np.random.Generator, count: int, point_count: int, seed: int) -> np.ndarray:
+    unique_count = max(1, min(point_count // DUPLICATE_FACTOR, CHUNK_SIZE))
+    unique_points = np.random.default_rng(seed).random((unique_count, 3)) * EXTENT
+    return unique_points[rng.integers(0, unique_count, count)]
+
+
+def _urban(rng: np.random.Generator, count: int, point_count: int, seed: int) -> np.ndarray:
+    # half of the points on the ground of the streets, half on the facades along them
+    street_count = int(URBAN_DISTRICT_SIZE // URBAN_STREET_SPACING)
+    street = (rng.integers(0, street_count, count) + 0.5) * URBAN_STREET_SPACING
+    along = rng.random(count) * URBAN_DISTRICT_SIZE
+    on_facade = rng.random(count) < 0.5
+    across = np.where(
+        on_facade,
+        rng.choice([-URBAN_STREET_HALF_WIDTH, URBAN_STREET_HALF_WIDTH], count),
+        rng.uniform(-URBAN_STREET_HALF_WIDTH, URBAN_STREET_HALF_WIDTH, count),
+    ) + rng.normal(0, URBAN_NOISE_SIGMA, count)
+    height = np.where(on_facade, rng.random(count) * URBAN_FACADE_HEIGHT, 0) + rng.normal(0, URBAN_NOISE_SIGMA, count)
+
+    # the streets along x and along y
+    along_x = rng.random(count) < 0.5
+    xyz = np.empty((count, 3))
+    xyz[:, 0] = np.where(along_x, along, street + across)
+    xyz[:, 1] = np.where(along_x, street + across, along)
+    xyz[:, 2] = height
+    xyz[:, :2] += (EXTENT[:2] - URBAN_DISTRICT_SIZE) / 2
+    return np.clip(xyz, 0, EXTENT)
+
+
+_GENERATORS = {
+    'uniform': _uniform,
+    'terrain': _terrain,
+    'clusters': _clusters,
+    'duplicates': _duplicates,
+    'urban': _urban,
+}
+
+
+def generate_points(distribution: str, point_count: int, seed: int = 0) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Generate the points of a dataset by chunks of CHUNK_SIZE points.
+    Yield the float64 coordinates (offset by ORIGIN) and the uint8 colors of each chunk.
+    """
+    if distribution not in _GENERATORS:
+        raise ValueError(f"Unknown distribution {distribution}, the available ones are {DISTRIBUTIONS}")
+    generator = _GENERATORS[distribution]
+
+    for chunk_index, start in enumerate(range(0, point_count, CHUNK_SIZE)):
+        count = min(CHUNK_SIZE, point_count - start)
+        rng = np.random.default_rng([seed, chunk_index])
+        xyz = generator(rng, count, point_count, seed)
+
+        # colored by height
+        height = np.clip(xyz[:, 2] / EXTENT[2], 0, 1)
+        rgb = np.empty((count, 3), dtype=np.uint8)
+        rgb[:, 0] = height * 255
+        rgb[:, 1] = 128
+        rgb[:, 2] = (1 - height) * 255
+
+        yield xyz + ORIGIN, rgb
+
+
+def get_points(distribution: str, point_count: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Get the points of a dataset in memory, as float32 coordinates relative to ORIGIN (like the points
+    sent to the workers by convert) and uint8 colors.
+    """
+    chunks = list(generate_points(distribution, point_count, seed))
+    xyz = np.concatenate([xyz for xyz, _ in chunks]) - ORIGIN
+    rgb = np.concatenate([rgb for _, rgb in chunks])
+    return np.ascontiguousarray(xyz, dtype=np.float32), rgb
+
+
+def write_las(path: Path, distribution: str, point_count: int, seed: int = 0) -> None:
+    header = laspy.LasHeader(point_format=2, version='1.2')
+    header.offsets = ORIGIN
+    header.scales = np.array([0.001, 0.001, 0.001])
+
+    with laspy.open(path, mode='w', header=header) as writer:
+        for xyz, rgb in generate_points(distribution, point_count, seed):
+            points = laspy.ScaleAwarePointRecord.zeros(len(xyz), header=header)
+            points.x = xyz[:, 0]
+            points.y = xyz[:, 1]
+            points.z = xyz[:, 2]
+            # 16 bits colors
+            points.red = rgb[:, 0].astype(np.uint16) * 256
+            points.green = rgb[:, 1].astype(np.uint16) * 256
+            points.blue = rgb[:, 2].astype(np.uint16) * 256
+            writer.write_points(points)
+
+
+def write_xyz(path: Path, distribution: str, point_count: int, seed: int = 0) -> None:
+    with path.open('w') as f:
+        for xyz, rgb in generate_points(distribution, point_count, seed):
+            np.savetxt(f, np.hstack((xyz, rgb)), fmt='%.3f %.3f %.3f %d %d %d')
+
+
+def write_dataset(folder: Path, distribution: str, point_count: int, file_format: str, seed: int = 0) -> Path:
+    """
+    Write a dataset in folder, unless it is already there, and return its path.
+    """
+    path = folder / f'{distribution}_{format_point_count(point_count)}_{seed}.{file_format}'
+    if path.exists():
+        return path
+
+    writers = {'las': write_las, 'xyz': write_xyz}
+    if file_format not in writers:
+        raise ValueError(f"Unknown format {file_format}, the available ones are {FORMATS}")
+
+    # write then rename, so that an interrupted generation is not reused
+    tmp_path = path.with_name('tmp_' + path.name)
+    writers[file_format](tmp_path, distribution, point_count, seed)
+    tmp_path.replace(path)
+    return path
+
+
+def record_throughput(benchmark, point_count: int) -> None:
+    """
+    Add the point count and the throughput of a benchmark in its results.
+    """
+    benchmark.extra_info['point_count'] = point_count
+    if benchmark.stats is not None:
+        benchmark.extra_info['points_per_second'] = point_count / benchmark.stats.stats.mean
@@ -0,0 +1,22 @@
+import shutil
+
+from pytest import mark
+
+from py3dtiles.convert import convert, ENGINES
+from .synthetic import DISTRIBUTIONS, FORMATS, record_throughput, write_dataset
+
+
+@mark.parametrize('engine', ENGINES)
+@mark.parametrize('file_format', FORMATS)
+@mark.parametrize('distribution', DISTRIBUTIONS)
+def test_convert_perf(distribution, file_format, engine, point_count, synthetic_dir, tmp_path, benchmark):
+    path = write_dataset(synthetic_dir, distribution, point_count, file_format)
+    out = tmp_path / 'out'
+
+    def clean_output():
+        shutil.rmtree(out, ignore_errors=True)
+
+    benchmark.pedantic(convert, args=(path,), kwargs={'outfolder': out, 'engine': engine}, setup=clean_output, rounds=1)
+    record_throughput(benchmark, point_count)
+
+    assert (out / 'tileset.json').exists()
@@ -0,0 +1,169 @@
+import numpy as np
+from pytest import fixture, mark
+
+from py3dtiles.tilers.node import Node
+from py3dtiles.tilers.node.distance import xyz_to_child_index, xyz_to_key
+from py3dtiles.tilers.node.points_grid import _build_voxels, _insert, Grid
+from py3dtiles.tilers.node.sort_builder import CODE_DEPTH, xyz_to_codes
+from py3dtiles.tilers.pnts.pnts_writer import points_to_pnts
+from py3dtiles.utils import compute_spacing, split_aabb
+from .synthetic import DISTRIBUTIONS, EXTENT, get_points, record_throughput
+
+# convert makes the root aabb cubic
+ROOT_AABB = np.array([[0, 0, 0], [EXTENT.max()] * 3], dtype=np.float32)
+TILESET_DEPTH = 3
+# the pending points of a node are received in several batches
+PENDING_BATCH_COUNT = 10
+# a deep node of the urban district, whose grid keeps most of the points: its cells hold many points
+DENSE_NODE_AABB = np.array([[400, 400, 0], [600, 600, 200]], dtype=np.float32)
+DENSE_NODE_SPACING = 0.02
+
+
+@fixture(params=DISTRIBUTIONS)
+def points(request, kernel_point_count):
+    return get_points(request.param, kernel_point_count)
+
+
+def make_root_node() -> Node:
+    return Node(b'', ROOT_AABB, compute_spacing(ROOT_AABB))
+
+
+def test_xyz_to_key_perf(points, benchmark):
+    xyz, _ = points
+    node = make_root_node()
+    grid = node.grid
+    shift = int(grid.cell_count[0] - 1).bit_length()
+
+    keys = benchmark(xyz_to_key, xyz, grid.cell_count, node.aabb[0], node.inv_aabb_size, shift)
+    record_throughput(benchmark, len(xyz))
+
+    assert keys.shape == (len(xyz),)
+
+
+def test_xyz_to_codes_perf(points, benchmark):
+    xyz, _ = points
+    codes = benchmark(xyz_to_codes, xyz, ROOT_AABB.astype(np.float64), CODE_DEPTH)
+    record_throughput(benchmark, len(xyz))
+
+    assert codes.shape == (len(xyz),)
+
+
+def test_grid_insert_perf(points, benchmark):
+    xyz, rgb = points
+    node = make_root_node()
+
+    def new_grid():
+        return (Grid(node), node.aabb[0], node.inv_aabb_size, xyz, rgb), {}
+
+    def insert(grid, *args):
+        return grid.insert(*args)
+
+    remainder_xyz, _, _ = benchmark.pedantic(insert, setup=new_grid, rounds=5)
+    record_throughput(benchmark, len(xyz))
+
+    assert len(remainder_xyz) < len(xyz)
+
+
+def test_grid_insert_dense_perf(kernel_point_count, benchmark):
+    # each point is tested against the points around it in its cell
+    xyz, rgb = get_points('urban', kernel_point_count)
+    node = Node(b'0', DENSE_NODE_AABB, DENSE_NODE_SPACING)
+
+    def new_grid():
+        return (Grid(node), node.aabb[0], node.inv_aabb_size, xyz, rgb), {}
+
+    def insert(grid, *args):
+        return grid.insert(*args)
+
+    remainder_xyz, _, _ = benchmark.pedantic(insert, setup=new_grid, rounds=5)
+    record_throughput(benchmark, len(xyz))
+
+    assert len(remainder_xyz) < len(xyz) // 2
+
+
+def test_insert_force_perf(points, benchmark):
+    # the forced insertion redistributes the points of a grid when it is balanced
+    xyz, rgb = points
+    node = make_root_node()
+    grid = node.grid
+    shift = int(grid.cell_count[0] - 1).bit_length()
+
+    def new_cells():
+        grid = Grid(node)
+        return (
+            grid.cells_xyz, grid.cells_rgb, grid.size, grid.cell_offsets, grid.cell_counts, grid.cell_capacities,
+            *_build_voxels(grid.cells_xyz, grid.cell_offsets, grid.cell_counts, node.aabb[0], grid.inv_voxel_size),
+            grid.inv_voxel_size, node.aabb[0], node.inv_aabb_size, grid.cell_count, xyz, rgb, grid.spacing, shift, True
+        ), {}
+
+    benchmark.pedantic(_insert, setup=new_cells, rounds=5)
+    record_throughput(benchmark, len(xyz))
+
+
+def test_get_pending_points_perf(points, benchmark):
+    xyz, rgb = points
+
+    def new_node():
+        node = make_root_node()
+        node.children = []
+        node.pending_xyz = np.array_split(xyz, PENDING_BATCH_COUNT)
+        node.pending_rgb = np.array_split(rgb, PENDING_BATCH_COUNT)
+        return (node,), {}
+
+    def get_pending_points(node):
+        return list(node._get_pending_points())
+
+    children = benchmark.pedantic(get_pending_points, setup=new_node, rounds=5)
+    record_throughput(benchmark, len(xyz))
+
+    assert sum(len(child_xyz) for _, child_xyz, _ in children) == len(xyz)
+
+
+def test_points_to_pnts_perf(points, tmp_path, benchmark):
+    xyz, rgb = points
+    data = np.concatenate((xyz.view(np.uint8).ravel(), rgb.ravel()))
+
+    count, _ = benchmark(points_to_pnts, b'0', data, tmp_path, True, True)
+    record_throughput(benchmark, len(xyz))
+
+    assert count == len(xyz)
+
+
+def write_tile_tree(folder, name, aabb, xyz, rgb, depth):
+    """
+    Write the pnts of a node and of its descendants down to depth, with the same point count at every level.
+    """
+    keep = len(xyz) // (depth + 1)
+    points_to_pnts(name, np.concatenate((xyz[:keep].view(np.uint8).ravel(), rgb[:keep].ravel())), folder, True)
+    if depth == 0:
+        return
+
+    xyz, rgb = xyz[keep:], rgb[keep:]
+    indices = xyz_to_child_index(xyz, ((aabb[0] + aabb[1]) * 0.5).astype(np.float32))
+    for child in np.unique(indices):
+        mask = indices == child
+        write_tile_tree(
+            folder, name + str(child).encode('ascii'), split_aabb(aabb, child),
+            np.ascontiguousarray(xyz[mask]), rgb[mask], depth - 1
+        )
+
+
+@mark.parametrize('distribution', DISTRIBUTIONS)
+def test_to_tileset_perf(distribution, kernel_point_count, tmp_path, benchmark):
+    xyz, rgb = get_points(distribution, kernel_point_count)
+    spacing = compute_spacing(ROOT_AABB)
+    folder = tmp_path / 'tiles'
+
+    def new_tiles():
+        # to_tileset merges the small tiles in their parent, so the tree is written again for each round
+        if folder.exists():
+            for path in folder.rglob('*.pnts'):
+                path.unlink()
+        folder.mkdir(exist_ok=True)
+        write_tile_tree(folder, b'', ROOT_AABB, xyz, rgb, TILESET_DEPTH)
+        return (None, b'', ROOT_AABB, spacing * 2, folder, np.array([1, 1, 1])), {}
+
+    tileset = benchmark.pedantic(Node.to_tileset, setup=new_tiles, rounds=3)
+    record_throughput(benchmark, len(xyz))
+
+    assert tileset['content']['uri'] == 'r.pnts'
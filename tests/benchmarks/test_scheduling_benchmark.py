@@ -0,0 +1,45 @@
+import timeit
+
+import numpy as np
+from pytest import mark
+
+from py3dtiles.convert import State
+from py3dtiles.scheduling import NodeNameTrie
+
+NODE_COUNTS = [1_000, 10_000, 100_000, 1_000_000]
+# the time of a dispatch with the most nodes compared to the fewest (linear in the node count, it would be 1000)
+MAX_DISPATCH_TIME_RATIO = 10
+
+
+def make_state(node_count: int) -> State:
+    """
+    A state with node_count nodes, half of them waiting to be written and half waiting to be processed.
+    """
+    names = np.random.default_rng(0).integers(0, 8, size=(node_count, 8)) + ord('0')
+    names = [bytes(name) for name in names.astype(np.uint8)]
+
+    state = State([], 1)
+    state.waiting_writing_nodes = NodeNameTrie(names[:node_count // 2])
+    for name in names[node_count // 2:]:
+        state.node_to_process[name[:5]] = ([], 1)
+    state.processing_nodes[b'1'] = (1, 1, 0)
+    return state
+
+
+def time_dispatch(state: State) -> float:
+    return min(timeit.repeat(lambda: state.add_processed_node(b'77777777'), number=100, repeat=5)) / 100
+
+
+@mark.parametrize('node_count', NODE_COUNTS)
+def test_state_add_processed_node_perf(node_count, benchmark):
+    state = make_state(node_count)
+
+    benchmark(state.add_processed_node, b'77777777')
+    benchmark.extra_info['node_count'] = node_count
+
+
+def test_state_add_processed_node_flat():
+    # the time to dispatch a processed node shouldn't depend on the node count
+    smallest = time_dispatch(make_state(NODE_COUNTS[0]))
+    largest = time_dispatch(make_state(NODE_COUNTS[-1]))
+    assert largest < MAX_DISPATCH_TIME_RATIO * smallest
@@ -1,25 +1,40 @@
 import json
+import os
 from pathlib import Path
+import pickle
 import shutil
-from unittest.mock import patch
+import socket
+from types import MethodType, SimpleNamespace
+from typing import Iterator
+from unittest.mock import Mock, patch
 
 import laspy
+import numpy as np
+from numpy.testing import assert_array_equal
 from pyproj import CRS
-from pytest import fixture, raises
-
-from py3dtiles.convert import convert
-from py3dtiles.exceptions import SrsInMissingException, SrsInMixinException
+from pytest import fixture, mark, raises
+import zmq
+
+from py3dtiles import reprojection
+from py3dtiles.convert import _Convert, convert, ENGINES, State, Worker
+from py3dtiles.exceptions import SrsInMissingException, SrsInMixinException, WorkerException
+from py3dtiles.reader import copc_reader
+from py3dtiles.reader.array_reader import ArraySource
+from py3dtiles.scheduling import JobSizeController, NodeNameTrie
 from py3dtiles.tileset.utils import TileContentReader
+from py3dtiles.utils import ResponseType
+from .utils import make_npy_points, NODES, write_copc, write_ply
 
 DATA_DIRECTORY = Path(__file__).parent / 'fixtures'
 
 
-def number_of_points_in_tileset(tileset_path: Path) -> int:
+def pnts_in_tileset(tileset_path: Path) -> Iterator:
+    """
+    Yield the pnts tiles of a tileset which are added to their parents.
+    """
     with tileset_path.open() as f:
         tileset = json.load(f)
 
-    nb_points = 0
-
     children_tileset_info = [(tileset["root"], tileset["root"]["refine"])]
     while children_tileset_info:
         child_tileset, parent_refine = children_tileset_info.pop()
@@ -27,8 +42,7 @@ def number_of_points_in_tileset(tileset_path: Path) -> int:
 
         content = tileset_path.parent / child_tileset["content"]['uri']
         if content.suffix == '.pnts' and child_refine == "ADD":
-            tile = TileContentReader.read_file(content)
-            nb_points += tile.body.feature_table.nb_points()
+            yield TileContentReader.read_file(content)
         elif content.suffix == '.json':
             with content.open() as f:
                 sub_tileset = json.load(f)
@@ -39,7 +53,19 @@ def number_of_points_in_tileset(tileset_path: Path) -> int:
                 (sub_child_tileset, child_refine)for sub_child_tileset in child_tileset["children"]
             ]
 
-    return nb_points
+
+def number_of_points_in_tileset(tileset_path: Path) -> int:
+    return sum(tile.body.feature_table.nb_points() for tile in pnts_in_tileset(tileset_path))
+
+
+def colors_in_tileset(tileset_path: Path) -> np.ndarray:
+    """
+    Get the colors of the points of a tileset, sorted.
+    """
+    colors = np.concatenate([
+        tile.body.feature_table.body.colors_arr.reshape((-1, 3)) for tile in pnts_in_tileset(tileset_path)
+    ])
+    return colors[np.lexsort(colors.T[::-1])]
 
 
 @fixture()
@@ -69,6 +95,215 @@ def test_convert(tmp_dir):
     assert las_point_count == number_of_points_in_tileset(tileset_path)
 
 
+def test_convert_resume(tmp_dir):
+    path = DATA_DIRECTORY / "ripple.las"
+
+    with raises(FileNotFoundError, match="No checkpoint found"):
+        convert(path, outfolder=tmp_dir, resume=True)
+
+    send_pnts_to_write = _Convert.send_pnts_to_write
+    written = []
+
+    def interrupt_after_first_write(self):
+        if written:
+            raise Exception("Interrupted")
+        written.append(True)
+        send_pnts_to_write(self)
+
+    with patch.object(_Convert, 'send_pnts_to_write', interrupt_after_first_write):
+        with raises(Exception, match="Interrupted"):
+            convert(path, outfolder=tmp_dir, checkpoint_interval=0, jobs=2)
+
+    assert Path(tmp_dir, 'tmp', 'checkpoint', 'state.pickle').exists()
+    assert not Path(tmp_dir, 'tileset.json').exists()
+    # the pnts written after the checkpoint are found even if their modification time is older
+    # (e.g. with coarse timestamps, or the clock of another host)
+    for pnts_path in tmp_dir.rglob('*.pnts'):
+        os.utime(pnts_path, (0, 0))
+
+    convert(path, outfolder=tmp_dir, resume=True, jobs=2)
+
+    assert not Path(tmp_dir, 'tmp').exists()
+    with laspy.open(path) as f:
+        las_point_count = f.header.point_count
+
+    assert las_point_count == number_of_points_in_tileset(tmp_dir / 'tileset.json')
+
+
+def test_convert_append(tmp_dir, tmp_path):
+    las = laspy.read(DATA_DIRECTORY / "ripple.las")
+    half_count = len(las.points) // 2
+    halves = []
+    for i, points in enumerate([las.points[:half_count], las.points[half_count:]]):
+        half = laspy.LasData(las.header)
+        half.points = points
+        halves.append(tmp_path / f'ripple_{i}.las')
+        half.write(halves[-1])
+
+    # the tileset is created by the first append
+    convert(halves[0], outfolder=tmp_dir, append=True, jobs=2)
+    assert Path(tmp_dir, 'state', 'metadata.pickle').exists()
+    assert half_count == number_of_points_in_tileset(tmp_dir / 'tileset.json')
+
+    convert(halves[1], outfolder=tmp_dir, append=True, jobs=2)
+    assert not Path(tmp_dir, 'tmp').exists()
+    assert len(las.points) == number_of_points_in_tileset(tmp_dir / 'tileset.json')
+
+    shutil.rmtree(tmp_dir)
+    convert(halves[0], outfolder=tmp_dir, jobs=2)
+    with raises(ValueError, match="can't be appended"):
+        convert(halves[1], outfolder=tmp_dir, append=True, jobs=2)
+
+
+def test_convert_trace(tmp_dir):
+    tmp_dir.mkdir()
+    trace_path = tmp_dir / 'trace.json'
+    path = DATA_DIRECTORY / "ripple.las"
+    convert(path, outfolder=tmp_dir / 'out', trace=trace_path, jobs=2)
+
+    with trace_path.open() as f:
+        events = json.load(f)
+
+    spans = [event for event in events if event['ph'] == 'X']
+    span_names = {event['name'] for event in spans}
+    assert {'read_file', 'process_jobs', 'write_pnts', 'write tileset'} <= span_names
+    assert all(event['dur'] >= 0 for event in spans)
+    with laspy.open(path) as f:
+        las_point_count = f.header.point_count
+    assert sum(event['args']['points'] for event in spans if event['name'] == 'read_file') == las_point_count
+    assert any(event['ph'] == 'C' and event['name'] == 'progress' for event in events)
+
+
+@mark.skipif(not Path('/dev/shm').exists(), reason="The shared memory segments are listed in /dev/shm")
+def test_convert_shared_memory(tmp_dir):
+    path = DATA_DIRECTORY / "ripple.las"
+    shared_memory_dir = Path('/dev/shm')
+    segments = set(shared_memory_dir.iterdir())
+
+    convert(path, outfolder=tmp_dir, jobs=2, shared_memory=True)
+
+    with laspy.open(path) as f:
+        las_point_count = f.header.point_count
+    assert las_point_count == number_of_points_in_tileset(tmp_dir / 'tileset.json')
+    # every segment is released
+    assert set(shared_memory_dir.iterdir()) == segments
+
+    with raises(ValueError, match="shared memory"):
+        convert(path, outfolder=tmp_dir, overwrite=True, shared_memory=True, bind='tcp://127.0.0.1:0')
+
+
+def test_convert_remote_workers(tmp_dir):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    uri = f'tcp://127.0.0.1:{port}'
+
+    with raises(ValueError, match="jobs should be strictly positive"):
+        convert(DATA_DIRECTORY / "ripple.las", outfolder=tmp_dir, jobs=0)
+
+    # the workers wait for the conversion to start
+    workers = [
+        Worker(trace=False, transformer=None, octree_metadata=None, folder=None,
+               write_rgb=None, overwrite_pnts=None, shared_memory=False, verbosity=0, uri=uri)
+        for _ in range(2)
+    ]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    try:
+        convert(DATA_DIRECTORY / "ripple.las", outfolder=tmp_dir, jobs=0, bind=uri)
+        for worker in workers:
+            worker.join(timeout=30)
+            assert worker.exitcode == 0
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+    with laspy.open(DATA_DIRECTORY / "ripple.las") as f:
+        las_point_count = f.header.point_count
+
+    assert las_point_count == number_of_points_in_tileset(tmp_dir / 'tileset.json')
+
+
+def test_convert_job_timeout(tmp_dir):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    uri = f'tcp://127.0.0.1:{port}'
+
+    # a remote worker that registers, then stops answering
+    context = zmq.Context()
+    try:
+        dead_worker = context.socket(zmq.DEALER)
+        dead_worker.connect(uri)
+        dead_worker.send_multipart([ResponseType.REGISTER.value])
+
+        with raises(WorkerException, match="did not finish its configure job in 1.0 seconds"):
+            convert(DATA_DIRECTORY / "ripple.las", outfolder=tmp_dir, jobs=0, bind=uri, job_timeout=1.)
+    finally:
+        context.destroy(linger=0)
+
+
+def test_convert_sort_engine(tmp_dir):
+    # the points of a file and the same points in memory
+    path = DATA_DIRECTORY / "ripple.las"
+    las = laspy.read(path)
+    source = ArraySource(np.vstack((las.x, las.y, las.z)).transpose(),
+                         np.vstack((las.red, las.green, las.blue)).transpose())
+    convert([path, source], outfolder=tmp_dir, engine='sort', jobs=2)
+
+    assert not Path(tmp_dir, 'tmp').exists()
+    assert 2 * len(las.points) == number_of_points_in_tileset(tmp_dir / 'tileset.json')
+
+    # the tree of the insert engine
+    convert([path, source], outfolder=tmp_dir / 'insert', jobs=2)
+    assert ({tile.name for tile in tmp_dir.glob('*.pnts')}
+            == {tile.name for tile in (tmp_dir / 'insert').glob('*.pnts')})
+    assert_array_equal(colors_in_tileset(tmp_dir / 'tileset.json'),
+                       colors_in_tileset(tmp_dir / 'insert' / 'tileset.json'))
+
+    for option in [{'append': True}, {'checkpoint_interval': 10}, {'shared_memory': True}]:
+        with raises(ValueError, match="can't be used with the sort engine"):
+            convert(path, outfolder=tmp_dir, overwrite=True, engine='sort', **option)
+    with raises(ValueError, match="engine should be one of insert, sort"):
+        convert(path, outfolder=tmp_dir, overwrite=True, engine='merge')
+
+
+def test_state_add_processed_node():
+    state = State([], 1)
+    state.node_to_process[b'0'] = ([], 10)
+    state.node_to_process[b'124'] = ([], 10)
+    state.processing_nodes[b'1'] = (1, 10, 0)
+    for name in [b'12', b'1245', b'13', b'01']:
+        state.add_processed_node(name)
+    assert state.pnts_to_writing == []
+
+    state.end_processing(b'1')
+    state.add_processed_node(b'1')
+    assert sorted(state.pnts_to_writing) == [b'1', b'12', b'13']
+    assert sorted(state.waiting_writing_nodes) == [b'01', b'1245']
+
+    del state.node_to_process[b'0']
+    del state.node_to_process[b'124']
+    state.add_processed_node(b'2')
+    assert sorted(state.pnts_to_writing) == [b'01', b'1', b'12', b'1245', b'13', b'2']
+    assert len(state.waiting_writing_nodes) == 0
+
+
+def test_state_add_processed_root():
+    # the root is processed last, after the children it sent points to
+    state = State([], 1)
+    state.processing_nodes[b''] = (1, 10, 0)
+    for name in [b'3', b'4']:
+        state.add_processed_node(name)
+    assert state.pnts_to_writing == []
+
+    state.end_processing(b'')
+    state.add_processed_node(b'')
+    assert sorted(state.pnts_to_writing) == [b'3', b'4']
+    assert len(state.waiting_writing_nodes) == 0
+
+
 def test_convert_without_srs(tmp_dir):
     with raises(SrsInMissingException):
         convert(DATA_DIRECTORY / 'without_srs.las',
@@ -121,6 +356,29 @@ def test_convert_with_srs(tmp_dir):
     assert las_point_count == number_of_points_in_tileset(tileset_path)
 
 
+def test_convert_reprojection_max_error(tmp_dir, monkeypatch):
+    # the file has too few points to be interpolated otherwise
+    monkeypatch.setattr(reprojection, 'MIN_POINT_COUNT', 0)
+
+    with raises(ValueError, match="only be used with crs_out"):
+        convert(DATA_DIRECTORY / 'with_srs_3857.las', outfolder=tmp_dir, reprojection_max_error=0.001)
+
+    convert(DATA_DIRECTORY / 'with_srs_3857.las',
+            outfolder=tmp_dir,
+            crs_out=CRS.from_epsg(4978),
+            reprojection_max_error=0.001,
+            jobs=1)
+
+    with (tmp_dir / 'tileset.json').open() as f:
+        tileset = json.load(f)
+    expecting_box = [5.1633, 5.1834, 0.1731, 5.1631, 0, 0, 0, 5.1834, 0, 0, 0, 0.1867]
+    box = [round(value, 4) for value in tileset['root']['boundingVolume']['box']]
+    assert box == expecting_box
+
+    with laspy.open(DATA_DIRECTORY / 'with_srs_3857.las') as f:
+        assert f.header.point_count == number_of_points_in_tileset(tmp_dir / 'tileset.json')
+
+
 def test_convert_simple_xyz(tmp_dir):
     convert(DATA_DIRECTORY / 'simple.xyz',
             outfolder=tmp_dir,
@@ -148,6 +406,68 @@ def test_convert_simple_xyz(tmp_dir):
     assert box == expecting_box
 
 
+def test_convert_array_source(tmp_dir):
+    xyz = np.loadtxt(DATA_DIRECTORY / 'simple.xyz')
+    convert(ArraySource(xyz, crs=CRS.from_epsg(3857)),
+            outfolder=tmp_dir,
+            crs_out=CRS.from_epsg(4978),
+            jobs=1)
+
+    tileset_path = tmp_dir / 'tileset.json'
+    assert len(xyz) == number_of_points_in_tileset(tileset_path)
+
+    # the points of ripple.las, in chunks, with the points of a file
+    with laspy.open(DATA_DIRECTORY / 'ripple.las') as f:
+        las = f.read()
+    las_xyz = np.vstack((las.x, las.y, las.z)).transpose()
+    las_rgb = np.vstack((las.red, las.green, las.blue)).transpose()
+    rgb = (las_rgb >> 8).astype(np.uint8)
+    chunks = ((las_xyz[i:i + 1000], rgb[i:i + 1000]) for i in range(0, len(las_xyz), 1000))
+    source = ArraySource.from_chunks(chunks, [las.header.mins, las.header.maxs], len(las_xyz), name='ripple')
+
+    convert([source, DATA_DIRECTORY / 'ripple.las'], outfolder=tmp_dir, overwrite=True, jobs=2)
+    assert 2 * len(las_xyz) == number_of_points_in_tileset(tileset_path)
+
+    # the 16 bits colors of ripple.las are scaled, the 8 bits colors of the other source aren't
+    for engine in ENGINES:
+        convert([ArraySource(las_xyz, las_rgb), ArraySource(las_xyz, rgb)], outfolder=tmp_dir, overwrite=True,
+                jobs=2, engine=engine)
+        expected = np.concatenate((rgb, rgb))
+        assert_array_equal(colors_in_tileset(tileset_path), expected[np.lexsort(expected.T[::-1])])
+
+    # the colors of the chunks are only read during the conversion
+    chunks = [(las_xyz, las_rgb)]
+    with raises(WorkerException, match="the color_scale should be set"):
+        convert(ArraySource.from_chunks(chunks, [las.header.mins, las.header.maxs], len(las_xyz)),
+                outfolder=tmp_dir, overwrite=True, jobs=1)
+
+    with raises(ValueError, match="can't be resumed"):
+        convert(ArraySource(xyz), outfolder=tmp_dir, overwrite=True, checkpoint_interval=10)
+
+
+def test_array_source_read():
+    xyz = np.arange(30, dtype=np.float64).reshape((10, 3))
+    source = ArraySource(xyz)
+    assert_array_equal(source.get_metadata()['aabb'], [[0, 1, 2], [27, 28, 29]])
+    read_xyz, read_rgb = source.read(2, 5)
+    assert_array_equal(read_xyz, xyz[2:5])
+    assert_array_equal(read_rgb, np.zeros((3, 3)))
+
+    # the portions of the chunks don't follow the chunk sizes
+    source = ArraySource.from_chunks([(xyz[:4], None), (xyz[4:], None)], [[0, 1, 2], [27, 28, 29]], 10)
+    assert_array_equal(source.read(0, 3)[0], xyz[:3])
+    with raises(ValueError, match="in order"):
+        source.read(5, 10)
+    assert_array_equal(source.read(3, 10)[0], xyz[3:])
+
+    with raises(ValueError, match="less points"):
+        ArraySource.from_chunks([(xyz, None)], [[0, 1, 2], [27, 28, 29]], 11).read(0, 11)
+    with raises(ValueError, match="more points"):
+        ArraySource.from_chunks([(xyz, None)], [[0, 1, 2], [27, 28, 29]], 9).read(0, 9)
+    with raises(ValueError, match="shape"):
+        ArraySource(xyz, np.zeros((9, 3), dtype=np.uint8))
+
+
 def test_convert_mix_las_xyz(tmp_dir):
     convert([DATA_DIRECTORY / 'simple.xyz', DATA_DIRECTORY / 'with_srs_3857.las'],
             outfolder=tmp_dir,
@@ -177,6 +497,42 @@ def test_convert_mix_las_xyz(tmp_dir):
     assert box == expecting_box
 
 
+def test_convert_copc(tmp_dir, tmp_path, monkeypatch):
+    # the nodes are read in depth-first order, by portions of several nodes
+    monkeypatch.setattr(copc_reader, 'POINTS_PER_PORTION', 50)
+    path = tmp_path / 'points.copc.laz'
+    write_copc(path, NODES)
+    convert(path, outfolder=tmp_dir, jobs=2)
+
+    assert number_of_points_in_tileset(tmp_dir / 'tileset.json') == sum(count for _, count, _ in NODES)
+
+
+def test_convert_ply_npy(tmp_dir, tmp_path):
+    write_ply(tmp_path / 'points.ply', 1000)
+    np.save(tmp_path / 'points.npy', make_npy_points(2000))
+    convert([tmp_path / 'points.ply', tmp_path / 'points.npy'], outfolder=tmp_dir, jobs=2)
+
+    assert number_of_points_in_tileset(tmp_dir / 'tileset.json') == 3000
+
+
+def test_convert_metadata_cache(tmp_dir, tmp_path):
+    files = [DATA_DIRECTORY / 'simple.xyz', DATA_DIRECTORY / 'with_srs_3857.las']
+    cache_dir = tmp_path / 'cache'
+
+    # the metadata of several files are read in a process pool
+    convert(files, outfolder=tmp_dir, crs_out=CRS.from_epsg(4978), jobs=2, metadata_cache=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 2
+    tileset = json.loads((tmp_dir / 'tileset.json').read_text())
+
+    with patch('py3dtiles.reader.las_reader.read_header_info') as read_header_info:
+        with patch('py3dtiles.reader.xyz_reader.scan') as scan:
+            convert(files, outfolder=tmp_dir, overwrite=True, crs_out=CRS.from_epsg(4978), jobs=1,
+                    metadata_cache=cache_dir)
+    read_header_info.assert_not_called()
+    scan.assert_not_called()
+    assert json.loads((tmp_dir / 'tileset.json').read_text())['root'] == tileset['root']
+
+
 def test_convert_mix_input_crs(tmp_dir):
     with raises(SrsInMixinException):
         convert([DATA_DIRECTORY / 'with_srs_3950.las', DATA_DIRECTORY / 'with_srs_3857.las'],
@@ -233,3 +589,27 @@ def test_convert_export_folder_already_exists(tmp_dir):
             jobs=1)
 
     assert (tmp_dir / 'tileset.json').exists()
+
+
+def test_send_file_to_read_laz_chunks():
+    # the portions of a laz file start at a chunk
+    converter = SimpleNamespace(
+        verbose=0,
+        state=State([('points.laz', (0, 250_000)), ('points.las', (0, 250_000))], 2),
+        job_sizes=JobSizeController(read_count=100_000),
+        file_info={'chunk_size': {'points.laz': 30_000, 'points.las': None}, 'color_scale': {}},
+        avg_min=np.zeros(3),
+        root_scale=np.ones(3),
+        rotation_matrix=None,
+        zmq_manager=Mock(),
+    )
+    converter.pop_file_portion = MethodType(_Convert.pop_file_portion, converter)
+    converter.get_read_parameters = MethodType(_Convert.get_read_parameters, converter)
+    for _ in range(6):
+        _Convert.send_file_to_read(converter)
+
+    sent = [pickle.loads(call.args[0][1]) for call in converter.zmq_manager.send_to_process.call_args_list]
+    assert [(Path(params['filename']).name, params['portion']) for params in sent] == [
+        ('points.las', (0, 100_000)), ('points.las', (100_000, 200_000)), ('points.las', (200_000, 250_000)),
+        ('points.laz', (0, 90_000)), ('points.laz', (90_000, 180_000)), ('points.laz', (180_000, 250_000)),
+    ]
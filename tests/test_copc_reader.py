@@ -0,0 +1,90 @@
+from pathlib import Path
+
+import laspy
+import numpy as np
+from numpy.testing import assert_array_equal
+from pytest import fixture, raises
+
+from py3dtiles.convert import get_extension, READER_MAP
+from py3dtiles.reader import copc_reader
+from py3dtiles.reader.copc_reader import get_depth_first_order, get_metadata, get_portions, read_hierarchy
+from .utils import make_entries, NODES, read_batches, write_copc
+
+
+@fixture
+def copc_path(tmp_path):
+    path = tmp_path / 'points.copc.laz'
+    write_copc(path, NODES)
+    return path
+
+
+def test_get_extension():
+    assert READER_MAP[get_extension(Path('points.copc.laz'))] is copc_reader
+    assert get_extension(Path('points.laz')) == '.laz'
+    assert get_extension(Path('dir.copc/points.las')) == '.las'
+
+
+def test_read_hierarchy(copc_path):
+    nodes = read_hierarchy(copc_path)
+    assert sorted(nodes[['level', 'x', 'y', 'z']].tolist()) == sorted(key for key, _, _ in NODES)
+    assert nodes['point_count'].sum() == 205
+
+    with raises(ValueError, match='not a COPC file'):
+        read_hierarchy(Path(__file__).parent / 'fixtures' / 'with_srs_3857.las')
+
+
+def test_get_depth_first_order():
+    nodes = make_entries(NODES, range(len(NODES)))
+    assert [NODES[i][0] for i in get_depth_first_order(nodes)] == [
+        (0, 0, 0, 0), (1, 0, 0, 0), (2, 0, 0, 0), (2, 1, 1, 1), (1, 1, 0, 0), (2, 2, 1, 0),
+    ]
+
+
+def test_get_portions(monkeypatch):
+    # in the file, the points of the nodes in depth-first order are at [55, 155[, [175, 205[, [155, 175[, [50, 55[,
+    # [0, 40[ and [40, 50[
+    nodes = make_entries(NODES, [rank for _, _, rank in NODES])
+    assert get_portions(nodes) == [(0, 205, ((55, 155), (175, 205), (155, 175), (50, 55), (0, 50)))]
+
+    monkeypatch.setattr(copc_reader, 'POINTS_PER_PORTION', 50)
+    assert get_portions(nodes) == [
+        (0, 100, ((55, 155),)),
+        (100, 150, ((175, 205), (155, 175))),
+        (150, 205, ((50, 55), (0, 50))),
+    ]
+
+
+def test_get_metadata(copc_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(copc_reader, 'POINTS_PER_PORTION', 50)
+    cache_dir = tmp_path / 'cache'
+    metadata = get_metadata(copc_path, cache_dir=cache_dir)
+    with laspy.open(copc_path) as f:
+        header = f.header
+    assert metadata['point_count'] == 205
+    assert_array_equal(metadata['aabb'], [header.mins, header.maxs])
+    assert metadata['portions'] == [(str(copc_path), portion) for portion in get_portions(read_hierarchy(copc_path))]
+    assert len(metadata['portions']) == 3
+
+    # the nodes are kept whole
+    assert get_metadata(copc_path, fraction=50)['point_count'] == 150
+    assert get_metadata(copc_path, color_scale=2)['color_scale'] == 2
+
+    def read_hierarchy_mock(path):
+        raise AssertionError("the hierarchy should be cached")
+
+    monkeypatch.setattr(copc_reader, 'read_hierarchy', read_hierarchy_mock)
+    assert get_metadata(copc_path, cache_dir=cache_dir)['portions'] == metadata['portions']
+
+
+def test_run(tmp_path):
+    path = tmp_path / 'points.copc.laz'
+    las = write_copc(path, NODES)
+    metadata = get_metadata(path)
+    offset_scale = (np.array([0, 0, 0]), np.array([1, 1, 1]), None, None)
+    batches = read_batches(copc_reader, path, offset_scale, metadata['portions'][0][1], batch_size=30)
+    indices = np.concatenate([np.arange(55, 155), np.arange(175, 205), np.arange(155, 175), np.arange(50, 55),
+                              np.arange(0, 50)])
+    xyz = np.concatenate([xyz for xyz, _ in batches])
+    assert_array_equal(xyz, np.stack((las.x, las.y, las.z), axis=1)[indices].astype(np.float32))
+    rgb = np.concatenate([rgb for _, rgb in batches])
+    assert_array_equal(rgb, np.stack((las.red, las.green, las.blue), axis=1)[indices])
@@ -0,0 +1,111 @@
+from pathlib import Path
+import shutil
+import struct
+
+import laspy
+import numpy as np
+from numpy.testing import assert_array_equal
+from pyproj import CRS
+
+from py3dtiles.reader import las_reader
+from py3dtiles.reader.las_reader import get_metadata, LASZIP_VARIABLE_CHUNK_SIZE, read_laz_chunk_size
+from .utils import read_batches
+
+DATA_DIRECTORY = Path(__file__).parent / 'fixtures'
+
+
+def test_get_metadata():
+    metadata = get_metadata(DATA_DIRECTORY / 'with_srs_3857.las')
+    with laspy.open(DATA_DIRECTORY / 'with_srs_3857.las') as f:
+        header = f.header
+    assert metadata['point_count'] == header.point_count
+    assert metadata['portions'] == [(str(DATA_DIRECTORY / 'with_srs_3857.las'), (0, header.point_count))]
+    assert_array_equal(metadata['aabb'], [header.mins, header.maxs])
+
+    # the CRS is read in the GeoTIFF keys
+    assert CRS(metadata['srs_in']) == CRS.from_epsg(3857)
+    assert CRS(get_metadata(DATA_DIRECTORY / 'with_srs_3950.las')['srs_in']) == CRS.from_epsg(3950)
+    assert get_metadata(DATA_DIRECTORY / 'without_srs.las')['srs_in'] is None
+
+    assert get_metadata(DATA_DIRECTORY / 'with_srs_3857.las', fraction=50)['point_count'] == header.point_count // 2
+    assert get_metadata(DATA_DIRECTORY / 'with_srs_3857.las', color_scale=2)['color_scale'] == 2
+
+
+def test_get_metadata_cache(tmp_path):
+    path = tmp_path / 'points.las'
+    shutil.copy(DATA_DIRECTORY / 'with_srs_3857.las', path)
+    cache_dir = tmp_path / 'cache'
+
+    metadata = get_metadata(path, cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 1
+    # the cache is used while the file doesn't change
+    las = laspy.read(path)
+    path.unlink()
+    shutil.copy(DATA_DIRECTORY / 'with_srs_3857.las', path)
+    assert get_metadata(path, cache_dir=cache_dir)['point_count'] == metadata['point_count']
+
+    las.points = las.points[:10]
+    las.write(path)
+    assert get_metadata(path, cache_dir=cache_dir)['point_count'] == 10
+
+
+def read_las_batches(path, portion):
+    metadata = get_metadata(path)
+    offset_scale = (-metadata['avg_min'], np.array([2, 2, 2]), None, metadata['color_scale'])
+    return read_batches(las_reader, path, offset_scale, portion, batch_size=300)
+
+
+def test_run():
+    path = DATA_DIRECTORY / 'ripple.las'
+    # the uncompressed points are mapped
+    batches = read_las_batches(path, (1000, 2000))
+    assert [len(xyz) for xyz, _ in batches] == [300, 300, 300, 100]
+
+    las = laspy.read(path)
+    metadata = get_metadata(path)
+    xyz = np.concatenate([xyz for xyz, _ in batches])
+    expected_xyz = (np.vstack((las.x, las.y, las.z)).T[1000:2000] - metadata['avg_min']) * 2
+    assert_array_equal(xyz, expected_xyz.astype(np.float32))
+
+
+def add_laszip_vlr(source: Path, path: Path, chunk_size: int) -> None:
+    """
+    Copy a las file with a laszip VLR, laspy doesn't write it in uncompressed files.
+    """
+    data = bytearray(source.read_bytes())
+    header_size = struct.unpack_from('<H', data, 94)[0]
+    record = struct.pack('<HHBBHIIqqH', 2, 0, 3, 4, 3, 0, chunk_size, -1, -1, 0)
+    vlr = struct.pack('<H16sHH32s', 0, b'laszip encoded', 22204, len(record), b'') + record
+    offset_to_point_data, vlr_count = struct.unpack_from('<II', data, 96)
+    struct.pack_into('<II', data, 96, offset_to_point_data + len(vlr), vlr_count + 1)
+    path.write_bytes(data[:header_size] + vlr + data[header_size:])
+
+
+def test_read_laz_chunk_size(tmp_path):
+    path = tmp_path / 'points.las'
+    add_laszip_vlr(DATA_DIRECTORY / 'ripple.las', path, 50_000)
+    assert read_laz_chunk_size(path) == 50_000
+    assert len(laspy.read(path).points) == 10201
+
+    add_laszip_vlr(DATA_DIRECTORY / 'ripple.las', path, LASZIP_VARIABLE_CHUNK_SIZE)
+    assert read_laz_chunk_size(path) is None
+    assert read_laz_chunk_size(DATA_DIRECTORY / 'ripple.las') is None
+
+
+def test_run_laz(monkeypatch):
+    # the compressed points (not mapped) are read in sequence, from the start of the portion
+    path = DATA_DIRECTORY / 'ripple.las'
+    batches = read_las_batches(path, (1000, 2000))
+    seeks = []
+    seek = laspy.LasReader.seek
+
+    def record_seek(reader, position, *args):
+        seeks.append(position)
+        return seek(reader, position, *args)
+
+    monkeypatch.setattr(las_reader, 'memmap_points', lambda *args: None)
+    monkeypatch.setattr(laspy.LasReader, 'seek', record_seek)
+    for (xyz, rgb), (laz_xyz, laz_rgb) in zip(batches, read_las_batches(path, (1000, 2000))):
+        assert_array_equal(xyz, laz_xyz)
+        assert_array_equal(rgb, laz_rgb)
+    assert seeks == [1000]
@@ -0,0 +1,86 @@
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+from pytest import fixture, raises
+
+from py3dtiles.reader import npy_reader
+from py3dtiles.reader.npy_reader import get_color_fields, get_metadata, load_points
+from .utils import make_npy_points, NPY_POINT_DTYPE, PointQueue, read_batches
+
+
+@fixture
+def npy_path(tmp_path):
+    path = tmp_path / 'points.npy'
+    np.save(path, make_npy_points(1000))
+    return path
+
+
+def test_get_color_fields():
+    assert get_color_fields(NPY_POINT_DTYPE) == ('red', 'green', 'blue')
+    assert get_color_fields(np.dtype([('x', 'f8'), ('intensity', 'u2')])) == ('intensity',) * 3
+    assert get_color_fields(np.dtype([('x', 'f8'), ('r', 'u1'), ('g', 'u1'), ('b', 'u1')])) == ('r', 'g', 'b')
+    assert get_color_fields(np.dtype([('x', 'f8'), ('red', 'u1')])) is None
+
+
+def test_load_points(npy_path, tmp_path):
+    points = load_points(npy_path)
+    assert isinstance(points, np.memmap)
+    assert_array_equal(points, make_npy_points(1000))
+
+    np.save(tmp_path / 'array.npy', np.zeros((10, 3)))
+    with raises(ValueError, match='should be a structured array with x, y and z fields'):
+        load_points(tmp_path / 'array.npy')
+
+
+def test_get_metadata(npy_path, tmp_path, monkeypatch):
+    points = make_npy_points(1000)
+    cache_dir = tmp_path / 'cache'
+    metadata = get_metadata(npy_path, cache_dir=cache_dir)
+    assert metadata['point_count'] == 1000
+    assert metadata['portions'] == [(str(npy_path), (0, 1000))]
+    assert_array_equal(metadata['aabb'], [
+        [points['x'].min(), points['y'].min(), points['z'].min()],
+        [points['x'].max(), points['y'].max(), points['z'].max()],
+    ])
+    assert metadata['color_scale'] is None
+    assert metadata['srs_in'] is None
+    assert get_metadata(npy_path, fraction=50)['point_count'] == 500
+
+    def load_points_mock(path):
+        raise AssertionError("the metadata should be cached")
+
+    with monkeypatch.context() as m:
+        m.setattr(npy_reader, 'load_points', load_points_mock)
+        assert get_metadata(npy_path, cache_dir=cache_dir)['point_count'] == 1000
+
+    # 16 bits colors
+    points['red'][0] = 1000
+    np.save(npy_path, points)
+    assert get_metadata(npy_path, cache_dir=cache_dir)['color_scale'] == 1 / 255
+
+
+def test_run(npy_path):
+    points = make_npy_points(1000)
+    offset_scale = (-np.array([100, 200, 300]), np.array([2, 2, 2]), None, None)
+    batches = read_batches(npy_reader, npy_path, offset_scale, (100, 800), batch_size=300)
+    assert [len(xyz) for xyz, _ in batches] == [300, 300, 100]
+
+    xyz = np.concatenate([xyz for xyz, _ in batches])
+    expected = (np.stack([points[axis] for axis in ['x', 'y', 'z']], axis=1)[100:800] - [100, 200, 300]) * 2
+    assert_allclose(xyz, expected, rtol=1e-6)
+    rgb = np.concatenate([rgb for _, rgb in batches])
+    assert_array_equal(rgb, np.stack([points[field] for field in ['red', 'green', 'blue']], axis=1)[100:800])
+
+
+def test_run_perf(tmp_path, benchmark):
+    path = tmp_path / 'points.npy'
+    np.save(path, make_npy_points(1_000_000))
+    offset_scale = (np.zeros(3), np.ones(3), None, None)
+
+    def read():
+        queue = PointQueue()
+        npy_reader.run(str(path), offset_scale, (0, 1_000_000), queue, None)
+        return queue
+
+    queue = benchmark(read)
+    # the batches of 100k points and the end of the reading
+    assert len(queue.messages) == 11
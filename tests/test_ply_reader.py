@@ -0,0 +1,72 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+from pytest import mark, raises
+
+from py3dtiles.reader import ply_reader
+from py3dtiles.reader.ply_reader import get_metadata, load_points, read_header
+from .utils import read_batches, write_ply
+
+
+@mark.parametrize('byte_order', ['<', '>'])
+def test_load_points(tmp_path, byte_order):
+    path = tmp_path / 'points.ply'
+    points = write_ply(path, 100, byte_order)
+    loaded = load_points(path)
+    assert isinstance(loaded, np.memmap)
+    assert_array_equal(loaded, points)
+
+    # the elements before the vertices are skipped
+    points = write_ply(path, 100, byte_order, before_vertices='element camera 2\nproperty int view\n')
+    assert_array_equal(load_points(path), points)
+
+
+def test_read_header_errors(tmp_path):
+    path = tmp_path / 'points.ply'
+    for header, message in [
+        (b'xyz\n', 'not a PLY file'),
+        (b'ply\nformat ascii 1.0\nelement vertex 1\nproperty float x\nend_header\n',
+         'should be binary_little_endian or binary_big_endian'),
+        (b'ply\nformat binary_little_endian 1.0\nelement vertex 1\nproperty float x\n', 'no end_header'),
+        (b'ply\nformat binary_little_endian 1.0\nelement face 1\nend_header\n', 'no vertex element'),
+        (b'ply\nformat binary_little_endian 1.0\nelement vertex 1\nproperty float128 x\nend_header\n',
+         'Invalid property float128 x'),
+        (b'ply\nformat binary_little_endian 1.0\nelement face 1\nproperty list uchar int vertex_indices\n'
+         b'element vertex 1\nproperty float x\nend_header\n', 'should be after the vertices'),
+    ]:
+        path.write_bytes(header)
+        with raises(ValueError, match=message):
+            read_header(path)
+
+    path.write_bytes(b'ply\nformat binary_little_endian 1.0\nelement vertex 1\nproperty float x\nend_header\n')
+    with raises(ValueError, match='structured array with x, y and z fields'):
+        load_points(path)
+
+    write_ply(path, 100)
+    path.write_bytes(path.read_bytes()[:1000])
+    with raises(ValueError, match='truncated'):
+        load_points(path)
+
+
+def test_get_metadata(tmp_path):
+    path = tmp_path / 'points.ply'
+    points = write_ply(path, 1000)
+    metadata = get_metadata(path)
+    assert metadata['point_count'] == 1000
+    assert metadata['portions'] == [(str(path), (0, 1000))]
+    assert_array_equal(metadata['aabb'], [
+        [points['x'].min(), points['y'].min(), points['z'].min()],
+        [points['x'].max(), points['y'].max(), points['z'].max()],
+    ])
+    assert metadata['color_scale'] is None
+
+
+def test_run(tmp_path):
+    path = tmp_path / 'points.ply'
+    points = write_ply(path, 1000, '>')
+    offset_scale = (np.zeros(3), np.ones(3), None, None)
+    batches = read_batches(ply_reader, path, offset_scale, (500, 1000), batch_size=300)
+    assert [len(xyz) for xyz, _ in batches] == [300, 200]
+    xyz = np.concatenate([xyz for xyz, _ in batches])
+    assert_array_equal(xyz, np.stack([points[axis] for axis in ['x', 'y', 'z']], axis=1)[500:])
+    rgb = np.concatenate([rgb for _, rgb in batches])
+    assert_array_equal(rgb, np.stack([points[field] for field in ['red', 'green', 'blue']], axis=1)[500:])
@@ -1,11 +1,12 @@
 from pathlib import Path
+import pickle
 
 import numpy as np
 from numpy.testing import assert_array_equal
 import pytest
 
-from py3dtiles.tilers.node import Grid,Node
-from py3dtiles.tilers.node.distance import is_point_far_enough
+from py3dtiles.tilers.node import Grid, Node, split_nodes
+from py3dtiles.tilers.node.distance import is_point_far_enough, xyz_to_key
 from py3dtiles.utils import compute_spacing, node_name_to_path
 
 # test point
@@ -61,6 +62,161 @@ def test_grid_get_point_count(grid, node):
     assert len(grid.get_points(False)) == 1 * (3 * 4)
 
 
+def test_grid_insert_cells(grid, node):
+    # the points are far enough from each other, in two cells alternately so that their capacity grows
+    # while the other cell is after them in the buffers
+    cell_xyz = np.array([[x / 100, 0, 0] for x in range(40)], dtype=np.float32)
+    points = np.empty((80, 3), dtype=np.float32)
+    points[0::2] = cell_xyz
+    points[1::2] = cell_xyz + 1.5
+    colors = np.arange(240, dtype=np.uint8).reshape((80, 3))
+    grid.spacing = 0.005 ** 2
+    for i in range(0, 80, 7):
+        assert len(grid.insert(node.aabb[0], node.inv_aabb_size, points[i:i + 7], colors[i:i + 7])[0]) == 0
+
+    assert grid.get_point_count() == 80
+    assert np.count_nonzero(grid.cell_counts) == 2
+    assert_array_equal(grid.get_points(True), np.concatenate((
+        np.concatenate((points[0::2], points[1::2])).view(np.uint8).ravel(),
+        np.concatenate((colors[0::2], colors[1::2])).ravel(),
+    )))
+
+    # the serialized grid is packed
+    state = grid.__getstate__()
+    assert len(state['cells_xyz']) == 80
+    loaded = pickle.loads(pickle.dumps(grid))
+    assert_array_equal(loaded.get_points(True), grid.get_points(True))
+    assert len(loaded.insert(node.aabb[0], node.inv_aabb_size, points[:1] + np.float32(0.5), colors[:1])[0]) == 0
+    assert loaded.get_point_count() == 81
+
+    # the points are kept by the balance
+    points_before = grid.get_points(True)
+    grid.balance(node.aabb_size, node.aabb[0], node.inv_aabb_size)
+    assert_array_equal(grid.cell_count, [4, 4, 4])
+    assert len(grid.cell_counts) == grid.max_key_value
+    assert grid.get_point_count() == 80
+    assert sorted(grid.get_points(False).view(np.float32).reshape((-1, 3)).tolist()) == \
+        sorted(points_before[:80 * 12].view(np.float32).reshape((-1, 3)).tolist())
+
+
+def test_grid_insert_reclaims_moved_cells(grid, node):
+    # the cells grow alternately, each growth moves a cell after the others
+    rng = np.random.default_rng(0)
+    points = (rng.random((20000, 3)) * 2).astype(np.float32)
+    colors = np.zeros((20000, 3), dtype=np.uint8)
+    grid.spacing = 1e-8
+    for i in range(0, 20000, 100):
+        assert len(grid.insert(node.aabb[0], node.inv_aabb_size, points[i:i + 100], colors[i:i + 100])[0]) == 0
+
+    # the buffers are reallocated without the space left by the moved cells
+    assert len(grid.cells_xyz) <= 2 * np.sum(grid.cell_capacities)
+    assert sorted(grid.get_points(False).view(np.float32).reshape((-1, 3)).tolist()) == sorted(points.tolist())
+
+
+def test_grid_insert_spacing(node):
+    # the voxels give the same points as a test against all the points of the cells
+    rng = np.random.default_rng(0)
+    grid = Grid(node)
+    grid.spacing = 0.05 ** 2
+    points = (rng.random((3000, 3)) * 2).astype(np.float32)
+    # points on the voxel boundaries, and duplicates
+    points[:500] = np.round(points[:500] / 0.05) * np.float32(0.05)
+    points[500:600] = points[:100]
+    colors = np.zeros((3000, 3), dtype=np.uint8)
+
+    keys = xyz_to_key(points, grid.cell_count, node.aabb[0], node.inv_aabb_size, 2)
+    cells = {}
+    expected = []
+    for point, key in zip(points, keys):
+        cell = cells.setdefault(key, np.zeros((0, 3), dtype=np.float32))
+        if len(cell) == 0 or is_point_far_enough(cell, point, grid.spacing):
+            cells[key] = np.concatenate((cell, point.reshape((1, 3))))
+        else:
+            expected.append(point)
+
+    remainder = np.concatenate([grid.insert(node.aabb[0], node.inv_aabb_size, points[i:i + 1000], colors[i:i + 1000])[0]
+                                for i in range(0, 3000, 1000)])
+    assert_array_equal(remainder, expected)
+
+
+def test_node_save_to_bytes(node):
+    rng = np.random.default_rng(0)
+    points = (rng.random((2000, 3)) * 2).astype(np.float32)
+    colors = rng.integers(0, 256, (2000, 3)).astype(np.uint8)
+
+    node.children = [b'noeud1', b'noeud6']
+    node.grid.insert(node.aabb[0], node.inv_aabb_size, points, colors)
+    leaf = Node(b'noeud12', node.aabb, node.spacing)
+    leaf.points = [(points[:10], colors[:10]), (points[10:30], colors[10:30])]
+    empty = Node(b'noeud13', node.aabb, node.spacing)
+    # the name of a deep node is longer than 255
+    deep = Node(b'1' * 300, node.aabb, node.spacing)
+    data = bytearray(node.save_to_bytes() + leaf.save_to_bytes() + empty.save_to_bytes() + deep.save_to_bytes())
+
+    records = list(split_nodes(data))
+    assert [record.name for record in records] == [b'noeud', b'noeud12', b'noeud13', b'1' * 300]
+    assert [record.children for record in records] == [[b'noeud1', b'noeud6'], None, None, None]
+    assert_array_equal(records[0].cell_counts, node.grid.cell_counts)
+    for record, saved in zip(records, [node, leaf]):
+        assert_array_equal(Node.get_points(record, True), Node.get_points(saved, True))
+        assert_array_equal(Node.get_points(record, False), Node.get_points(saved, False))
+    assert len(Node.get_points(records[2], True)) == 0
+
+    # the points of the loaded grid are read from the buffer, and can be updated
+    loaded = Node(b'noeud', node.aabb, node.spacing)
+    loaded.load_from_bytes(records[0].record)
+    assert np.shares_memory(loaded.grid.cells_xyz, np.frombuffer(data, dtype=np.uint8))
+    for n in [node, loaded]:
+        n.grid.insert(node.aabb[0], node.inv_aabb_size, points + np.float32(0.01), colors)
+    assert_array_equal(loaded.grid.get_points(True), node.grid.get_points(True))
+    assert loaded.children == node.children
+
+    loaded = Node(b'noeud12', node.aabb, node.spacing)
+    loaded.load_from_bytes(bytes(records[1].record))
+    assert_array_equal(Node.get_points(loaded, True), Node.get_points(leaf, True))
+
+    data[0] = 0
+    with pytest.raises(ValueError, match='Unsupported node version 0'):
+        next(split_nodes(data))
+
+
+def test_node_save_to_bytes_perf(node, benchmark):
+    rng = np.random.default_rng(0)
+    node.children = []
+    node.grid.insert(node.aabb[0], node.inv_aabb_size, (rng.random((100_000, 3)) * 2).astype(np.float32),
+                     np.zeros((100_000, 3), dtype=np.uint8))
+
+    def save_and_load():
+        loaded = Node(b'noeud', node.aabb, node.spacing)
+        loaded.load_from_bytes(bytearray(node.save_to_bytes()))
+        return loaded
+
+    assert benchmark(save_and_load).grid.get_point_count() == node.grid.get_point_count()
+
+
+def test_node_get_pending_points(node):
+    # the node of the fixture is an octree node, centered on (1, 1, 1)
+    node.children = [b'noeud7']
+    xyz = np.array([[0.5, 0.5, 0.5], [1.5, 0.5, 1], [1, 1, 1], [0.1, 0.2, 0.3], [1.5, 0.2, 1.5]], dtype=np.float32)
+    colors = np.arange(15, dtype=np.uint8).reshape((5, 3))
+    node.pending_xyz = [xyz[:3], xyz[3:]]
+    node.pending_rgb = [colors[:3], colors[3:]]
+
+    children = list(node._get_pending_points())
+    assert [name for name, _, _ in children] == [b'noeud0', b'noeud5', b'noeud7']
+    for (_, child_xyz, child_rgb), indices in zip(children, [[0, 3], [1, 4], [2]]):
+        assert_array_equal(child_xyz, xyz[indices])
+        assert_array_equal(child_rgb, colors[indices])
+    assert node.children == [b'noeud7', b'noeud0', b'noeud5']
+
+    # the children of a quadtree node are split along x and y only
+    quadtree_node = Node(b'1', np.array([[0, 0, 0], [100, 100, 1]]), 1)
+    quadtree_node.children = []
+    quadtree_node.pending_xyz = [np.array([[60, 10, 0.9], [10, 60, 0.1]], dtype=np.float32)]
+    quadtree_node.pending_rgb = [np.zeros((2, 3), dtype=np.uint8)]
+    assert [name for name, _, _ in quadtree_node._get_pending_points()] == [b'12', b'14']
+
+
 def test_is_point_far_enough():
     points = np.array(
         [
@@ -0,0 +1,57 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+from pyproj import Transformer
+from pytest import fixture, raises
+
+from py3dtiles import reprojection
+from py3dtiles.reprojection import InterpolatedTransformer
+
+
+@fixture
+def transformer():
+    return Transformer.from_crs(3950, 4978)
+
+
+@fixture
+def points():
+    # a square of 1 km, sorted along x like the points of a scan
+    rng = np.random.default_rng(0)
+    x = np.sort(rng.uniform(1_840_000, 1_841_000, 100_000))
+    y = rng.uniform(5_170_000, 5_171_000, 100_000)
+    z = rng.uniform(150, 300, 100_000)
+    return x, y, z
+
+
+def get_error(xyz, exact_xyz):
+    return np.max(np.linalg.norm(np.array(xyz) - np.array(exact_xyz), axis=0))
+
+
+def test_transform(transformer, points):
+    exact = transformer.transform(*points)
+    for max_error in [0.01, 0.001, 0.0001]:
+        assert get_error(InterpolatedTransformer(transformer, max_error).transform(*points), exact) <= max_error
+
+    # the points with the same z are in a flat bounding box
+    flat_points = (points[0], points[1], np.zeros_like(points[2]))
+    interpolated = InterpolatedTransformer(transformer, 0.001).transform(*flat_points)
+    assert get_error(interpolated, transformer.transform(*flat_points)) <= 0.001
+
+
+def test_transform_exact(transformer, points, monkeypatch):
+    # a few points
+    interpolated = InterpolatedTransformer(transformer, 0.001).transform(*[axis[:100] for axis in points])
+    assert_array_equal(interpolated, transformer.transform(*[axis[:100] for axis in points]))
+
+    # an error that can't be reached with a lattice
+    monkeypatch.setattr(reprojection, 'MAX_HORIZONTAL_CELL_COUNT', 16)
+    interpolated = InterpolatedTransformer(transformer, 1e-9).transform(*points)
+    assert_array_equal(interpolated, transformer.transform(*points))
+
+    with raises(ValueError, match="strictly positive"):
+        InterpolatedTransformer(transformer, 0)
+
+
+def test_transform_perf(transformer, points, benchmark):
+    interpolated_transformer = InterpolatedTransformer(transformer, 0.001)
+    xyz = benchmark(interpolated_transformer.transform, *points)
+    assert get_error(xyz, transformer.transform(*points)) <= 0.001
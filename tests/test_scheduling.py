@@ -0,0 +1,64 @@
+from py3dtiles.scheduling import JobSizeController, NodeNameTrie, NodeScheduler
+from py3dtiles.utils import CommandType
+
+
+def test_job_size_controller():
+    controller = JobSizeController(target_duration=1, read_count=1_000_000, process_count=100_000, smoothing=0.5)
+
+    controller.update(CommandType.PROCESS_JOBS.value, 100_000, 0.25)
+    assert controller.process_count == 400_000
+    controller.update(CommandType.PROCESS_JOBS.value, 400_000, 2)
+    assert controller.process_count == 300_000
+    # the sizes are bounded
+    for _ in range(10):
+        controller.update(CommandType.PROCESS_JOBS.value, 10, 100)
+    assert controller.process_count == 10_000
+
+    controller.update(CommandType.READ_FILE.value, 1_000_000, 0.01)
+    assert controller.read_count == 10_000_000
+    # the other jobs aren't measured
+    controller.update(CommandType.WRITE_PNTS.value, 1_000_000, 0.01)
+    assert controller.process_count == 10_000
+
+    # the few pending points are shared between the idle workers
+    assert controller.get_process_count(1_000_000, 4) == 10_000
+    assert controller.get_process_count(20_000, 4) == 5_001
+    assert controller.get_process_count(20_000, 1) == 10_000
+
+
+def test_node_scheduler():
+    scheduler = NodeScheduler()
+    scheduler.push(b'12', 10)
+    scheduler.push(b'3', 5)
+    scheduler.push(b'4', 50)
+    scheduler.push(b'10', 20)
+    scheduler.push(b'56', 30)
+    # update the point count
+    scheduler.push(b'3', 100)
+
+    assert len(scheduler) == 5
+    assert scheduler.pop() == b'3'
+    assert scheduler.pop() == b'4'
+    assert scheduler.pop() == b'56'
+    assert scheduler.pop_siblings(b'56') == []
+    assert scheduler.pop() == b'10'
+    assert scheduler.pop_siblings(b'10') == [b'12']
+    assert b'12' not in scheduler
+    assert len(scheduler) == 0
+    assert scheduler.pop() is None
+
+
+def test_node_name_trie():
+    trie = NodeNameTrie([b'1', b'12', b'123', b'1245', b'2'])
+    assert len(trie) == 5
+    assert b'12' in trie
+    assert b'124' not in trie
+    assert sorted(trie) == [b'1', b'12', b'123', b'1245', b'2']
+
+    assert trie.pop_descendants(b'3', lambda name: False) == []
+    assert sorted(trie.pop_descendants(b'12', lambda name: name == b'124')) == [b'12', b'123']
+    assert sorted(trie) == [b'1', b'1245', b'2']
+
+    trie.remove(b'1245')
+    assert sorted(trie) == [b'1', b'2']
+    assert trie.root[ord('1')] == {NodeNameTrie.END: True}
@@ -0,0 +1,160 @@
+import concurrent.futures
+
+import numpy as np
+from numpy.testing import assert_array_equal
+from pytest import mark
+
+from py3dtiles.tilers.node import Node
+from py3dtiles.tilers.node.sort_builder import (
+    build_tiles, CODE_DEPTH, get_code_range, get_tree_depth, merge_runs, reduce_runs, RUN_DTYPE, write_run,
+    xyz_to_codes
+)
+from py3dtiles.tileset.utils import TileContentReader
+from py3dtiles.utils import compute_spacing, encode_point_batch, node_name_to_path, ResponseType, split_aabb
+
+
+def make_points(aabb: np.ndarray, point_count: int, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    xyz = (aabb[0] + rng.random((point_count, 3)) * (aabb[1] - aabb[0])).astype(np.float32)
+    rgb = rng.integers(0, 256, (point_count, 3), dtype=np.uint8)
+    return xyz, rgb
+
+
+def make_reader(xyz: np.ndarray, rgb: np.ndarray, batch_size: int = 1000):
+    def read(queue):
+        for start in range(0, len(xyz), batch_size):
+            queue.send_multipart([ResponseType.NEW_TASK.value, b''] + encode_point_batch(
+                xyz[start:start + batch_size], rgb[start:start + batch_size]))
+        queue.send_multipart([ResponseType.READ.value])
+
+    return read
+
+
+def write_runs(tmp_path, aabb: np.ndarray, point_count: int, run_count: int) -> list:
+    paths = [tmp_path / f'{i}.npy' for i in range(run_count)]
+    for i, path in enumerate(paths):
+        write_run(make_reader(*make_points(aabb, point_count, seed=i)), aabb, CODE_DEPTH, path)
+    return paths
+
+
+@mark.parametrize('aabb', [[[0, 0, 0], [100, 100, 100]], [[-5, 10, 0], [995, 710, 20]]])
+def test_xyz_to_codes(aabb):
+    # the codes follow the partition of the points of the nodes by child, in cubic and flat nodes
+    aabb = np.array(aabb, dtype=np.float64)
+    xyz, rgb = make_points(aabb, 10_000)
+    xyz[:10] = aabb[0]
+    xyz[10:20] = aabb[1]
+    xyz[20:30] = (aabb[0] + aabb[1]) / 2
+    codes = xyz_to_codes(xyz, aabb, CODE_DEPTH)
+
+    def check_node(name, node_aabb, indices):
+        start, end = get_code_range(name)
+        assert np.all((codes[indices] >= start) & (codes[indices] < end))
+        if len(name) == 4:
+            return
+        node = Node(name, node_aabb, 1.0)
+        node.children = []
+        node.pending_xyz = [xyz[indices]]
+        node.pending_rgb = [rgb[indices]]
+        children = list(node._get_pending_points())
+        for child_name, child_xyz, _ in children:
+            child_indices = indices[(codes[indices] >= get_code_range(child_name)[0])
+                                    & (codes[indices] < get_code_range(child_name)[1])]
+            assert_array_equal(xyz[child_indices], child_xyz)
+            check_node(child_name, split_aabb(node_aabb, int(child_name[-1:])), child_indices)
+
+    check_node(b'', aabb, np.arange(len(xyz)))
+
+
+def test_get_code_range():
+    assert get_code_range(b'') == (0, 1 << 63)
+    assert get_code_range(b'7') == (7 << 60, 1 << 63)
+    assert get_code_range(b'05') == (5 << 57, 6 << 57)
+
+
+def test_get_tree_depth():
+    # the nodes with a spacing of 1 mm or less, in the scaled coordinates, are leaves
+    assert get_tree_depth(1.0, 1.0) == 10
+    assert get_tree_depth(1.0, 0.01) == 17
+    assert get_tree_depth(1.0, 100.0) == 4
+    assert get_tree_depth(0.001, 1.0) == 1
+    assert get_tree_depth(1e9, 1.0) == CODE_DEPTH
+
+    xyz, _ = make_points(np.array([[0, 0, 0], [10, 10, 10]], dtype=np.float64), 100)
+    codes = xyz_to_codes(xyz, np.array([[0, 0, 0], [10, 10, 10]], dtype=np.float64), 3)
+    assert_array_equal(codes >> (3 * (CODE_DEPTH - 3)) << (3 * (CODE_DEPTH - 3)), codes)
+
+
+def test_merge_runs(tmp_path):
+    aabb = np.array([[0, 0, 0], [10, 10, 10]], dtype=np.float64)
+    paths = write_runs(tmp_path, aabb, 5000, 3)
+    # the points of the same code keep the order of their runs
+    duplicated = np.concatenate((np.load(paths[0])[:100], np.load(paths[2])))
+    duplicated['rgb'][:100] = 0
+    np.save(paths[2], duplicated[np.argsort(duplicated['code'], kind='stable')])
+    runs = np.concatenate([np.load(path) for path in paths])
+    expected = runs[np.argsort(runs['code'], kind='stable')]
+
+    merged = list(merge_runs(paths, block_size=1000))
+    assert all(block.dtype == RUN_DTYPE for block in merged)
+    assert_array_equal(np.concatenate(merged), expected)
+
+    start, end = get_code_range(b'3')
+    merged = np.concatenate(list(merge_runs(paths, start, end, block_size=700)))
+    assert_array_equal(merged, expected[(expected['code'] >= start) & (expected['code'] < end)])
+
+    with concurrent.futures.ThreadPoolExecutor(1) as executor:
+        reduced = reduce_runs(executor, paths, tmp_path, max_merged_runs=2)
+    assert reduced == [tmp_path / 'merged-0-0.npy', paths[2]]
+    assert not paths[0].exists()
+    assert_array_equal(np.concatenate(list(merge_runs(reduced))), expected)
+
+
+def test_merge_runs_equal_codes(tmp_path):
+    # the points of the same code straddle the blocks, they stay in the order of the runs
+    paths = []
+    for i, codes in enumerate([[5] * 10, [1] + [5] * 9, [5] * 3 + [7] * 7]):
+        run = np.zeros(len(codes), dtype=RUN_DTYPE)
+        run['code'] = codes
+        run['rgb'][:, 0] = i
+        run['rgb'][:, 1] = np.arange(len(codes))
+        paths.append(tmp_path / f'{i}.npy')
+        np.save(paths[-1], run)
+    runs = np.concatenate([np.load(path) for path in paths])
+    expected = runs[np.argsort(runs['code'], kind='stable')]
+
+    for block_size in [1, 3, 4, 100]:
+        assert_array_equal(np.concatenate(list(merge_runs(paths, block_size=block_size))), expected)
+
+
+@mark.parametrize('subtree_point_count', [10_000, 1_000_000])
+def test_build_tiles(tmp_path, subtree_point_count):
+    aabb = np.array([[0, 0, 0], [10, 10, 10]], dtype=np.float64)
+    runs_dir = tmp_path / 'runs'
+    runs_dir.mkdir()
+    paths = write_runs(runs_dir, aabb, 100_000, 2)
+    out = tmp_path / 'out'
+    out.mkdir()
+
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        point_count = build_tiles(executor, paths, aabb, compute_spacing(aabb), CODE_DEPTH, out, True,
+                                  subtree_point_count)
+    assert point_count == 200_000
+
+    # every point is in the pnts of a node containing it, and the parents of a pnts have a pnts
+    pnts_count = 0
+    names = set()
+    for path in out.rglob('*.pnts'):
+        name = ''.join(path.relative_to(out).parent.parts + (path.stem[1:],)).encode('ascii')
+        node_aabb = aabb
+        for depth in range(1, len(name) + 1):
+            node_aabb = split_aabb(node_aabb, int(name[depth - 1:depth]))
+            assert node_name_to_path(out, name[:depth], '.pnts').exists()
+
+        tile = TileContentReader.read_file(path)
+        xyz = tile.body.feature_table.body.positions_arr.view(np.float32).reshape((-1, 3))
+        assert np.all((xyz >= node_aabb[0].astype(np.float32)) & (xyz <= node_aabb[1].astype(np.float32)))
+        pnts_count += len(xyz)
+        names.add(name)
+    assert pnts_count == 200_000
+    assert b'00' in names
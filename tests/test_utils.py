@@ -0,0 +1,125 @@
+import json
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+import subprocess
+import sys
+import time
+
+import numpy as np
+from numpy.testing import assert_array_equal
+from pytest import mark, raises
+
+from py3dtiles.utils import (
+    decode_point_batch, encode_point_batch, get_point_batch_count, is_shared_point_batch, POINT_BATCH_FRAME_COUNT,
+    POINT_BATCH_HEADER, release_point_batch, share_point_batch, TraceWriter
+)
+
+
+def test_point_batch_round_trip():
+    xyz = np.arange(30, dtype=np.float32).reshape((10, 3))
+    rgb = np.arange(30, dtype=np.uint8).reshape((10, 3))
+
+    frames = encode_point_batch(xyz, rgb)
+    assert len(frames) == POINT_BATCH_FRAME_COUNT
+    assert get_point_batch_count(frames[0]) == 10
+
+    # simulate the transport
+    decoded_xyz, decoded_rgb = decode_point_batch([bytes(frame) for frame in frames])
+    assert_array_equal(decoded_xyz, xyz)
+    assert_array_equal(decoded_rgb, rgb)
+
+
+def test_point_batch_empty():
+    frames = encode_point_batch(np.zeros((0, 3), dtype=np.float32), np.zeros((0, 3), dtype=np.uint8))
+    xyz, rgb = decode_point_batch([bytes(frame) for frame in frames])
+    assert xyz.shape == (0, 3)
+    assert rgb.shape == (0, 3)
+
+
+def test_point_batch_errors():
+    with raises(ValueError, match='same length'):
+        encode_point_batch(np.zeros((2, 3), dtype=np.float32), np.zeros((1, 3), dtype=np.uint8))
+
+    with raises(ValueError, match='Unsupported point batch version'):
+        get_point_batch_count(POINT_BATCH_HEADER.pack(255, 1))
+
+
+def test_shared_point_batch():
+    xyz = np.arange(30, dtype=np.float32).reshape((10, 3))
+    rgb = np.arange(30, dtype=np.uint8).reshape((10, 3))
+
+    frames = share_point_batch(encode_point_batch(xyz, rgb))
+    assert len(frames) == POINT_BATCH_FRAME_COUNT
+    assert is_shared_point_batch(frames)
+    assert get_point_batch_count(frames[0]) == 10
+    # only the handle of the points is sent
+    assert len(frames[1]) < xyz.nbytes
+    segment_name = frames[1].decode('ascii')
+
+    # the segment is kept until the batch is decoded
+    decoded_xyz, decoded_rgb = decode_point_batch(frames, release=False)
+    assert_array_equal(decoded_xyz, xyz)
+    assert_array_equal(decoded_rgb, rgb)
+
+    decoded_xyz, decoded_rgb = decode_point_batch(frames)
+    assert_array_equal(decoded_xyz, xyz)
+    assert_array_equal(decoded_rgb, rgb)
+    with raises(FileNotFoundError):
+        SharedMemory(name=segment_name)
+
+
+@mark.skipif(not Path('/dev/shm').exists(), reason="The shared memory segments are listed in /dev/shm")
+def test_shared_point_batch_killed_process():
+    # the segments of a killed process are unlinked by its resource tracker
+    code = (
+        'import os, signal, sys\n'
+        'import numpy as np\n'
+        'from py3dtiles.utils import encode_point_batch, share_point_batch\n'
+        'frames = share_point_batch(encode_point_batch(np.zeros((2, 3), np.float32), np.zeros((2, 3), np.uint8)))\n'
+        'print(frames[1].decode("ascii"), flush=True)\n'
+        'os.kill(os.getpid(), signal.SIGKILL)\n'
+    )
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    segment_name = result.stdout.strip()
+    assert segment_name
+
+    # the tracker unlinks the segment when it sees that the process is gone
+    for _ in range(100):
+        if not Path('/dev/shm', segment_name).exists():
+            break
+        time.sleep(0.1)
+    else:
+        raise AssertionError(f'The segment {segment_name} was not unlinked')
+
+
+def test_release_shared_point_batch():
+    frames = encode_point_batch(np.zeros((2, 3), dtype=np.float32), np.zeros((2, 3), dtype=np.uint8))
+    assert not is_shared_point_batch(frames)
+    # nothing to release
+    release_point_batch(frames)
+
+    frames = share_point_batch(frames)
+    release_point_batch(frames)
+    with raises(FileNotFoundError):
+        SharedMemory(name=frames[1].decode('ascii'))
+    # already released
+    release_point_batch(frames)
+
+
+def test_trace_writer(tmp_path):
+    trace_path = tmp_path / 'trace.json'
+    writer = TraceWriter(trace_path, origin=100)
+    writer.add_process_name(1, 'manager')
+    writer.add_span('read_file', 'job', 100.5, 0.25, 1, {'points': 10})
+    writer.add_counters('progress', 101, 1, {'percent': 50})
+    writer.close()
+
+    with trace_path.open() as f:
+        events = json.load(f)
+
+    assert events[0] == {'name': 'process_name', 'ph': 'M', 'pid': 1, 'args': {'name': 'manager'}}
+    assert events[1] == {
+        'name': 'read_file', 'cat': 'job', 'ph': 'X', 'pid': 1, 'tid': 1,
+        'ts': 500_000, 'dur': 250_000, 'args': {'points': 10},
+    }
+    assert events[2] == {'name': 'progress', 'ph': 'C', 'pid': 1, 'ts': 1_000_000, 'args': {'percent': 50}}
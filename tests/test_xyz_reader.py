@@ -0,0 +1,174 @@
+import io
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+from pytest import fixture, raises
+
+from py3dtiles.reader import xyz_reader
+from py3dtiles.reader.xyz_reader import get_metadata, parse_lines, read_blocks, read_points, split_in_ranges
+from .utils import read_batches
+
+
+@fixture
+def xyz_path(tmp_path):
+    rng = np.random.default_rng(0)
+    points = np.round(rng.random((1000, 3)) * 1000, 3)
+    colors = rng.integers(0, 256, (1000, 3))
+    path = tmp_path / 'points.xyz'
+    with path.open('w') as f:
+        for (x, y, z), (r, g, b) in zip(points, colors):
+            f.write(f'{x} {y} {z} {r} {g} {b}\n')
+    return path
+
+
+def test_parse_lines():
+    points, line_starts = parse_lines(b'1 2 3\n4 5 6\n')
+    assert_array_equal(points, [[1, 2, 3, 0, 0, 0, 0], [4, 5, 6, 0, 0, 0, 0]])
+    assert_array_equal(line_starts, [0, 6])
+    # without line end at the end of the file, and with empty lines
+    points, line_starts = parse_lines(b'1 2 3 4\r\n\n5.5  -6\t7e2 +8')
+    assert_array_equal(points, [[1, 2, 3, 4, 0, 0, 0], [5.5, -6, 700, 8, 0, 0, 0]])
+    assert_array_equal(line_starts, [0, 10])
+    assert parse_lines(b'')[0].shape == (0, 7)
+
+
+def test_parse_lines_values():
+    values = ['0', '-0.5', '123456.789', '1234567.125', '0.001', '1e-3', '2.5E+10', '.5', '5.', '-1.7976931348623157e308',
+              '0.30000000000000004', '4294967295', '00012.34000', '1234567890123456789012', '1.00000000000000000000001', '9007199254740993', '1e-30']
+    points, _ = parse_lines('\n'.join(f'{value} 0 0' for value in values).encode())
+    assert points[:, 0].tolist() == [float(value) for value in values]
+
+
+def test_parse_lines_mixed_layouts():
+    block = b'1 2 3\n1 2 3 4\n1 2 3 10 20 30\n1 2 3 4 10 20 30\n1 2 3\n'
+    assert_array_equal(parse_lines(block)[0], [
+        [1, 2, 3, 0, 0, 0, 0],
+        [1, 2, 3, 4, 0, 0, 0],
+        [1, 2, 3, 0, 10, 20, 30],
+        [1, 2, 3, 4, 10, 20, 30],
+        [1, 2, 3, 0, 0, 0, 0],
+    ])
+
+
+def test_parse_lines_errors():
+    with raises(ValueError, match="Invalid xyz line b'1 2 3 4 5'.*3, 4, 6 or 7 numbers"):
+        parse_lines(b'1 2 3\n1 2 3 4 5\n')
+    for line in [b'1 2 a', b'1 2 3a', b'1 2 -', b'1 2 3e', b'1 2 3 4 5 6 7 8', b'1,2,3']:
+        with raises(ValueError, match='Invalid xyz line'):
+            parse_lines(line)
+
+
+def test_read_blocks():
+    data = b'1 2 3\n4 5 6\n7 8 9'
+    blocks = list(read_blocks(io.BytesIO(data), block_size=8))
+    assert blocks == [(0, b'1 2 3\n'), (6, b'4 5 6\n'), (12, b'7 8 9')]
+
+    # a line longer than a block
+    assert list(read_blocks(io.BytesIO(data), block_size=2)) == blocks
+
+    f = io.BytesIO(data)
+    f.seek(6)
+    assert list(read_blocks(f, block_size=4, size=6)) == [(6, b'4 5 6\n')]
+
+
+def test_read_points():
+    data = b''.join(f'{i} 0 0\n'.encode() for i in range(10))
+    batches = list(read_points(io.BytesIO(data), 7, 3))
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert_array_equal(np.concatenate(batches)[:, 0], np.arange(7))
+
+
+def test_get_metadata(xyz_path, monkeypatch):
+    monkeypatch.setattr(xyz_reader, 'POINTS_PER_PORTION', 300)
+    monkeypatch.setattr(xyz_reader, 'BLOCK_SIZE', 1000)
+
+    metadata = get_metadata(xyz_path)
+    points = np.loadtxt(xyz_path)
+    assert metadata['point_count'] == 1000
+    assert_array_equal(metadata['aabb'], [points[:, :3].min(axis=0), points[:, :3].max(axis=0)])
+
+    lines = xyz_path.read_bytes().splitlines(keepends=True)
+    line_offsets = np.cumsum([0] + [len(line) for line in lines])
+    assert [portion for _, portion in metadata['portions']] == [
+        (0, 300, line_offsets[0]), (300, 600, line_offsets[300]),
+        (600, 900, line_offsets[600]), (900, 1000, line_offsets[900]),
+    ]
+
+
+def test_split_in_ranges(xyz_path):
+    data = xyz_path.read_bytes()
+    ranges = split_in_ranges(xyz_path, 7)
+    assert len(ranges) == 7
+    assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+    for (_, end), (start, _) in zip(ranges, ranges[1:]):
+        assert end == start and data[start - 1:start] == b'\n'
+
+    # more ranges than lines
+    assert split_in_ranges(xyz_path, 5000) == [(offset, offset + len(line)) for offset, line in zip(
+        np.cumsum([0] + [len(line) for line in data.splitlines(keepends=True)]).tolist(),
+        data.splitlines(keepends=True)
+    )]
+
+
+def test_get_metadata_ranges(xyz_path, monkeypatch):
+    monkeypatch.setattr(xyz_reader, 'POINTS_PER_PORTION', 300)
+    monkeypatch.setattr(xyz_reader, 'MIN_RANGE_SIZE', 1000)
+
+    metadata = get_metadata(xyz_path)
+    parallel_metadata = get_metadata(xyz_path, jobs=2)
+    assert parallel_metadata['point_count'] == 1000
+    assert_array_equal(parallel_metadata['aabb'], metadata['aabb'])
+
+    # the portions cover all the points, each range ends with a smaller portion
+    portions = [portion for _, portion in parallel_metadata['portions']]
+    assert len(portions) > len(metadata['portions'])
+    assert portions[0][0] == 0 and portions[-1][1] == 1000
+    assert all(end == start for (_, end, _), (start, _, _) in zip(portions, portions[1:]))
+
+    lines = xyz_path.read_bytes().splitlines(keepends=True)
+    line_offsets = np.cumsum([0] + [len(line) for line in lines])
+    assert all(line_offsets[start] == offset for start, _, offset in portions)
+
+
+def test_get_metadata_cache(xyz_path, tmp_path, monkeypatch):
+    cache_dir = tmp_path / 'cache'
+    metadata = get_metadata(xyz_path, cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 1
+
+    def scan(*args):
+        raise AssertionError("the scan should be cached")
+
+    with monkeypatch.context() as m:
+        m.setattr(xyz_reader, 'scan', scan)
+        cached_metadata = get_metadata(xyz_path, color_scale=2, cache_dir=cache_dir)
+    assert cached_metadata['point_count'] == metadata['point_count']
+    assert cached_metadata['portions'] == metadata['portions']
+    assert cached_metadata['color_scale'] == 2
+    assert_array_equal(cached_metadata['aabb'], metadata['aabb'])
+
+    # the file is scanned again once modified
+    with xyz_path.open('a') as f:
+        f.write('5000 5000 5000 0 0 0\n')
+    assert get_metadata(xyz_path, cache_dir=cache_dir)['point_count'] == 1001
+
+
+def test_run(xyz_path):
+    metadata = get_metadata(xyz_path)
+    offset_scale = (-metadata['avg_min'], np.array([1, 1, 1]), None, None)
+    batches = read_batches(xyz_reader, xyz_path, offset_scale, metadata['portions'][0][1], batch_size=300)
+    assert [len(xyz) for xyz, _ in batches] == [300, 300, 300, 100]
+
+    points = np.loadtxt(xyz_path)
+    xyz = np.concatenate([xyz for xyz, _ in batches])
+    rgb = np.concatenate([rgb for _, rgb in batches])
+    assert_allclose(xyz, points[:, :3] - metadata['avg_min'], atol=1e-4)
+    assert_array_equal(rgb, points[:, 3:].astype(np.uint8))
+
+
+def test_parse_lines_perf(benchmark):
+    rng = np.random.default_rng(0)
+    lines = [f'{x:.3f} {y:.3f} {z:.3f} 10 20 30\n' for x, y, z in rng.random((100_000, 3)) * 1000]
+    block = ''.join(lines).encode()
+
+    points, _ = benchmark(parse_lines, block)
+    assert points.shape == (100_000, 7)
@@ -0,0 +1,140 @@
+"""
+Helpers shared by the test modules, e.g. to write point cloud files.
+"""
+from pathlib import Path
+import struct
+
+import laspy
+import numpy as np
+
+from py3dtiles.reader.copc_reader import HIERARCHY_ENTRY_DTYPE
+from py3dtiles.utils import decode_point_batch, ResponseType
+
+NPY_POINT_DTYPE = np.dtype([('x', '<f8'), ('y', '<f8'), ('z', '<f4'), ('red', 'u2'), ('green', 'u2'), ('blue', 'u2')])
+
+COPC_INFO_FORMAT = '<5d2Q2d11Q'
+# the COPC info VLR written before the hierarchy pages, replaced once their offset is known
+COPC_INFO_PLACEHOLDER = struct.pack(COPC_INFO_FORMAT, *range(1, 21))
+
+# (level, x, y, z), point count and rank of the chunk in the file
+NODES = [
+    ((0, 0, 0, 0), 100, 3),
+    ((1, 1, 0, 0), 40, 0),
+    ((1, 0, 0, 0), 30, 5),
+    ((2, 2, 1, 0), 10, 1),
+    ((2, 0, 0, 0), 20, 4),
+    ((2, 1, 1, 1), 5, 2),
+]
+
+
+def make_entries(nodes, offsets) -> np.ndarray:
+    entries = np.zeros(len(nodes), dtype=HIERARCHY_ENTRY_DTYPE)
+    for entry, ((level, x, y, z), point_count, _), offset in zip(entries, nodes, offsets):
+        entry['level'], entry['x'], entry['y'], entry['z'] = level, x, y, z
+        entry['offset'] = offset
+        entry['byte_size'] = point_count * 10
+        entry['point_count'] = point_count
+    return entries
+
+
+def write_copc(path: Path, nodes) -> laspy.LasData:
+    """
+    Write an uncompressed las file with a COPC hierarchy. The chunks of the nodes are
+    ordered by their rank, the nodes of the level 2 are in a child hierarchy page.
+    """
+    point_count = sum(count for _, count, _ in nodes)
+    rng = np.random.default_rng(0)
+    header = laspy.LasHeader(point_format=7, version='1.4')
+    header.scales = [0.01, 0.01, 0.01]
+    header.vlrs.append(laspy.VLR('copc', 1, record_data=COPC_INFO_PLACEHOLDER))
+    las = laspy.LasData(header)
+    las.x, las.y, las.z = rng.random((3, point_count)) * 100
+    las.red, las.green, las.blue = rng.integers(0, 256, (3, point_count))
+    with path.open('wb') as f:
+        las.write(f, do_compress=False)
+
+    offsets = [1000 + rank * 100 for _, _, rank in nodes]
+    root_nodes = [node for node in nodes if node[0][0] < 2]
+    child_nodes = [node for node in nodes if node[0][0] == 2]
+    data = path.read_bytes()
+    child_page = make_entries(child_nodes, [o for node, o in zip(nodes, offsets) if node[0][0] == 2]).tobytes()
+    child_page_entry = np.zeros(1, dtype=HIERARCHY_ENTRY_DTYPE)
+    child_page_entry['level'] = 1
+    child_page_entry['offset'] = len(data)
+    child_page_entry['byte_size'] = len(child_page)
+    child_page_entry['point_count'] = -1
+    root_page = make_entries(root_nodes, [o for node, o in zip(nodes, offsets) if node[0][0] < 2]).tobytes()
+    root_page += child_page_entry.tobytes()
+
+    copc_info = struct.pack(COPC_INFO_FORMAT, 50, 50, 50, 50, 1, len(data) + len(child_page), len(root_page),
+                            *[0] * 13)
+    data = data.replace(COPC_INFO_PLACEHOLDER, copc_info)
+    path.write_bytes(data + child_page + root_page)
+    return las
+
+
+def make_npy_points(point_count: int, dtype: np.dtype = NPY_POINT_DTYPE) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    points = np.zeros(point_count, dtype=dtype)
+    for axis in ['x', 'y', 'z']:
+        points[axis] = rng.random(point_count) * 1000
+    for field in set(dtype.names) - {'x', 'y', 'z'}:
+        points[field] = rng.integers(0, 256, point_count)
+    return points
+
+
+def write_ply(path: Path, point_count: int, byte_order: str = '<', before_vertices: str = '') -> np.ndarray:
+    """
+    Write a binary PLY file with colored vertices, followed by faces.
+    """
+    rng = np.random.default_rng(0)
+    dtype = np.dtype([('x', byte_order + 'f4'), ('y', byte_order + 'f4'), ('z', byte_order + 'f4'),
+                      ('red', 'u1'), ('green', 'u1'), ('blue', 'u1'), ('nx', byte_order + 'f4')])
+    points = np.zeros(point_count, dtype=dtype)
+    for axis in ['x', 'y', 'z']:
+        points[axis] = rng.random(point_count) * 100
+    for field in ['red', 'green', 'blue']:
+        points[field] = rng.integers(0, 256, point_count)
+
+    format_name = 'binary_little_endian' if byte_order == '<' else 'binary_big_endian'
+    header = (
+        f'ply\nformat {format_name} 1.0\ncomment written by a test\n{before_vertices}'
+        f'element vertex {point_count}\n'
+        'property float x\nproperty float y\nproperty float z\n'
+        'property uchar red\nproperty uchar green\nproperty uchar blue\nproperty float32 nx\n'
+        'element face 1\nproperty list uchar int vertex_indices\nend_header\n'
+    )
+    with path.open('wb') as f:
+        f.write(header.encode())
+        if before_vertices:
+            f.write(b'\x00' * 8)
+        f.write(points.tobytes())
+        f.write(np.array([3], dtype='u1').tobytes() + np.array([0, 1, 2], dtype=byte_order + 'i4').tobytes())
+    return points
+
+
+class PointQueue:
+    """
+    Collect the messages sent by a reader, in place of the socket of a worker.
+    """
+    def __init__(self):
+        self.messages = []
+
+    def send_multipart(self, frames, copy=True):
+        self.messages.append(frames)
+
+    def get_batches(self) -> list:
+        """
+        Decode the point batches of a finished reading.
+        """
+        assert self.messages[-1] == [ResponseType.READ.value]
+        return [decode_point_batch(message[2:]) for message in self.messages[:-1]]
+
+
+def read_batches(reader, path: Path, offset_scale, portion, batch_size: int) -> list:
+    """
+    Read a portion of a file with the run function of a reader, and get its point batches.
+    """
+    queue = PointQueue()
+    reader.run(str(path), offset_scale, portion, queue, None, batch_size=batch_size)
+    return queue.get_batches()